@@ -11,6 +11,16 @@ class Settings:
     MONGODB_URI = os.getenv("MONGODB_URI")
     DATABASE_NAME = os.getenv("DATABASE_NAME", "studysync")
     COLLECTION_NAME = os.getenv("COLLECTION_NAME", "users")
+    UPDATED_AT_FIELD = os.getenv("UPDATED_AT_FIELD", "updatedAt")  # timestamp de última edición (deltas)
+    MONGO_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", 2000))  # documentos por lote del cursor al entrenar
+    # Cliente único por proceso (Motor + pymongo comparten el pool)
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 10000))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 60000))  # 0 = sin límite
+    # primary | primaryPreferred | secondary | secondaryPreferred | nearest
+    MONGO_TRAINING_READ_PREFERENCE = os.getenv("MONGO_TRAINING_READ_PREFERENCE", "primary")
 
     # 🚀 API
     API_TITLE = "Academic Match ML Service"
@@ -38,7 +48,42 @@ class Settings:
     OPTIMAL_K_NEIGHBORS = int(os.getenv("OPTIMAL_K_NEIGHBORS", 3))
     MAX_K_NEIGHBORS = int(os.getenv("MAX_K_NEIGHBORS", 10))
     KNN_METRIC = os.getenv("KNN_METRIC", "cosine")
-    KNN_ALGORITHM = os.getenv("KNN_ALGORITHM", "brute")
+    KNN_ALGORITHM = os.getenv("KNN_ALGORITHM", "brute")  # brute (exacto), lsh (aproximado, coseno) o los de sklearn
+    MAX_SEARCH_NEIGHBORS = int(os.getenv("MAX_SEARCH_NEIGHBORS", 5000))  # k máximo al expandir (acota páginas profundas)
+    SEARCH_MIN_NEIGHBORS = int(os.getenv("SEARCH_MIN_NEIGHBORS", 20))  # k mínimo de la primera búsqueda
+    SEARCH_GROWTH_FACTOR = float(os.getenv("SEARCH_GROWTH_FACTOR", 2.0))  # multiplica k mientras la página quede corta
+    SEARCH_MIN_PASS_RATE = float(os.getenv("SEARCH_MIN_PASS_RATE", 0.05))  # piso de la tasa de paso estimada
+    SEMESTER_PARTITIONS = os.getenv("SEMESTER_PARTITIONS", "true").lower() == "true"  # buscar solo entre semestres compatibles
+
+    # 🎲 Backend LSH (KNN_ALGORITHM=lsh), experimental: en bench_ann recién supera a brute
+    # desde ~100k usuarios (recall@100 ~0.97, x1.2-1.3); con menos usuarios conviene brute
+    LSH_TABLES = int(os.getenv("LSH_TABLES", 32))  # construcción: más tablas → más recall y memoria (16 bytes × fila × tabla)
+    LSH_BITS = int(os.getenv("LSH_BITS", 12))  # construcción: bits por tabla, más bits → buckets más chicos
+    LSH_SEED = int(os.getenv("LSH_SEED", 42))  # hiperplanos: igual en todos los workers
+    LSH_PROBE_RADIUS = int(os.getenv("LSH_PROBE_RADIUS", 1))  # consulta: buckets a distancia Hamming <= radio
+    LSH_QUERY_TABLES = int(os.getenv("LSH_QUERY_TABLES", 0))  # consulta: tablas a revisar (0 = todas)
+
+    # 📋 Tabla de vecinos precomputada al entrenar (una consulta fría = slice + filtros)
+    # Los usuarios cambiados o agregados por upserts se puntúan en cada lectura hasta el próximo entrenamiento
+    PRECOMPUTE_NEIGHBORS = os.getenv("PRECOMPUTE_NEIGHBORS", "false").lower() == "true"  # ~8 bytes × usuarios × NEIGHBOR_TABLE_SIZE
+    NEIGHBOR_TABLE_SIZE = int(os.getenv("NEIGHBOR_TABLE_SIZE", 100))  # vecinos por fila; más profundo se busca en línea
+    NEIGHBOR_TABLE_CHUNK_ROWS = int(os.getenv("NEIGHBOR_TABLE_CHUNK_ROWS", 256))  # filas por bloque: acota el pico de memoria
+    NEIGHBOR_TABLE_WORKERS = int(os.getenv("NEIGHBOR_TABLE_WORKERS", os.cpu_count() or 1))  # hilos que construyen la tabla
+
+    # 🔄 Actualización incremental
+    VOCAB_DRIFT_THRESHOLD = float(os.getenv("VOCAB_DRIFT_THRESHOLD", 0.10))  # tokens nuevos sobre la referencia
+    VOCAB_DRIFT_MIN_TOKENS = int(os.getenv("VOCAB_DRIFT_MIN_TOKENS", 50))
+    FULL_RETRAIN_INTERVAL_MINUTES = int(os.getenv("FULL_RETRAIN_INTERVAL_MINUTES", 360))  # 0 = desactivado
+    DELTA_MAX_FRACTION = float(os.getenv("DELTA_MAX_FRACTION", 0.20))  # más cambios que esto → re-entrenamiento completo
+    CHANGE_STREAM_ENABLED = os.getenv("CHANGE_STREAM_ENABLED", "false").lower() == "true"  # requiere replica set
+
+    # 💾 Snapshots en disco (arranque en caliente)
+    SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "")  # vacío = no persistir
+    SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", 3))  # snapshots conservados
+    SNAPSHOT_MAX_DELTAS = int(os.getenv("SNAPSHOT_MAX_DELTAS", 100))  # deltas sobre un snapshot antes de reescribirlo completo
+    # Varios workers: un entrenador escribe snapshots y los readers los mapean (np.memmap)
+    SNAPSHOT_ROLE = os.getenv("SNAPSHOT_ROLE", "standalone")  # standalone | trainer | reader | auto
+    SNAPSHOT_POLL_SECONDS = float(os.getenv("SNAPSHOT_POLL_SECONDS", 5))  # revisión de CURRENT / upserts pendientes
 
     # 📊 Filtros
     MAX_SEMESTER_DIFFERENCE = int(os.getenv("MAX_SEMESTER_DIFFERENCE", 1))
@@ -47,9 +92,25 @@ class Settings:
 
     # 🔁 Recomendaciones
     DEFAULT_RECOMMENDATION_LIMIT = int(os.getenv("DEFAULT_RECOMMENDATION_LIMIT", 10))
+    MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 500))  # usuarios por /recommendations/batch
+
+    # 🧵 Concurrencia (trabajo de CPU fuera del event loop)
+    MATCHER_MAX_WORKERS = int(os.getenv("MATCHER_MAX_WORKERS", 4))  # recomendaciones/upserts en paralelo
+    TRAINING_MAX_WORKERS = int(os.getenv("TRAINING_MAX_WORKERS", 1))  # entrenamientos en paralelo
+
+    # 🗃️ Cache de recomendaciones
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+    CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 256 * 1024 * 1024))
+    CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", 0))  # 0 = sin expiración
+
+    # 📝 Logging
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))  # fracción de registros por request
 
     # 📍 Coordenadas por defecto
     DEFAULT_COORDINATES = [-77.0428, -12.0464]
+    DISTANCE_BACKEND = os.getenv("DISTANCE_BACKEND", "haversine")  # haversine | geodesic (requiere geopy)
 
     # 📈 Métricas de validación
     MIN_ACCURACY_THRESHOLD = float(os.getenv("MIN_ACCURACY_THRESHOLD", 0.80))
@@ -1,19 +1,31 @@
 from fastapi import FastAPI, BackgroundTasks, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from datetime import datetime
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import asyncio
+import logging
 from threading import Lock
 
 import pandas as pd
 
 from .models.matcher import AcademicMatcher
+from .models.persistence import acquire_trainer_lock, drain_upserts, enqueue_upsert
 from .models.schemas import (
     CacheClearRequest, CacheClearResponse, RecommendationRequest, RecommendationResponse, 
-    HealthResponse, ModelStatsResponse, PaginationMetadata
+    HealthResponse, ModelStatsResponse, PaginationMetadata, UserUpdatedWebhook,
+    BatchRecommendationRequest, BatchRecommendationResponse, BatchRecommendationResult, SearchMetadata
 )
 from .config.settings import settings
-from .utils.database import DatabaseManager
+from .utils.change_stream import UserChangeStream
+from .utils.database import close_client
+from .utils.logger import configure_logging
+from .utils.metrics import REGISTRY, REQUEST_STAGE_SECONDS, CallbackGauge
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title=settings.API_TITLE,
@@ -33,16 +45,204 @@ matcher = AcademicMatcher()
 needs_retraining = False
 is_retraining = False
 retrain_lock = Lock()
+snapshot_role = "standalone"  # se resuelve en startup (ver resolve_snapshot_role)
+change_stream: Optional[UserChangeStream] = None
+
+def _snapshot_metric(read):
+    """Gauge sobre el snapshot publicado (sin muestra si no hay modelo)"""
+    def callback():
+        snapshot = matcher.snapshot
+        return read(snapshot) if snapshot is not None else None
+    return callback
+
+CallbackGauge("academic_match_cache_hit_ratio", "Hit ratio del cache de recomendaciones",
+              lambda: matcher.recommendation_cache.stats()["hit_ratio"])
+CallbackGauge("academic_match_cache_entries", "Entradas en el cache de recomendaciones",
+              lambda: len(matcher.recommendation_cache))
+CallbackGauge("academic_match_cache_bytes", "Bytes estimados del cache de recomendaciones",
+              lambda: matcher.recommendation_cache.nbytes)
+CallbackGauge("academic_match_snapshot_age_seconds", "Segundos desde el último entrenamiento completo",
+              _snapshot_metric(lambda snapshot: snapshot.age_seconds))
+CallbackGauge("academic_match_snapshot_users", "Usuarios en el snapshot publicado",
+              _snapshot_metric(lambda snapshot: snapshot.active_users))
+CallbackGauge("academic_match_snapshot_version", "Versión del snapshot publicado",
+              _snapshot_metric(lambda snapshot: snapshot.version))
+CallbackGauge("academic_match_feature_matrix_bytes", "Bytes de la matriz de features CSR",
+              _snapshot_metric(lambda snapshot: snapshot.matrix_nbytes))
+
+# El trabajo de CPU (kneighbors, TF-IDF, entrenamiento) corre en pools acotados
+# para que un re-entrenamiento o una consulta fría no congele el event loop.
+# El entrenamiento tiene su propio pool: nunca ocupa los hilos de los requests.
+EXECUTOR_SIZES = {
+    "matcher": settings.MATCHER_MAX_WORKERS,
+    "training": settings.TRAINING_MAX_WORKERS,
+}
+executors = {}
+
+def get_executor(name: str) -> ThreadPoolExecutor:
+    """Pool por nombre, creado al primer uso (y de nuevo tras un shutdown)"""
+    executor = executors.get(name)
+    if executor is None:
+        executor = executors[name] = ThreadPoolExecutor(
+            max_workers=EXECUTOR_SIZES[name], thread_name_prefix=name
+        )
+    return executor
+
+async def run_in_matcher(func, *args, **kwargs):
+    """Ejecuta una llamada del matcher en el pool de requests"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor("matcher"), partial(func, *args, **kwargs))
+
+async def run_training(func, *args, **kwargs):
+    """Ejecuta un entrenamiento en el pool de entrenamiento"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor("training"), partial(func, *args, **kwargs))
+
+def resolve_snapshot_role() -> str:
+    """
+    Rol del worker frente a SNAPSHOT_DIR
+    
+    - standalone: entrena y sirve su propio modelo (un solo worker)
+    - trainer: único que lee Mongo y entrena; publica snapshots en disco
+    - reader: nunca entrena; mapea el snapshot de CURRENT y deriva los webhooks al entrenador
+    - auto: el primer worker que toma el lock del directorio es trainer, el resto reader
+    """
+    role = settings.SNAPSHOT_ROLE
+    if role not in ("standalone", "trainer", "reader", "auto"):
+        logger.warning("⚠️ SNAPSHOT_ROLE desconocido: %s - usando standalone", role)
+        return "standalone"
+    if role != "standalone" and not settings.SNAPSHOT_DIR:
+        logger.warning("⚠️ SNAPSHOT_ROLE=%s requiere SNAPSHOT_DIR - usando standalone", role)
+        return "standalone"
+    if role == "auto":
+        return "trainer" if acquire_trainer_lock(settings.SNAPSHOT_DIR) else "reader"
+    return role
 
 @app.on_event("startup")
 async def startup_event():
     """Se ejecuta cuando inicia el servicio"""
-    print("🚀 Iniciando servicio de ML...")
+    global snapshot_role
+    snapshot_role = resolve_snapshot_role()
+    logger.info("🚀 Iniciando servicio de ML (rol: %s)", snapshot_role)
+    
+    if snapshot_role == "reader":
+        if not await run_training(matcher.refresh_from_disk):
+            logger.info("⏳ Sin snapshot publicado todavía - esperando al entrenador")
+        asyncio.create_task(watch_snapshots())
+        return
+    
+    # Arranque en caliente: sirve el último snapshot en disco y trae solo lo cambiado desde entonces
+    if await run_training(matcher.restore_snapshot):
+        logger.info("📦 Sirviendo snapshot de disco - sincronizando cambios en segundo plano")
+        asyncio.create_task(refresh_async())
+    else:
+        try:
+            result = await run_training(matcher.train_model)
+            logger.info("✅ Modelo entrenado en startup: %d usuarios", result["users_processed"])
+        except Exception as e:
+            logger.warning("⚠️ Error al entrenar modelo en startup: %s", e)
+    
+    if settings.FULL_RETRAIN_INTERVAL_MINUTES > 0:
+        asyncio.create_task(scheduled_retrain())
+    if snapshot_role == "trainer":
+        asyncio.create_task(apply_pending_upserts())
+    if settings.CHANGE_STREAM_ENABLED:
+        start_change_stream(asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Detiene el change stream, libera los pools de hilos y cierra el cliente de MongoDB"""
+    global change_stream
+    if change_stream is not None:
+        change_stream.stop()
+        change_stream = None
+    for name in list(executors):
+        executors.pop(name).shutdown(wait=False, cancel_futures=True)
+    close_client()
+
+async def scheduled_retrain():
+    """Re-entrenamiento completo periódico (los webhooks solo hacen upserts)"""
+    while True:
+        await asyncio.sleep(settings.FULL_RETRAIN_INTERVAL_MINUTES * 60)
+        logger.info("⏰ Re-entrenamiento programado")
+        await retrain_async()
+
+def start_change_stream(loop):
+    """
+    Aplica cada usuario modificado en Mongo apenas llega por el change stream
+    
+    El upsert corre en el hilo del stream; los re-entrenamientos y deltas
+    se programan en el event loop.
+    """
+    global change_stream
+    
+    def on_change(user_id):
+        result = matcher.upsert_user(user_id)
+        if result["needs_full_retrain"]:
+            asyncio.run_coroutine_threadsafe(retrain_async(), loop)
+    
+    def on_gap():
+        asyncio.run_coroutine_threadsafe(refresh_async(), loop)
+    
+    change_stream = UserChangeStream(matcher.db_manager, on_change=on_change, on_gap=on_gap)
+    change_stream.start()
+
+async def refresh_async():
+    """Delta desde la marca del snapshot; re-entrenamiento completo si no alcanza"""
     try:
-        result = matcher.train_model()
-        print(f"✅ Modelo entrenado en startup: {result}")
+        result = await run_training(matcher.sync_changes)
     except Exception as e:
-        print(f"⚠️ Error al entrenar modelo en startup: {e}")
+        logger.warning("⚠️ Error sincronizando cambios: %s", getattr(e, "detail", e))
+        result = {"needs_full_retrain": True}
+    
+    if result["needs_full_retrain"]:
+        await retrain_async()
+
+async def watch_snapshots():
+    """Reader: publica cada snapshot nuevo que el entrenador apunta en CURRENT y sus deltas"""
+    while True:
+        await asyncio.sleep(settings.SNAPSHOT_POLL_SECONDS)
+        try:
+            await run_training(matcher.refresh_from_disk)
+        except Exception as e:
+            logger.error("❌ Error refrescando snapshot: %s", e, exc_info=True)
+
+async def apply_pending_upserts():
+    """
+    Entrenador: aplica los webhooks que recibieron los readers y publica
+    
+    Los upserts (propios o de readers) se guardan juntos en un delta por
+    vuelta: los readers los re-aplican sin volver a mapear el snapshot.
+    """
+    global needs_retraining
+    while True:
+        await asyncio.sleep(settings.SNAPSHOT_POLL_SECONDS)
+        try:
+            user_ids, full_retrain = drain_upserts(settings.SNAPSHOT_DIR)
+            # Un re-entrenamiento completo ya lee el estado actual de todos los usuarios
+            for user_id in ([] if full_retrain else user_ids):
+                try:
+                    result = await upsert_user_async(user_id)
+                except HTTPException as e:
+                    logger.warning("❌ Error en upsert de %s: %s", user_id, e.detail)
+                    continue
+                full_retrain = full_retrain or result["needs_full_retrain"]
+            
+            if full_retrain:
+                needs_retraining = True
+                await retrain_async()
+            await run_training(matcher.persist_pending)
+        except Exception as e:
+            logger.error("❌ Error aplicando upserts pendientes: %s", e, exc_info=True)
+
+async def upsert_user_async(user_id: str):
+    """Lee el usuario con Motor (sin ocupar un hilo) y aplica el upsert en el pool"""
+    user = await matcher.db_manager.get_user_by_id_async(user_id, active_only=True)
+    return await run_in_matcher(matcher.apply_user, user_id, user)
+
+async def retrain_async():
+    """Re-entrenamiento en segundo plano sobre el pool de entrenamiento"""
+    await run_training(retrain_in_background)
 
 def retrain_in_background():
     """Re-entrena el modelo en segundo plano"""
@@ -50,30 +250,35 @@ def retrain_in_background():
     
     with retrain_lock:
         if is_retraining:
-            print("⚠️ Re-entrenamiento ya en proceso, saltando...")
+            logger.info("⚠️ Re-entrenamiento ya en proceso, saltando")
             return
         is_retraining = True
     
     try:
-        print("🔄 Re-entrenando modelo en segundo plano...")
+        logger.info("🔄 Re-entrenando modelo en segundo plano")
         result = matcher.train_model()
         needs_retraining = False
-        print(f"✅ Modelo re-entrenado: {result['users_processed']} usuarios")
+        logger.info("✅ Modelo re-entrenado: %d usuarios", result["users_processed"])
     except Exception as e:
-        print(f"❌ Error re-entrenando: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error("❌ Error re-entrenando: %s", e, exc_info=True)
         needs_retraining = True
     finally:
         is_retraining = False
 
 @app.post("/webhook/user-updated")
 async def user_updated_webhook(
+    background_tasks: BackgroundTasks,
+    payload: Optional[UserUpdatedWebhook] = None,
     x_api_key: Optional[str] = Header(None)
 ):
     """
     🔔 WEBHOOK llamado desde NestJS cuando se actualiza un usuario
-    RE-ENTRENA DE FORMA SÍNCRONA para garantizar datos actualizados
+    Actualiza SOLO la fila de ese usuario con los vectorizadores ya entrenados.
+    El re-entrenamiento completo queda para el ciclo programado o cuando
+    el drift de vocabulario supera el umbral.
+    
+    Body:
+    - user_id: Usuario modificado (sin body → re-entrenamiento completo en segundo plano)
     
     Headers opcionales:
     - x-api-key: Token de autenticación
@@ -81,35 +286,53 @@ async def user_updated_webhook(
     global needs_retraining
     
     if settings.WEBHOOK_API_KEY and x_api_key != settings.WEBHOOK_API_KEY:
-        return {"error": "Unauthorized"}, 401
+        raise HTTPException(status_code=401, detail="Unauthorized")
     
-    print(f"📥 Webhook recibido - RE-ENTRENANDO SÍNCRONAMENTE")
-    
-    # 🔥 SIEMPRE re-entrenar de forma síncrona
-    try:
-        print("⏳ Iniciando re-entrenamiento síncrono...")
-        result = matcher.train_model()
-        needs_retraining = False
-        print(f"✅ Modelo re-entrenado: {result['users_processed']} usuarios")
-        
+    if snapshot_role == "reader":
+        # Solo el entrenador modifica el modelo: lo publica y todos los workers lo ven igual
+        user_id = payload.user_id if payload else None
+        enqueue_upsert(settings.SNAPSHOT_DIR, user_id)
         return {
-            "message": "Model retrained successfully",
-            "status": "completed",
-            "users_processed": result['users_processed'],
+            "message": "Update queued for trainer",
+            "status": "queued",
+            "user_id": user_id,
             "timestamp": datetime.now().isoformat()
         }
-    except Exception as e:
-        print(f"❌ Error re-entrenando: {e}")
-        import traceback
-        traceback.print_exc()
+    
+    if payload is None:
+        logger.info("📥 Webhook sin user_id - re-entrenamiento completo en segundo plano")
         needs_retraining = True
-        
+        background_tasks.add_task(retrain_async)
+        return {
+            "message": "Full retrain scheduled",
+            "status": "scheduled",
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    try:
+        result = await upsert_user_async(payload.user_id)
+    except HTTPException as e:
+        logger.warning("❌ Error en upsert de %s: %s", payload.user_id, e.detail)
         return {
-            "message": "Model retraining failed",
+            "message": "User update failed",
             "status": "error",
-            "error": str(e),
+            "error": e.detail,
             "timestamp": datetime.now().isoformat()
         }
+    
+    if result["needs_full_retrain"]:
+        logger.info("🔄 Drift de vocabulario %s - programando re-entrenamiento", result.get("vocabulary_drift"))
+        background_tasks.add_task(retrain_async)
+    
+    return {
+        "message": "User updated incrementally",
+        "status": "completed",
+        "action": result["status"],
+        "user_id": payload.user_id,
+        "users_loaded": result.get("users_loaded", matcher.is_healthy()["users_loaded"]),
+        "full_retrain_scheduled": result["needs_full_retrain"],
+        "timestamp": datetime.now().isoformat()
+    }
 
 @app.post("/recommendations", response_model=RecommendationResponse)
 async def get_recommendations(
@@ -125,40 +348,9 @@ async def get_recommendations(
     - **page**: Número de página (1-indexed, default: 1)
     - **use_cache**: Usar cache de recomendaciones (default: true)
     """
-    global needs_retraining, is_retraining
-    
-    print(f"📥 Request de recomendaciones:")
-    print(f"   Usuario: {request.user_id}")
-    print(f"   Página: {request.page}, Límite: {request.limit}")
-    print(f"   Excluidos: {len(request.exclude_users)}")
-    print(f"   needs_retraining={needs_retraining}, is_retraining={is_retraining}")
-    
-    # Si hay cambios pendientes, ESPERAR a que termine el re-entrenamiento
-    if needs_retraining or is_retraining:
-        print("⏳ Esperando a que termine el re-entrenamiento actual...")
-        
-        max_wait = 30
-        waited = 0
-        while (needs_retraining or is_retraining) and waited < max_wait:
-            await asyncio.sleep(0.5)
-            waited += 0.5
-        
-        if waited >= max_wait:
-            print("⚠️ Timeout esperando re-entrenamiento, usando modelo actual")
-        else:
-            print(f"✅ Re-entrenamiento completado después de {waited}s")
-    
-    # Si aún hay flag de re-entrenamiento, forzar uno síncrono
-    if needs_retraining:
-        print("🔄 Forzando re-entrenamiento síncrono antes de recomendar...")
-        try:
-            matcher.train_model()
-            needs_retraining = False
-            print("✅ Modelo actualizado antes de recomendar")
-        except Exception as e:
-            print(f"❌ Error re-entrenando: {e}")
-    
-    result = matcher.get_recommendations(
+    # Sin esperas: se sirve el snapshot publicado aunque haya un re-entrenamiento en curso
+    result = await run_in_matcher(
+        matcher.get_recommendations,
         user_id=request.user_id,
         exclude_users=request.exclude_users,
         limit=request.limit,
@@ -166,14 +358,57 @@ async def get_recommendations(
         use_cache=request.use_cache
     )
     
-    return RecommendationResponse(
-        recommendations=result["recommendations"],
-        pagination=PaginationMetadata(**result["pagination"]),
-        compatibility_metrics=result["compatibility_metrics"],
-        model_version=settings.API_VERSION,
-        generated_at=datetime.now().isoformat(),
-        cache_used=result.get("cache_used", False)
+    with REQUEST_STAGE_SECONDS.time(stage="serialization"):
+        return RecommendationResponse(
+            recommendations=result["recommendations"],
+            pagination=PaginationMetadata(**result["pagination"]),
+            compatibility_metrics=result["compatibility_metrics"],
+            search=SearchMetadata(**result["search"]),
+            model_version=settings.API_VERSION,
+            generated_at=datetime.now().isoformat(),
+            cache_used=result.get("cache_used", False)
+        )
+
+@app.post("/recommendations/batch", response_model=BatchRecommendationResponse)
+async def get_batch_recommendations(request: BatchRecommendationRequest):
+    """
+    Recomendaciones para varios usuarios en una sola llamada
+    
+    - **items**: lista de {user_id, exclude_users, limit, page}
+    - **use_cache**: Usar cache de recomendaciones (default: true)
+    
+    Los vecinos de todos los usuarios sin cache se calculan en una sola
+    consulta por bloques; los usuarios no encontrados van en `errors`.
+    Un user_id repetido en `items` responde 400 (los resultados van por user_id).
+    """
+    if len(request.items) > settings.MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo {settings.MAX_BATCH_SIZE} usuarios por batch (recibidos: {len(request.items)})"
+        )
+    
+    result = await run_in_matcher(
+        matcher.get_batch_recommendations,
+        items=[item.model_dump() for item in request.items],
+        use_cache=request.use_cache
     )
+    
+    with REQUEST_STAGE_SECONDS.time(stage="batch_serialization"):
+        return BatchRecommendationResponse(
+            results={
+                user_id: BatchRecommendationResult(
+                    recommendations=user_result["recommendations"],
+                    pagination=PaginationMetadata(**user_result["pagination"]),
+                    compatibility_metrics=user_result["compatibility_metrics"],
+                    search=SearchMetadata(**user_result["search"]),
+                    cache_used=user_result["cache_used"]
+                )
+                for user_id, user_result in result["results"].items()
+            },
+            errors=result["errors"],
+            model_version=settings.API_VERSION,
+            generated_at=datetime.now().isoformat()
+        )
 
 @app.post("/cache/clear", response_model=CacheClearResponse)
 async def clear_cache(request: CacheClearRequest):
@@ -184,12 +419,7 @@ async def clear_cache(request: CacheClearRequest):
     - Con user_id: limpia solo cache de ese usuario
     """
     try:
-        cache_size_before = len(matcher._recommendation_cache)
-        
-        matcher.clear_cache(request.user_id)
-        
-        cache_size_after = len(matcher._recommendation_cache)
-        cleared = cache_size_before - cache_size_after
+        cleared = matcher.clear_cache(request.user_id)
         
         message = f"Cache limpiado para {request.user_id}" if request.user_id else "Cache completo limpiado"
         
@@ -205,7 +435,14 @@ async def clear_cache(request: CacheClearRequest):
 async def retrain_model():
     """Re-entrena el modelo manualmente"""
     global needs_retraining
-    result = matcher.train_model()
+    if snapshot_role == "reader":
+        enqueue_upsert(settings.SNAPSHOT_DIR)
+        return {
+            "message": "Re-entrenamiento derivado al entrenador",
+            "status": "queued",
+            "timestamp": datetime.now().isoformat()
+        }
+    result = await run_training(matcher.train_model)
     needs_retraining = False
     return {
         "message": "Modelo re-entrenado exitosamente",
@@ -221,7 +458,9 @@ async def health_check():
         status="healthy",
         model_trained=health_data["model_trained"],
         timestamp=datetime.now().isoformat(),
-        users_loaded=health_data["users_loaded"]
+        users_loaded=health_data["users_loaded"],
+        cache_entries=health_data["cache_entries"],
+        cache_stats=health_data["cache_stats"]
     )
 
 @app.get("/model/stats", response_model=ModelStatsResponse)
@@ -232,12 +471,22 @@ async def model_stats():
         total_users=stats["total_users"],
         feature_dimensions=stats["feature_dimensions"],
         k_neighbors=stats["k_neighbors"],
-        last_trained=datetime.now().isoformat()
+        last_trained=stats["last_trained"],
+        neighbor_table=stats["neighbor_table"],
+        neighbor_table_changed_rows=stats["neighbor_table_changed_rows"],
+        cache_size=stats["cache_size"],
+        cache_stats=stats["cache_stats"]
     )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métricas en formato de texto de Prometheus (etapas de entrenamiento y serving)"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/test-webhook")
 async def test_webhook():
     """Endpoint de prueba"""
-    print("🧪 TEST WEBHOOK EJECUTADO")
+    logger.info("🧪 TEST WEBHOOK EJECUTADO")
     return {"message": "Test successful", "timestamp": datetime.now().isoformat()}
 
 @app.get("/")
@@ -3,6 +3,7 @@ Modelos y esquemas de datos
 """
 
 from .matcher import AcademicMatcher
+from .snapshot import ModelSnapshot
 from .schemas import (
     UserProfile, RecommendationRequest, RecommendationResponse,
     TrainingResult, HealthResponse, ModelStatsResponse
@@ -10,6 +11,7 @@ from .schemas import (
 
 __all__ = [
     'AcademicMatcher',
+    'ModelSnapshot',
     'UserProfile', 
     'RecommendationRequest', 
     'RecommendationResponse',
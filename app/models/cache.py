@@ -0,0 +1,156 @@
+import sys
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import numpy as np
+
+
+def estimate_size(obj, _seen=None) -> int:
+    """Tamaño aproximado en bytes de un valor cacheado (recorre contenedores)"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        # getsizeof ya incluye el buffer si el array es dueño de sus datos; una vista no
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is not None else 0)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, _seen) + estimate_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _seen) for item in obj)
+    return size
+
+
+class _CacheEntry:
+    __slots__ = ("user_id", "value", "size", "expires_at")
+
+    def __init__(self, user_id, value, size, expires_at):
+        self.user_id = user_id
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+
+
+class RecommendationCache:
+    """
+    Cache LRU acotado (entradas y bytes) con TTL opcional
+
+    Mantiene un índice secundario user_id → claves para invalidar por
+    usuario en O(entradas de ese usuario) y contadores de hits, misses y
+    evicciones. Thread-safe.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int,
+        ttl_seconds: float = 0,
+        sizeof: Callable[[Any], int] = estimate_size
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sizeof = sizeof
+        self._entries: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
+        self._user_keys: Dict[str, set] = {}
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key: Hashable, value: Any, user_id: str):
+        size = self._sizeof(value)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _CacheEntry(user_id, value, size, expires_at)
+            self._user_keys.setdefault(user_id, set()).add(key)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: str) -> int:
+        """Elimina todas las entradas del usuario"""
+        with self._lock:
+            keys = list(self._user_keys.get(user_id, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def invalidate_users(self, predicate: Callable[[str], bool]) -> int:
+        """Elimina las entradas de los usuarios que cumplen el predicado"""
+        with self._lock:
+            keys = [key for user_id, user_keys in self._user_keys.items() if predicate(user_id) for key in user_keys]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> int:
+        with self._lock:
+            cleared = len(self._entries)
+            self._entries.clear()
+            self._user_keys.clear()
+            self._bytes = 0
+            return cleared
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        user_keys = self._user_keys.get(entry.user_id)
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._user_keys[entry.user_id]
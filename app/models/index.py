@@ -0,0 +1,618 @@
+import copy
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+
+import numpy as np
+import scipy.sparse as sp
+
+# Top-N de cada fila calculado al entrenar: filas vecinas (int32, -1 = relleno si
+# la ventana tiene menos filas) y similitud coseno (float32), ordenadas;
+# stale_rows son filas cambiadas por upserts desde entonces (las agregadas son
+# las que quedan después de la última fila de la tabla)
+NeighborTable = namedtuple('NeighborTable', ['indices', 'similarities', 'stale_rows'])
+
+
+class CosineIndex:
+    """
+    Búsqueda exacta de vecinos coseno sobre filas ya normalizadas (L2)
+
+    Mismo contrato que NearestNeighbors(metric='cosine', algorithm='brute')
+    (fit / kneighbors) pero sin copiar ni re-normalizar la matriz en cada
+    consulta: guarda la referencia tal cual, así puede ser un memmap
+    compartido entre workers, y la distancia es 1 - producto punto.
+    Los empates se desempatan por fila para que todos los workers devuelvan
+    el mismo orden.
+    """
+
+    # Celdas de la matriz densa de similitudes por bloque de consultas (~64 MB en float64)
+    CHUNK_CELLS = 8_000_000
+
+    def __init__(self, n_neighbors: int = 5):
+        self.n_neighbors = n_neighbors
+        self._fit_X = None
+        self.n_samples_fit_ = 0
+        self.tiebreak = None  # fila original de cada fila ajustada (None = su posición)
+
+    def fit(self, X):
+        self._fit_X = X if sp.issparse(X) else np.asarray(X)
+        self.n_samples_fit_ = X.shape[0]
+        return self
+
+    def state(self):
+        """Arreglos que fit calcula a partir de X, para guardarlos con el snapshot (ver restore)"""
+        return {}
+
+    def restore(self, X, state):
+        """Índice sobre X con el estado de state(), sin volver a calcularlo"""
+        return self.fit(X)
+
+    def with_rows(self, X, deleted=None, inserted=None):
+        """
+        Índice sobre X = la matriz ajustada sin la fila `deleted` y/o con una
+        fila nueva en la posición `inserted` (posiciones de X); un upsert
+
+        La búsqueda exacta no guarda nada calculado de las filas: basta con
+        apuntar a la matriz nueva.
+        """
+        return CosineIndex(n_neighbors=self.n_neighbors).fit(X)
+
+    def kneighbors(self, X, n_neighbors=None, return_distance=True):
+        k = n_neighbors or self.n_neighbors
+        n = self.n_samples_fit_
+        if k > n:
+            raise ValueError(f"Se pidieron {k} vecinos pero el índice tiene {n} filas")
+
+        rows_per_chunk = max(1, self.CHUNK_CELLS // max(n, 1))
+        distances = np.empty((X.shape[0], k), dtype=np.float64)
+        indices = np.empty((X.shape[0], k), dtype=np.intp)
+
+        for start in range(0, X.shape[0], rows_per_chunk):
+            end = min(start + rows_per_chunk, X.shape[0])
+            distances[start:end], indices[start:end] = self._query_chunk(X[start:end], k)
+
+        return (distances, indices) if return_distance else indices
+
+    def _query_chunk(self, queries, k):
+        # Consultas densas × índice disperso: las similitudes salen densas de todos
+        # modos (TF-IDF corto con vocabulario común) y se evita el producto
+        # disperso × disperso más el toarray; la resta y el clip son in-place
+        if sp.issparse(queries):
+            queries = queries.toarray()
+        chunk_distances = np.ascontiguousarray(queries @ self._fit_X.T, dtype=np.float64)
+        np.subtract(1.0, chunk_distances, out=chunk_distances)
+        np.clip(chunk_distances, 0.0, 2.0, out=chunk_distances)
+
+        candidates = smallest_k(chunk_distances, k, self.tiebreak)
+        return np.take_along_axis(chunk_distances, candidates, axis=1), candidates
+
+
+class LSHIndex(CosineIndex):
+    """
+    Vecinos coseno aproximados con LSH de hiperplanos aleatorios (SimHash)
+
+    Cada tabla asigna a cada fila un código de `n_bits` bits (signo de la
+    proyección sobre n_bits hiperplanos); filas con ángulo pequeño caen en
+    el mismo bucket con alta probabilidad. La consulta junta los buckets de
+    la fila en las tablas y re-ordena esos candidatos con el coseno exacto.
+
+    Construcción (fijas al ajustar):
+        n_tables     más tablas → más recall, más memoria (código y fila: 16 bytes por fila y tabla)
+        n_bits       más bits → buckets más chicos y consultas más rápidas, menos recall
+    Consulta (se pueden cambiar sin re-ajustar):
+        probe_radius también busca los buckets a distancia Hamming <= radio (0-2)
+        query_tables cuántas tablas se consultan (None = todas)
+
+    Si los candidatos no alcanzan para k vecinos, esa consulta se resuelve
+    exacta: nunca devuelve menos de k. La semilla es fija para que todos los
+    workers que ajustan la misma matriz obtengan los mismos códigos.
+
+    Experimental: solo conviene si los buckets de una consulta juntan una
+    fracción chica de las filas. Con perfiles TF-IDF cortos los k vecinos
+    quedan lejos (coseno ~0.5) y, con recall alto, los candidatos son una
+    parte grande del índice: en benchmarks/bench_ann.py recién gana a la
+    búsqueda exacta desde ~100k filas.
+    """
+
+    def __init__(
+        self,
+        n_neighbors: int = 5,
+        n_tables: int = 32,
+        n_bits: int = 12,
+        probe_radius: int = 1,
+        query_tables=None,
+        seed: int = 42
+    ):
+        super().__init__(n_neighbors=n_neighbors)
+        # Los códigos de todas las tablas van en un solo arreglo ordenado: tabla en los bits altos
+        if not 1 <= n_bits or n_bits + (n_tables - 1).bit_length() > 62:
+            raise ValueError("n_bits debe ser >= 1 y n_bits + bits de n_tables <= 62")
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.probe_radius = probe_radius
+        self.query_tables = query_tables
+        self.seed = seed
+        self._planes = None
+        self._sorted_codes = None  # (tablas, n) tabla << n_bits | código, creciente en el arreglo aplanado
+        self._order = None  # (tablas, n) fila de cada código ordenado
+
+    def fit(self, X):
+        super().fit(X)
+        self._planes = self._random_planes(X.shape[1])
+
+        codes = self._codes(X)
+        self._order = np.argsort(codes, axis=1, kind='stable')
+        self._sorted_codes = np.take_along_axis(codes, self._order, axis=1)
+        return self
+
+    def _random_planes(self, n_features):
+        rng = np.random.default_rng(self.seed)
+        return rng.standard_normal((n_features, self.n_tables * self.n_bits)).astype(np.float32)
+
+    def state(self):
+        """Tablas ordenadas (los hiperplanos salen de la semilla)"""
+        return {'order': self._order, 'sorted_codes': self._sorted_codes}
+
+    def restore(self, X, state):
+        """Índice sobre X con las tablas de state() (p. ej. mapeadas desde disco), sin proyectar ni ordenar"""
+        order, sorted_codes = state['order'], state['sorted_codes']
+        if order.shape != (self.n_tables, X.shape[0]) or sorted_codes.shape != order.shape:
+            raise ValueError("tablas LSH desalineadas con la matriz")
+        CosineIndex.fit(self, X)
+        self._planes = self._random_planes(X.shape[1])
+        self._order, self._sorted_codes = order, sorted_codes
+        return self
+
+    def with_rows(self, X, deleted=None, inserted=None):
+        """
+        Índice sobre X con solo la fila que cambió re-hasheada (ver CosineIndex.with_rows)
+
+        Los códigos del resto de las filas no cambian (mismos hiperplanos): se
+        quitan las entradas de `deleted` de cada tabla, se corren las filas
+        siguientes y se insertan las de `inserted` en su lugar del orden.
+        Cuesta copiar las tablas (tablas × filas), no proyectar ni re-ordenar.
+        """
+        index = copy.copy(self)
+        CosineIndex.fit(index, X)
+        order, sorted_codes = self._order, self._sorted_codes
+
+        if deleted is not None:
+            keep = order != deleted
+            order = order[keep].reshape(self.n_tables, -1)
+            sorted_codes = sorted_codes[keep].reshape(self.n_tables, -1)
+            order -= order > deleted
+        if inserted is not None:
+            order = order + (order >= inserted)
+            codes = self._codes(X[inserted:inserted + 1])[:, 0]
+            # Entre códigos iguales el orden es por fila, como el argsort estable de fit
+            positions = []
+            for table_codes, table_order, code in zip(sorted_codes, order, codes):
+                lo = np.searchsorted(table_codes, code, side='left')
+                hi = np.searchsorted(table_codes, code, side='right')
+                positions.append(lo + np.searchsorted(table_order[lo:hi], inserted))
+            order = _insert_per_row(order, positions, np.full(self.n_tables, inserted))
+            sorted_codes = _insert_per_row(sorted_codes, positions, codes)
+
+        index._order, index._sorted_codes = order, sorted_codes
+        return index
+
+    def _codes(self, X):
+        """(tablas, filas) tabla << n_bits | código de cada fila en cada tabla"""
+        projected = X @ self._planes
+        bits = (np.asarray(projected) > 0).reshape(X.shape[0], self.n_tables, self.n_bits)
+        weights = np.left_shift(np.int64(1), np.arange(self.n_bits, dtype=np.int64))
+        return (bits.astype(np.int64) @ weights).T | self._table_offsets()[:, None]
+
+    def _table_offsets(self):
+        return np.left_shift(np.arange(self.n_tables, dtype=np.int64), self.n_bits)
+
+    def _probe_masks(self):
+        masks = [0]
+        for radius in range(1, self.probe_radius + 1):
+            for positions in combinations(range(self.n_bits), radius):
+                masks.append(sum(1 << bit for bit in positions))
+        return np.array(masks, dtype=np.int64)
+
+    def kneighbors(self, X, n_neighbors=None, return_distance=True):
+        k = n_neighbors or self.n_neighbors
+        n = self.n_samples_fit_
+        if k > n:
+            raise ValueError(f"Se pidieron {k} vecinos pero el índice tiene {n} filas")
+
+        tables = min(self.query_tables or self.n_tables, self.n_tables)
+        # (tablas, consultas, máscaras): el bucket de cada consulta y sus vecinos Hamming
+        probes = np.bitwise_xor(self._codes(X)[:tables, :, None], self._probe_masks())
+
+        rows_per_chunk = max(1, self.CHUNK_CELLS // max(n, 1))
+        distances = np.empty((X.shape[0], k), dtype=np.float64)
+        indices = np.empty((X.shape[0], k), dtype=np.intp)
+        for start in range(0, X.shape[0], rows_per_chunk):
+            end = min(start + rows_per_chunk, X.shape[0])
+            distances[start:end], indices[start:end] = self._query_buckets(X[start:end], probes[:, start:end], k)
+
+        return (distances, indices) if return_distance else indices
+
+    def _candidates(self, probes):
+        """(consultas, n) máscara de las filas que comparten bucket (o uno vecino) con cada consulta"""
+        n = self.n_samples_fit_
+        # Un solo searchsorted para todas las tablas, consultas y máscaras
+        keys = self._sorted_codes.ravel()
+        starts = np.searchsorted(keys, probes, side='left').ravel()
+        lengths = np.searchsorted(keys, probes, side='right').ravel() - starts
+        queries = np.broadcast_to(np.arange(probes.shape[1])[:, None], probes.shape[1:])
+        queries = np.broadcast_to(queries, probes.shape).ravel()
+
+        # Todos los rangos [start, end) concatenados sin bucle en Python
+        total = int(lengths.sum())
+        positions = np.arange(total) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+        seen = np.zeros((probes.shape[1], n), dtype=bool)
+        seen[np.repeat(queries, lengths), self._order.ravel()[positions]] = True
+        return seen
+
+    def _query_buckets(self, queries, probes, k):
+        """Top-k de un bloque de consultas entre sus candidatos, todas juntas"""
+        seen = self._candidates(probes)
+        candidates = np.flatnonzero(seen.any(axis=0))  # unión del bloque, en orden de fila
+        short = np.count_nonzero(seen, axis=1) < k
+        if short.all():
+            return self._query_chunk(queries, k)
+
+        # Similitudes de la unión contra el bloque; cada consulta solo ve sus candidatos
+        dense_queries = queries.toarray() if sp.issparse(queries) else np.asarray(queries)
+        similarities = np.asarray(self._fit_X[candidates] @ dense_queries.T).T
+        seen = seen[:, candidates]
+        chunk_distances = np.full(similarities.shape, np.inf)
+        chunk_distances[seen] = np.clip(1.0 - similarities[seen], 0.0, 2.0)
+
+        # candidates viene ordenado: desempatar por columna es desempatar por fila
+        tiebreak = None if self.tiebreak is None else self.tiebreak[candidates]
+        top = smallest_k(chunk_distances, k, tiebreak)
+        distances = np.take_along_axis(chunk_distances, top, axis=1)
+        indices = candidates[top]
+
+        # Menos candidatos que k: esa consulta se resuelve exacta
+        if short.any():
+            distances[short], indices[short] = self._query_chunk(queries[np.flatnonzero(short)], k)
+        return distances, indices
+
+
+def smallest_k(distances, k, tiebreak=None):
+    """
+    Columnas de las k menores distancias de cada fila, ordenadas por (distancia, desempate)
+
+    tiebreak: clave de desempate de cada columna (None = la columna). Es
+    determinista: entre empates en la k-ésima distancia entran los de clave
+    más baja (argpartition elige cualquiera), así el top-k de un k menor
+    siempre es prefijo del de uno mayor y las páginas más profundas no
+    repiten ni saltean filas.
+    """
+    n = distances.shape[1]
+    if k < n:
+        columns = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        kth = np.take_along_axis(distances, columns, axis=1).max(axis=1, keepdims=True)
+        # Filas con más de k en el umbral: se rehacen con los empatados de clave más baja
+        for row in np.flatnonzero(np.count_nonzero(distances <= kth, axis=1) > k):
+            below = np.flatnonzero(distances[row] < kth[row, 0])
+            tied = np.flatnonzero(distances[row] == kth[row, 0])
+            if tiebreak is not None:
+                tied = tied[np.argsort(tiebreak[tied], kind='stable')]
+            columns[row] = np.concatenate([below, tied[:k - len(below)]])
+    else:
+        columns = np.broadcast_to(np.arange(n), distances.shape)
+
+    keys = columns if tiebreak is None else tiebreak[columns]
+    order = np.lexsort((keys, np.take_along_axis(distances, columns, axis=1)), axis=-1)
+    return np.take_along_axis(columns, order, axis=1)
+
+
+def _insert_per_row(array, positions, values):
+    """Copia de `array` (2D) con values[i] insertado en positions[i] de cada fila i"""
+    rows, columns = array.shape
+    result = np.empty((rows, columns + 1), dtype=array.dtype)
+    for row, (position, value) in enumerate(zip(positions, values)):
+        result[row, :position] = array[row, :position]
+        result[row, position] = value
+        result[row, position + 1:] = array[row, position:]
+    return result
+
+
+def with_rows(index, X, fit, deleted=None, inserted=None):
+    """
+    `index` actualizado para X tras un upsert de una fila (ver CosineIndex.with_rows)
+
+    Los backends que no saben actualizarse (sklearn) se ajustan de cero con
+    fit(X), aunque no haya cambiado ninguna fila: así tampoco retienen la
+    matriz anterior.
+    """
+    if hasattr(index, 'with_rows'):
+        return index.with_rows(X, deleted=deleted, inserted=inserted)
+    return fit(X)
+
+
+def splice_rows(matrix, row=None, deleted=None, inserted=None):
+    """
+    `matrix` sin la fila `deleted` y/o con `row` en la posición `inserted`
+
+    Posiciones como en CosineIndex.with_rows (inserted es de la matriz
+    nueva); se copia una sola vez.
+    """
+    if inserted is None:
+        pieces = [matrix] if deleted is None else [matrix[:deleted], matrix[deleted + 1:]]
+    elif deleted is None:
+        pieces = [matrix[:inserted], row, matrix[inserted:]]
+    elif inserted <= deleted:
+        pieces = [matrix[:inserted], row, matrix[inserted:deleted], matrix[deleted + 1:]]
+    else:
+        pieces = [matrix[:deleted], matrix[deleted + 1:inserted + 1], row, matrix[inserted + 1:]]
+    return sp.vstack(pieces, format='csr')
+
+
+def build_neighbor_table(search, n_rows: int, k: int, chunk_rows: int = 256, workers: int = 1) -> NeighborTable:
+    """
+    Top-k vecinos de todas las filas con la búsqueda del snapshot
+
+    search(start, end) devuelve [(distancias, filas)] para las filas
+    [start, end). Se consulta por bloques de chunk_rows filas, repartidos
+    entre `workers` hilos (el producto de matrices y la selección liberan el
+    GIL). Cada hilo tiene a lo sumo un bloque de similitudes densas a la vez,
+    así el pico es ~workers × chunk_rows × filas × 8 bytes y nunca la matriz N×N.
+    """
+    indices = np.full((n_rows, k), -1, dtype=np.int32)
+    similarities = np.zeros((n_rows, k), dtype=np.float32)
+
+    def fill(start):
+        end = min(start + chunk_rows, n_rows)
+        for row, (distances, rows) in enumerate(search(start, end), start):
+            count = min(len(rows), k)
+            indices[row, :count] = rows[:count]
+            similarities[row, :count] = 1.0 - distances[:count]
+
+    starts = range(0, n_rows, max(1, chunk_rows))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="neighbor-table") as pool:
+            list(pool.map(fill, starts))
+    else:
+        for start in starts:
+            fill(start)
+    return NeighborTable(indices, similarities, np.empty(0, dtype=np.int32))
+
+
+def table_neighbors(table: NeighborTable, matrix_rows, n_rows: int, row: int, eligible=None):
+    """
+    (distancias, filas, completa) de `row` según la tabla, o None si hay que buscar en línea
+
+    None si la fila se agregó o cambió después de construir la tabla. Las
+    filas cambiadas (stale_rows) y las agregadas (>= filas de la tabla)
+    desde entonces se puntúan contra la matriz actual y se mezclan con la
+    lista guardada; las demás no cambiaron, así que el resultado es exacto
+    hasta la distancia del último vecino guardado y se corta ahí (puede
+    quedar más corto que la tabla). completa = la lista guardada ya cubría
+    todas las filas (relleno -1): no hay corte y no existen más vecinos.
+
+    matrix_rows(filas) → esas filas de la matriz actual, de n_rows filas.
+    eligible(filas) → máscara de las filas que la búsqueda de `row` puede
+    devolver (su ventana de semestres); None = todas.
+    """
+    if table is None or row >= len(table.indices) or row in table.stale_rows:
+        return None
+
+    rows = table.indices[row].astype(np.intp)
+    distances = 1.0 - table.similarities[row].astype(np.float64)
+    complete = not len(rows) or rows[-1] < 0
+    if complete:
+        filled = rows >= 0
+        rows, distances = rows[filled], distances[filled]
+    cutoff = np.inf if complete else distances[-1]
+
+    changed = np.concatenate([table.stale_rows, np.arange(len(table.indices), n_rows)]).astype(np.intp)
+    if len(changed):
+        kept = ~np.isin(rows, changed)
+        rows, distances = rows[kept], distances[kept]
+        if eligible is not None:
+            changed = changed[eligible(changed)]
+        similarities = matrix_rows(changed) @ matrix_rows([row]).T
+        if sp.issparse(similarities):
+            similarities = similarities.toarray()
+        changed_distances = np.clip(1.0 - np.asarray(similarities).ravel(), 0.0, 2.0)
+        within = changed_distances <= cutoff
+        rows = np.concatenate([rows, changed[within]])
+        distances = np.concatenate([distances, changed_distances[within]])
+        order = np.lexsort((rows, distances))
+        rows, distances = rows[order], distances[order]
+    return distances, rows, complete
+
+
+def mark_stale(table, row: int):
+    """Tabla con `row` marcada como cambiada (None si no hay tabla)"""
+    if table is None:
+        return None
+    return table._replace(stale_rows=np.union1d(table.stale_rows, [row]).astype(np.int32))
+
+
+def changed_rows(table, n_rows: int) -> int:
+    """Filas cambiadas o agregadas desde que se construyó la tabla (se puntúan al leer)"""
+    if table is None:
+        return 0
+    return len(table.stale_rows) + max(0, n_rows - len(table.indices))
+
+
+class PartitionedIndex:
+    """
+    Vecinos restringidos a un rango de claves (semestres) compatible con la consulta
+
+    Guarda la única copia de la matriz, con las filas ordenadas por clave:
+    las filas de cada ventana [lo, hi] quedan contiguas y su sub-índice
+    trabaja sobre una vista de ese rango, sin más copias. rows() da las
+    filas por número de fila original. Una consulta solo busca en la
+    ventana de su clave y nunca trae candidatos que el filtro descartaría.
+
+    windows: clave → (lo, hi) inclusive; fit(matriz, estado=None) → índice
+    fit/kneighbors (con el estado de su state(), restaurado sin re-ajustar)
+    order, sorted_matrix: orden y copia ordenada ya hechos (p. ej. mapeados
+    desde disco, compartidos entre workers); None = calcularlos aquí a
+    partir de feature_matrix. states: clave → estado guardado de su sub-índice
+    """
+
+    def __init__(self, feature_matrix, keys, windows, fit, order=None, sorted_matrix=None, states=None):
+        keys = np.asarray(keys)
+        if order is None:
+            order = np.argsort(keys, kind='stable')
+        if sorted_matrix is None:
+            sorted_matrix = _sorted_rows(feature_matrix, order)
+        states = states or {}
+        self._set_rows(order, keys[order], sorted_matrix, windows, fit)
+        self.partitions = {}
+        for key, (start, end) in self._ranges().items():
+            index = None
+            if end > start:
+                index = self._break_ties(fit(_row_range(sorted_matrix, start, end), states.get(key)), start, end)
+            self.partitions[key] = (start, end, index)
+
+    def states(self):
+        """clave → state() de su sub-índice, para los que guardan algo"""
+        return {
+            key: index.state()
+            for key, (_, _, index) in self.partitions.items()
+            if hasattr(index, 'state') and index.state()
+        }
+
+    def _set_rows(self, order, sorted_keys, sorted_matrix, windows, fit):
+        # Orden por (clave, fila): lo que da el argsort estable y lo que mantiene with_rows
+        self.order = order
+        self.positions = inverse_permutation(order)
+        self.sorted_keys = sorted_keys
+        self.sorted_matrix = sorted_matrix
+        self.windows = windows
+        self._fit = fit
+
+    def rows(self, rows):
+        """Filas de la matriz por número de fila original (rows: slice o arreglo), en ese orden"""
+        return self.sorted_matrix[self.positions[rows]]
+
+    def _ranges(self):
+        """clave → (inicio, fin) de sus filas en la matriz ordenada"""
+        return {
+            key: (
+                int(np.searchsorted(self.sorted_keys, lo, side='left')),
+                int(np.searchsorted(self.sorted_keys, hi, side='right'))
+            )
+            for key, (lo, hi) in self.windows.items()
+        }
+
+    def with_rows(self, keys, windows, row=None, deleted=None, inserted=None):
+        """
+        Índice con una fila cambiada, sin re-ajustar las particiones
+
+        keys son las nuevas (globales); deleted / inserted como en
+        CosineIndex.with_rows, con la clave vieja de deleted y keys[inserted]
+        como la nueva, y row la fila nueva de inserted. La copia ordenada se
+        rehace con esa fila en su lugar. Solo los sub-índices cuya ventana
+        contiene alguna de las dos claves cambian de filas; todos pasan a
+        trabajar sobre la copia nueva (brute y LSH re-apuntan sus vistas,
+        sklearn se re-ajusta sobre la suya), así ninguno retiene la anterior.
+        """
+        keys = np.asarray(keys)
+        order = self.order
+        deleted_at = inserted_at = None
+
+        if deleted is not None:
+            deleted_at = int(self.positions[deleted])
+            deleted_key = self.sorted_keys[deleted_at]
+            order = np.delete(order, deleted_at)
+            order -= order > deleted
+        if inserted is not None:
+            order = order + (order >= inserted)
+            inserted_key = keys[inserted]
+            group = keys[order]
+            lo = int(np.searchsorted(group, inserted_key, side='left'))
+            hi = int(np.searchsorted(group, inserted_key, side='right'))
+            inserted_at = lo + int(np.searchsorted(order[lo:hi], inserted))
+            order = np.insert(order, inserted_at, inserted)
+
+        updated = copy.copy(self)
+        sorted_matrix = splice_rows(self.sorted_matrix, row, deleted=deleted_at, inserted=inserted_at)
+        updated._set_rows(order, keys[order], sorted_matrix, windows, self._fit)
+        updated.partitions = {}
+        for key, (start, end) in updated._ranges().items():
+            lo, hi = windows[key]
+            previous = self.partitions.get(key)
+            view = _row_range(updated.sorted_matrix, start, end) if end > start else None
+            if view is None:
+                index = None
+            elif previous is None or previous[2] is None or self.windows.get(key) != (lo, hi):
+                index = self._fit(view)
+            else:
+                index = with_rows(
+                    previous[2], view, self._fit,
+                    deleted=deleted_at - previous[0] if deleted_at is not None and lo <= deleted_key <= hi else None,
+                    inserted=inserted_at - start if inserted_at is not None and lo <= inserted_key <= hi else None
+                )
+            updated.partitions[key] = (start, end, updated._break_ties(index, start, end))
+        return updated
+
+    def _break_ties(self, index, start, end):
+        """Sub-índice que desempata por fila original, como la búsqueda global (los de sklearn no pueden)"""
+        if isinstance(index, CosineIndex):
+            index.tiebreak = self.order[start:end]
+        return index
+
+    def window_size(self, key) -> int:
+        start, end, _ = self.partitions.get(key, (0, 0, None))
+        return end - start
+
+    def kneighbors(self, X, keys, n_neighbors):
+        """
+        [(distancias, filas)] por fila de X, ordenados por (distancia, fila)
+
+        Cada lista tiene min(n_neighbors, filas de la ventana) vecinos; las
+        consultas con la misma clave se resuelven juntas.
+        """
+        keys = np.asarray(keys)
+        results = [None] * X.shape[0]
+        for key in np.unique(keys):
+            queries = np.flatnonzero(keys == key)
+            start, end, index = self.partitions.get(int(key), (0, 0, None))
+            k = min(n_neighbors, end - start)
+            if index is None or k <= 0:
+                for query in queries:
+                    results[query] = (np.empty(0, dtype=np.float64), np.empty(0, dtype=np.intp))
+                continue
+
+            distances, local_rows = index.kneighbors(X[queries], n_neighbors=k)
+            rows = self.order[start + local_rows]
+            # Mismo desempate que la búsqueda global: (distancia, fila original)
+            order = np.lexsort((rows, distances), axis=-1)
+            distances = np.take_along_axis(distances, order, axis=1)
+            rows = np.take_along_axis(rows, order, axis=1)
+            for query, query_distances, query_rows in zip(queries, distances, rows):
+                results[query] = (query_distances, query_rows)
+        return results
+
+
+def inverse_permutation(order):
+    """posiciones[fila] = lugar de la fila en `order`"""
+    positions = np.empty_like(order)
+    positions[order] = np.arange(len(order), dtype=order.dtype)
+    return positions
+
+
+def _sorted_rows(feature_matrix, order):
+    sorted_matrix = feature_matrix[order]
+    if sp.issparse(sorted_matrix):
+        sorted_matrix = sp.csr_matrix(sorted_matrix)
+    return sorted_matrix
+
+
+def _row_range(matrix, start, end):
+    """Filas [start, end) como vista: en CSR comparte data/indices con la matriz"""
+    if not sp.issparse(matrix):
+        return matrix[start:end]
+    begin, finish = matrix.indptr[start], matrix.indptr[end]
+    # El constructor "poda" (copia) las vistas de menos de la mitad del arreglo
+    # base: se arma vacía y se le asignan las vistas directamente
+    view = sp.csr_matrix((end - start, matrix.shape[1]), dtype=matrix.dtype)
+    view.data = matrix.data[begin:finish]
+    view.indices = matrix.indices[begin:finish]
+    view.indptr = matrix.indptr[start:end + 1] - begin
+    return view
@@ -0,0 +1,110 @@
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from ..utils.metrics import TRAINING_STAGE_SECONDS
+from ..utils.preprocessing import TEXT_COLUMNS, FeaturePreprocessor
+from .snapshot import build_metadata_arrays
+
+# Valores únicos por usuario: no vale la pena compartirlos
+_UNIQUE_FIELDS = ('_id', 'user_id')
+
+
+@dataclass
+class UserColumns:
+    """
+    Usuarios de entrenamiento en columnas, alineados fila a fila
+
+    Los textos viven solo aquí (se sueltan después de ajustar el TF-IDF):
+    los features que quedan en el snapshot no los repiten.
+    """
+    users: List[dict]
+    features: List[dict]
+    texts: Tuple[List[str], List[str], List[str]]  # en el orden de TEXT_COLUMNS
+    match_tokens: List[Tuple[frozenset, frozenset, frozenset]]
+    metadata: dict  # semesters, ages, coordinates_rad
+    received: int = 0
+
+    def __len__(self):
+        return len(self.users)
+
+
+def ingest_users(preprocessor: FeaturePreprocessor, batches: Iterable[List[dict]]) -> UserColumns:
+    """
+    Construye las columnas de entrenamiento a medida que llegan los lotes del cursor
+
+    Cada lote se procesa y se descarta: no hay una lista completa de
+    documentos crudos más otra de features con texto al mismo tiempo.
+    La metadata numérica se arma por lote y se concatena una sola vez.
+
+    Cada documento decodificado trae su propia copia de cada clave y de
+    cada valor de vocabulario (skills, universidad, ...); aquí se reemplazan
+    por una instancia compartida, igual que los conjuntos de match_tokens.
+    
+    El procesamiento de los lotes se observa como etapa extract_features; la
+    espera al cursor la mide quien produce los lotes (mongo_load).
+    """
+    users, features, match_tokens = [], [], []
+    texts = tuple([] for _ in TEXT_COLUMNS)
+    metadata_parts = []
+    received = 0
+    pool = {}
+
+    extract_seconds = 0.0
+    for batch in batches:
+        started = time.perf_counter()
+        received += len(batch)
+        batch = [_share_document(user, pool) for user in batch]
+        batch_features, batch_users = preprocessor.extract_user_features(batch)
+        for feature_dict in batch_features:
+            for column, values in zip(TEXT_COLUMNS, texts):
+                values.append(feature_dict.pop(column))
+
+        if batch_features:
+            metadata_parts.append(build_metadata_arrays(batch_features))
+        match_tokens.extend(
+            tuple(pool.setdefault(tokens, tokens) for tokens in preprocessor.match_tokens(user))
+            for user in batch_users
+        )
+        users.extend(batch_users)
+        features.extend(batch_features)
+        extract_seconds += time.perf_counter() - started
+
+    if metadata_parts:
+        metadata = {
+            name: np.concatenate([part[name] for part in metadata_parts])
+            for name in metadata_parts[0]
+        }
+    else:
+        metadata = build_metadata_arrays([])
+    TRAINING_STAGE_SECONDS.observe(extract_seconds, stage="extract_features")
+
+    return UserColumns(
+        users=users,
+        features=features,
+        texts=texts,
+        match_tokens=match_tokens,
+        metadata=metadata,
+        received=received
+    )
+
+
+def _share_document(user: dict, pool: dict) -> dict:
+    return {
+        pool.setdefault(key, key): value if key in _UNIQUE_FIELDS else _shared(value, pool)
+        for key, value in user.items()
+    }
+
+
+def _shared(value, pool):
+    """Copia de value con claves y strings tomados del pool (una instancia por valor distinto)"""
+    kind = type(value)
+    if kind is str:
+        return pool.setdefault(value, value)
+    if kind is dict:
+        return {pool.setdefault(key, key): _shared(item, pool) for key, item in value.items()}
+    if kind is list:
+        return [_shared(item, pool) for item in value]
+    return value
@@ -1,70 +1,747 @@
-from typing import List, Dict
+from collections import Counter, namedtuple
+from dataclasses import replace
+from pathlib import Path
+from types import MappingProxyType
+from typing import List, Dict, Optional, Tuple
+from threading import Lock, RLock
+import logging
+import math
+import time
 from fastapi import HTTPException
-from sklearn.neighbors import NearestNeighbors
 import numpy as np
+import scipy.sparse as sp
 import pandas as pd
-from geopy.distance import geodesic
 
 from ..utils.database import DatabaseManager
 from ..utils.preprocessing import FeaturePreprocessor
+from ..utils.geo import coordinates_to_radians, get_distance_backend
+from ..utils.logger import log_event, sampled
+from ..utils.metrics import (
+    REQUEST_ERRORS_TOTAL, REQUEST_STAGE_SECONDS, REQUESTS_TOTAL, SEARCH_EXPANSIONS_TOTAL,
+    TRAINING_STAGE_SECONDS, TRAININGS_TOTAL, UPSERTS_TOTAL
+)
 from ..config.settings import settings
+from .cache import RecommendationCache
+from .index import build_neighbor_table, changed_rows, mark_stale, table_neighbors
+from .ingest import ingest_users
+from .persistence import (
+    POINTER_FILE, append_delta, load_latest_snapshot, load_snapshot, read_deltas, read_pointer, save_snapshot
+)
+from .rows import OverlayRows
+from .snapshot import (
+    ModelSnapshot, build_user_index, fit_indexes, max_search_neighbors, metadata_row, semester_window,
+    update_indexes
+)
+
+# Lista rankeada compacta que guarda el cache: filas (int32), scores (float32)
+# y diferencia de semestre (int8); los dicts de respuesta se arman por página
+RankedCandidates = namedtuple('RankedCandidates', ['rows', 'scores', 'semester_diffs'])
+
+# Lo que guarda el cache: la lista rankeada, cuántos vecinos se buscaron para
+# armarla y si ya se vio todo lo que la búsqueda puede devolver (no hay más que expandir)
+RankedSearch = namedtuple('RankedSearch', ['ranked', 'searched_k', 'complete'])
+
+
+def ranked_search_size(search: RankedSearch) -> int:
+    """Bytes que ocupa un RankedSearch en el cache: los de sus arrays"""
+    return sum(array.nbytes for array in search.ranked)
+
+
+# Peso de cada búsqueda en la media móvil de la tasa de paso de los filtros
+PASS_RATE_SMOOTHING = 0.1
+
+# Upserts guardados para el próximo delta; si se pasa, se guarda el snapshot completo
+MAX_PENDING_UPSERTS = 10_000
+
+logger = logging.getLogger(__name__)
 
 class AcademicMatcher:
     
     def __init__(self):
-        self.knn_model = None
         self.preprocessor = FeaturePreprocessor()
         self.db_manager = DatabaseManager()
-        self.user_data = None
-        self.feature_matrix = None
-        self.model_trained = False
-        self.features_list = None
-        self._recommendation_cache = {}
+        self.needs_full_retrain = False
+        self._distance_backend = get_distance_backend(settings.DISTANCE_BACKEND)
+        self._snapshot: Optional[ModelSnapshot] = None
+        self._drift_unknown_tokens = 0
+        self._drift_total_tokens = 0
+        self._write_lock = RLock()
+        self._train_lock = Lock()
+        self._training = False
+        self._upserts_during_training = set()
+        self._unpersisted_upserts = False
+        self._persist_lock = RLock()
+        self._delta_upserts = []  # (user_id, documento) aplicados desde el último guardado
+        self._persisted_base: Optional[Tuple[str, int]] = None  # (directorio, deltas) sobre el que agregar
+        self._pass_rate = 1.0  # fracción estimada de vecinos que pasa los filtros de semestre
+        self.recommendation_cache = RecommendationCache(
+            max_entries=settings.CACHE_MAX_ENTRIES,
+            max_bytes=settings.CACHE_MAX_BYTES,
+            ttl_seconds=settings.CACHE_TTL_SECONDS,
+            sizeof=ranked_search_size
+        )
+    
+    # Vistas de solo lectura del snapshot publicado (compatibilidad)
+    @property
+    def snapshot(self) -> Optional[ModelSnapshot]:
+        return self._snapshot
+    
+    @property
+    def model_trained(self) -> bool:
+        return self._snapshot is not None
+    
+    @property
+    def feature_matrix(self):
+        # Con particiones por semestre es una copia en orden de fila armada al pedirla
+        return self._snapshot.matrix_rows(slice(None)) if self._snapshot else None
+    
+    @property
+    def knn_model(self):
+        return self._snapshot.knn_model if self._snapshot else None
+    
+    @property
+    def user_data(self):
+        return self._snapshot.user_data if self._snapshot else None
+    
+    @property
+    def features_list(self):
+        return self._snapshot.features_list if self._snapshot else None
+    
+    def _require_snapshot(self) -> ModelSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise HTTPException(status_code=400, detail="Modelo no entrenado")
+        return snapshot
     
     def train_model(self):
+        """
+        Entrena un snapshot nuevo aparte y lo publica con un único swap
+        
+        Los requests siguen sirviendo el snapshot anterior mientras tanto.
+        Los upserts que llegan durante el entrenamiento se re-aplican sobre
+        el snapshot nuevo para no perderlos.
+        """
+        started = time.perf_counter()
+        with self._train_lock:
+            with self._write_lock:
+                self._training = True
+                self._upserts_during_training = set()
+            try:
+                snapshot = self._build_snapshot()
+            except Exception:
+                with self._write_lock:
+                    self._training = False
+                TRAININGS_TOTAL.inc(status="error")
+                raise
+            
+            with self._write_lock:
+                self._publish(snapshot)
+                self.needs_full_retrain = False
+                self._drift_unknown_tokens = 0
+                self._drift_total_tokens = 0
+                self.recommendation_cache.clear()
+                self._training = False
+                self._unpersisted_upserts = False
+                self._delta_upserts = []
+                self._persisted_base = None
+                pending = self._upserts_during_training
+                self._upserts_during_training = set()
+        
+        for user_id in pending:
+            try:
+                self.upsert_user(user_id)
+            except HTTPException as e:
+                logger.warning("⚠️ Upsert pendiente %s falló: %s", user_id, e.detail)
+        
+        TRAINING_STAGE_SECONDS.observe(time.perf_counter() - started, stage="total")
+        TRAININGS_TOTAL.inc(status="success")
+        
+        if settings.SNAPSHOT_DIR:
+            self._save_live_snapshot()
+        
+        result = {
+            "status": "success",
+            "users_processed": snapshot.user_count,
+            "features_shape": list(snapshot.stored_matrix.shape),
+            "k_neighbors": snapshot.k_neighbors,
+            "max_search_k": snapshot.max_search_k,
+            "feature_weights": snapshot.preprocessor.feature_weights,
+            "model_version": snapshot.version
+        }
+        
+        log_event(
+            logger, logging.INFO, "✅ Modelo entrenado",
+            users_processed=result["users_processed"],
+            features_shape=result["features_shape"],
+            k_neighbors=result["k_neighbors"],
+            max_search_k=result["max_search_k"],
+            model_version=result["model_version"]
+        )
+        return result
+    
+    def _build_snapshot(self) -> ModelSnapshot:
         try:
-            print("🚀 Iniciando entrenamiento del modelo KNN...")
+            logger.info("🚀 Iniciando entrenamiento del modelo KNN")
+            
+            # Marca leída antes de la carga: los deltas posteriores parten de aquí
+            watermark = self.db_manager.get_latest_update()
+            
+            # Vectorizadores nuevos: el snapshot publicado conserva los suyos
+            preprocessor = FeaturePreprocessor()
             
-            users_data = self.db_manager.get_active_users()
-            user_count = len(users_data)
+            # Lotes del cursor → columnas de texto y metadata, sin materializar todo antes
+            # (mongo_load y extract_features se miden por separado adentro)
+            columns = ingest_users(preprocessor, self.db_manager.iter_active_user_batches())
+            user_count = columns.received
             
             if user_count < settings.MIN_USERS_FOR_TRAINING:
                 raise ValueError(f"Insuficientes usuarios: {user_count} < {settings.MIN_USERS_FOR_TRAINING}")
             
-            self.features_list, self.user_data = self.preprocessor.extract_user_features(users_data)
-            self.feature_matrix = self.preprocessor.create_feature_matrix(self.features_list)
+            features_list, user_data = columns.features, columns.users
+            feature_matrix = preprocessor.fit_text_columns(*columns.texts)
+            match_tokens = OverlayRows(tuple(columns.match_tokens))
+            metadata = columns.metadata
+            del columns  # los textos ya no hacen falta
+            
+            with TRAINING_STAGE_SECONDS.time(stage="metadata"):
+                row_user_ids, user_index = build_user_index(features_list)
             
             optimal_k = min(
                 settings.OPTIMAL_K_NEIGHBORS,
-                max(3, len(self.features_list) - 1)
+                max(3, len(features_list) - 1)
             )
             
-            self.knn_model = NearestNeighbors(
-                n_neighbors=optimal_k,
-                metric=settings.KNN_METRIC,
-                algorithm=settings.KNN_ALGORITHM
+            # Índice único: responde cualquier k <= max_search_k sin re-entrenar por request
+            # (cada request busca solo lo que necesita su página, ver _search_for_page)
+            max_search_k = max_search_neighbors(len(features_list))
+            
+            logger.info("🧠 Entrenando KNN con k=%d (búsqueda hasta k=%d)", optimal_k, max_search_k)
+            with TRAINING_STAGE_SECONDS.time(stage="index_fit"):
+                feature_matrix, knn_model, semester_index = fit_indexes(
+                    feature_matrix, metadata['semesters'], optimal_k
+                )
+            
+            previous = self._snapshot
+            snapshot = ModelSnapshot(
+                version=(previous.version + 1) if previous else 1,
+                feature_matrix=feature_matrix,
+                knn_model=knn_model,
+                features_list=OverlayRows(tuple(features_list)),
+                user_data=OverlayRows(tuple(user_data)),
+                row_user_ids=row_user_ids,
+                user_index=user_index,
+                preprocessor=preprocessor,
+                match_tokens=match_tokens,
+                k_neighbors=optimal_k,
+                max_search_k=max_search_k,
+                watermark=watermark,
+                semester_index=semester_index,
+                **metadata
             )
             
-            print(f"🧠 Entrenando KNN con k={optimal_k}...")
-            self.knn_model.fit(self.feature_matrix)
-            self.model_trained = True
+            if settings.PRECOMPUTE_NEIGHBORS:
+                table_k = min(settings.NEIGHBOR_TABLE_SIZE, max_search_k)
+                with TRAINING_STAGE_SECONDS.time(stage="neighbor_table"):
+                    neighbor_table = build_neighbor_table(
+                        lambda start, end: self._search_neighbors(snapshot, slice(start, end), table_k),
+                        snapshot.user_count, table_k,
+                        chunk_rows=settings.NEIGHBOR_TABLE_CHUNK_ROWS,
+                        workers=settings.NEIGHBOR_TABLE_WORKERS
+                    )
+                snapshot = replace(snapshot, neighbor_table=neighbor_table)
+            return snapshot
+            
+        except Exception as e:
+            logger.error("❌ Error entrenando: %s", e, exc_info=True)
+            raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    def _persist_snapshot(self, snapshot: ModelSnapshot) -> Optional[Path]:
+        """Guarda el snapshot entrenado; un fallo de disco no invalida el entrenamiento"""
+        try:
+            with TRAINING_STAGE_SECONDS.time(stage="persist"):
+                path = save_snapshot(snapshot, settings.SNAPSHOT_DIR)
+            logger.info("💾 Snapshot guardado en %s", path)
+            return path
+        except Exception as e:
+            logger.warning("⚠️ No se pudo guardar el snapshot: %s", e, exc_info=True)
+            return None
+    
+    def _save_live_snapshot(self) -> bool:
+        """
+        Guarda completo el snapshot vivo; los deltas siguientes se agregan sobre él
+        
+        _persist_lock ordena los guardados: el último en escribir CURRENT es
+        también el último snapshot tomado.
+        """
+        with self._persist_lock:
+            with self._write_lock:
+                snapshot = self._snapshot
+                self._delta_upserts = []
+                self._unpersisted_upserts = False
+                self._persisted_base = None
+            
+            path = self._persist_snapshot(snapshot)
+            with self._write_lock:
+                if path is None:
+                    self._unpersisted_upserts = True
+                elif self._snapshot.version == snapshot.version:
+                    # Un entrenamiento publicado mientras tanto deja la base en None
+                    self._persisted_base = (path.name, 0)
+            return path is not None
+    
+    def restore_snapshot(self) -> bool:
+        """
+        Publica el snapshot más reciente de SNAPSHOT_DIR sin tocar Mongo
+        
+        Solo aplica si todavía no hay modelo publicado: nunca reemplaza un
+        modelo vivo por uno de disco. Re-aplica los deltas guardados sobre
+        él. Devuelve True si se restauró.
+        """
+        if not settings.SNAPSHOT_DIR or self._snapshot is not None:
+            return False
+        
+        with TRAINING_STAGE_SECONDS.time(stage="restore"):
+            snapshot = load_latest_snapshot(settings.SNAPSHOT_DIR)
+        if snapshot is None:
+            return False
+        
+        with self._write_lock:
+            if self._snapshot is not None:
+                return False
+            self._publish(snapshot)
+            self.recommendation_cache.clear()
+        
+        self._replay_deltas(Path(settings.SNAPSHOT_DIR) / snapshot.source)
+        with self._write_lock:
+            self._persisted_base = (self._snapshot.source, self._snapshot.deltas)
+        return True
+    
+    def refresh_from_disk(self) -> bool:
+        """
+        Publica el snapshot al que apunta CURRENT y sus deltas nuevos (workers reader)
+        
+        La matriz, la metadata y los índices se mapean de solo lectura, así
+        todos los readers comparten la misma memoria y sirven la misma
+        versión. Si CURRENT no cambió solo se aplican los deltas nuevos, sin
+        volver a mapear nada. Devuelve True si se publicó algo nuevo.
+        """
+        current = read_pointer(settings.SNAPSHOT_DIR)
+        snapshot = self._snapshot
+        if current is None:
+            return False
+        path = Path(settings.SNAPSHOT_DIR) / current
+        if snapshot is not None and snapshot.source == current:
+            return self._replay_deltas(path) > 0
+        
+        with TRAINING_STAGE_SECONDS.time(stage="restore"):
+            try:
+                updated = load_snapshot(path, mmap=True)
+            except Exception as e:
+                # Puede haberse podado entre leer CURRENT y cargarlo: se reintenta en la próxima vuelta
+                logger.warning("⚠️ No se pudo cargar %s (%s): %s", current, POINTER_FILE, e)
+                return False
+        
+        with self._write_lock:
+            self._publish(updated)
+            self.recommendation_cache.clear()
+        self._replay_deltas(path)
+        log_event(
+            logger, logging.INFO, "📦 Snapshot compartido publicado",
+            source=current,
+            model_version=updated.version,
+            revision=self._snapshot.revision,
+            deltas=self._snapshot.deltas,
+            users=self._snapshot.active_users
+        )
+        return True
+    
+    def _replay_deltas(self, path: Path) -> int:
+        """
+        Re-aplica los deltas de `path` que el snapshot vivo todavía no tiene
+        
+        Son los mismos upserts, en el mismo orden y con los mismos
+        vectorizadores que aplicó el entrenador, así las filas quedan iguales.
+        Devuelve cuántos deltas aplicó.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.source != path.name:
+            return 0
+        try:
+            deltas = read_deltas(path, snapshot.deltas)
+        except Exception as e:
+            logger.warning("⚠️ No se pudieron leer los deltas de %s: %s", path.name, e)
+            return 0
+        
+        applied = 0
+        for delta in deltas:
+            with self._write_lock:
+                if self._snapshot is not snapshot:
+                    break  # otro snapshot publicado mientras tanto
+                for user_id, user in delta["upserts"]:
+                    try:
+                        self._apply_user(user_id, user, record=False)
+                    except HTTPException as e:
+                        logger.warning("⚠️ Delta de %s falló: %s", user_id, e.detail)
+                snapshot = replace(
+                    self._snapshot,
+                    source=path.name,
+                    deltas=delta["sequence"] + 1,
+                    revision=delta["revision"],
+                    watermark=delta["watermark"]
+                )
+                self._publish(snapshot)
+            applied += 1
+        return applied
+    
+    def persist_pending(self) -> bool:
+        """
+        Persiste los upserts sin guardar (entrenador); True si guardó
+        
+        Se agregan como un delta al snapshot guardado en lugar de reescribirlo:
+        los readers los re-aplican sin volver a mapear nada. Se guarda
+        completo si no hay base o ya tiene SNAPSHOT_MAX_DELTAS deltas.
+        """
+        with self._persist_lock:
+            with self._write_lock:
+                if not self._unpersisted_upserts or self._snapshot is None:
+                    return False
+                base = self._persisted_base
+                if base is not None and base[1] < settings.SNAPSHOT_MAX_DELTAS:
+                    snapshot = self._snapshot
+                    upserts = self._delta_upserts
+                    self._delta_upserts = []
+                    self._unpersisted_upserts = False
+        
+            if base is None or base[1] >= settings.SNAPSHOT_MAX_DELTAS:
+                return self._save_live_snapshot()
+            
+            try:
+                append_delta(
+                    Path(settings.SNAPSHOT_DIR) / base[0], base[1], upserts, snapshot.revision, snapshot.watermark
+                )
+            except Exception as e:
+                logger.warning("⚠️ No se pudo guardar el delta: %s", e, exc_info=True)
+                with self._write_lock:
+                    self._delta_upserts = upserts + self._delta_upserts
+                    self._unpersisted_upserts = True
+                return False
             
-            self._recommendation_cache.clear()
+            with self._write_lock:
+                if self._persisted_base == base:
+                    self._persisted_base = (base[0], base[1] + 1)
+            return True
+    
+    def _publish(self, snapshot: ModelSnapshot):
+        """Publica un snapshot: una sola asignación de referencia"""
+        self.preprocessor = snapshot.preprocessor
+        self._snapshot = snapshot
+    
+    def upsert_user(self, user_id: str) -> Dict:
+        """
+        Actualiza un único usuario sin re-entrenar todo el modelo
+        
+        Lee solo ese documento, lo proyecta con los vectorizadores ya
+        entrenados y publica un snapshot derivado con su fila reemplazada
+        (o agregada/eliminada). Invalida solo las entradas de cache afectadas.
+        Si el vocabulario nuevo supera VOCAB_DRIFT_THRESHOLD marca
+        needs_full_retrain para que se programe un re-entrenamiento completo.
+        """
+        self._require_snapshot()
+        
+        user = self.db_manager.get_user_by_id(user_id, active_only=True)
+        return self.apply_user(user_id, user)
+    
+    def apply_user(self, user_id: str, user: Optional[Dict]) -> Dict:
+        """
+        Parte de upsert_user que no toca Mongo: aplica un documento ya leído
+        (None = inactivo o borrado). Los endpoints async leen con Motor y solo
+        esto corre en el pool.
+        """
+        self._require_snapshot()
+        return self._apply_user(user_id, user)
+    
+    def _apply_user(self, user_id: str, user: Optional[Dict], record: bool = True) -> Dict:
+        """apply_user; record=False para los deltas re-aplicados desde disco (ya están guardados)"""
+        with self._write_lock:
+            if self._training:
+                self._upserts_during_training.add(user_id)
             
-            result = {
-                "status": "success",
-                "users_processed": user_count,
-                "features_shape": list(self.feature_matrix.shape),
-                "k_neighbors": optimal_k,
-                "feature_weights": self.preprocessor.feature_weights
+            snapshot = self._snapshot
+            row = snapshot.user_index.get(user_id)
+            old_semester = int(snapshot.semesters[row]) if row is not None else None
+            
+            if user is None:
+                if row is None:
+                    UPSERTS_TOTAL.inc(action="ignored")
+                    return {"status": "ignored", "user_id": user_id, "needs_full_retrain": self.needs_full_retrain}
+                updated = self._remove_row(snapshot, row)
+                action = "removed"
+            else:
+                features, _ = snapshot.preprocessor.extract_user_features([user])
+                if not features:
+                    raise HTTPException(status_code=422, detail=f"Usuario {user_id} no procesable")
+                
+                feature_dict = features[0]
+                user_row = snapshot.preprocessor.transform_features(features)
+                self._track_vocabulary_drift(snapshot, feature_dict)
+                
+                if row is None:
+                    updated = self._insert_row(snapshot, feature_dict, user, user_row)
+                    action = "inserted"
+                else:
+                    updated = self._replace_row(snapshot, row, feature_dict, user, user_row)
+                    action = "updated"
+            
+            self._publish(updated)
+            if record:
+                self._record_upsert(user_id, user)
+            self._invalidate_user_cache(updated, user_id, old_semester)
+            UPSERTS_TOTAL.inc(action=action)
+            
+            log_event(
+                logger, logging.INFO, "✅ Upsert",
+                action=action,
+                user_id=user_id,
+                vocabulary_drift=round(self.vocabulary_drift, 4),
+                revision=updated.revision
+            )
+            return {
+                "status": action,
+                "user_id": user_id,
+                "users_loaded": updated.active_users,
+                "vocabulary_drift": round(self.vocabulary_drift, 4),
+                "needs_full_retrain": self.needs_full_retrain
             }
+    
+    def _record_upsert(self, user_id: str, user: Optional[Dict]):
+        """Anota el upsert para el próximo delta (ver persist_pending)"""
+        self._unpersisted_upserts = True
+        if not settings.SNAPSHOT_DIR:
+            return
+        if len(self._delta_upserts) >= MAX_PENDING_UPSERTS:
+            # Más barato guardar todo que re-aplicarlos en cada reader
+            self._delta_upserts = []
+            self._persisted_base = None
+            return
+        self._delta_upserts.append((user_id, user))
+    
+    def sync_changes(self) -> Dict:
+        """
+        Aplica solo los usuarios cambiados desde la marca del snapshot (delta)
+        
+        Trae de Mongo únicamente los documentos con UPDATED_AT_FIELD >= marca
+        y los aplica como upserts. Si no hay marca o cambiaron más de
+        DELTA_MAX_FRACTION de los usuarios, pide un re-entrenamiento completo
+        en lugar de aplicarlos uno por uno.
+        """
+        # Un entrenamiento en curso ya trae todo: el delta espera y parte de su marca
+        with self._train_lock:
+            snapshot = self._require_snapshot()
+            if snapshot.watermark is None:
+                return {"status": "no_watermark", "applied": 0, "needs_full_retrain": True}
             
-            print(f"✅ Modelo entrenado: {result}")
-            return result
+            changes = self.db_manager.get_users_changed_since(snapshot.watermark)
+            changed = len(changes["active"]) + len(changes["inactive_ids"])
+            if changed > settings.DELTA_MAX_FRACTION * snapshot.active_users:
+                return {"status": "too_many_changes", "applied": 0, "changed": changed, "needs_full_retrain": True}
             
-        except Exception as e:
-            print(f"❌ Error entrenando: {e}")
-            raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+            applied = 0
+            pending = [(user["user_id"], user) for user in changes["active"]]
+            pending += [(user_id, None) for user_id in changes["inactive_ids"]]
+            for user_id, user in pending:
+                row = self._snapshot.user_index.get(user_id)
+                if (user is None and row is None) or (row is not None and self._snapshot.user_data[row] == user):
+                    continue  # sin cambios en lo que usa el modelo (p. ej. el borde de la marca)
+                try:
+                    self.apply_user(user_id, user)
+                    applied += 1
+                except HTTPException as e:
+                    logger.warning("⚠️ Delta de %s falló: %s", user_id, e.detail)
+            
+            with self._write_lock:
+                self._publish(replace(self._snapshot, watermark=changes["watermark"]))
+        
+        log_event(
+            logger, logging.INFO, "🔁 Delta aplicado",
+            changed=changed,
+            applied=applied,
+            watermark=changes["watermark"],
+            needs_full_retrain=self.needs_full_retrain
+        )
+        return {
+            "status": "synced",
+            "applied": applied,
+            "changed": changed,
+            "needs_full_retrain": self.needs_full_retrain
+        }
+    
+    def _derive_snapshot(
+        self, snapshot, features_list, user_data, metadata, user_row=None, deleted=None, inserted=None
+    ):
+        """
+        Snapshot nuevo a partir de otro (copy-on-write)
+        
+        La matriz y los índices KNN se actualizan solo en la fila que cambió
+        (deleted / inserted, ver CosineIndex.with_rows) en lugar de ajustarse de cero.
+        """
+        feature_matrix, knn_model, semester_index = update_indexes(
+            snapshot, metadata['semesters'], user_row, deleted=deleted, inserted=inserted
+        )
+        
+        return replace(
+            snapshot,
+            feature_matrix=feature_matrix,
+            knn_model=knn_model,
+            semester_index=semester_index,
+            features_list=features_list,
+            user_data=user_data,
+            max_search_k=max_search_neighbors(len(features_list)),
+            revision=snapshot.revision + 1,
+            source=None,
+            **metadata
+        )
+    
+    @staticmethod
+    def _metadata_arrays(snapshot):
+        return {
+            'semesters': snapshot.semesters,
+            'ages': snapshot.ages,
+            'coordinates_rad': snapshot.coordinates_rad
+        }
+    
+    @staticmethod
+    def _assign_row(snapshot, row, user_id):
+        """row_user_ids, user_index y removed con `row` asignada a user_id (None = lápida)"""
+        row_user_ids = snapshot.row_user_ids.copy()
+        user_index = dict(snapshot.user_index)
+        removed = np.zeros(len(row_user_ids), dtype=bool) if snapshot.removed is None else snapshot.removed.copy()
+        user_index.pop(row_user_ids[row], None)
+        row_user_ids[row] = user_id
+        removed[row] = user_id is None
+        if user_id is not None:
+            user_index[user_id] = row
+        return {'row_user_ids': row_user_ids, 'user_index': MappingProxyType(user_index), 'removed': removed}
+    
+    def _insert_row(self, snapshot, feature_dict, user, user_row):
+        """Alta: reusa la fila de un usuario eliminado si hay una libre; si no, agrega una al final"""
+        row = snapshot.free_row()
+        if row is None:
+            return self._append_row(snapshot, feature_dict, user, user_row)
+        return self._replace_row(snapshot, row, feature_dict, user, user_row)
+    
+    def _replace_row(self, snapshot, row, feature_dict, user, user_row):
+        features_list = snapshot.features_list.with_row(row, feature_dict)
+        user_data = snapshot.user_data.with_row(row, user)
+        
+        metadata = {name: array.copy() for name, array in self._metadata_arrays(snapshot).items()}
+        semester, age, coordinates = metadata_row(feature_dict)
+        metadata['semesters'][row] = semester
+        metadata['ages'][row] = age
+        metadata['coordinates_rad'][row] = coordinates_to_radians(coordinates)[0]
+        tokens = snapshot.preprocessor.match_tokens(user)
+        metadata['match_tokens'] = snapshot.match_tokens.with_row(row, tokens)
+        if snapshot.removed is not None and snapshot.removed[row]:
+            metadata.update(self._assign_row(snapshot, row, feature_dict['user_id']))
+        # Su fila en la tabla ya no vale; en las listas ajenas se re-puntúa al leer
+        # (y entra donde ahora corresponda, ver table_neighbors)
+        metadata['neighbor_table'] = mark_stale(snapshot.neighbor_table, row)
+        return self._derive_snapshot(
+            snapshot, features_list, user_data, metadata, user_row=user_row, deleted=row, inserted=row
+        )
+    
+    def _append_row(self, snapshot, feature_dict, user, user_row):
+        row = snapshot.user_count
+        features_list = snapshot.features_list.with_row(row, feature_dict)
+        user_data = snapshot.user_data.with_row(row, user)
+        
+        semester, age, coordinates = metadata_row(feature_dict)
+        metadata = {
+            'semesters': np.append(snapshot.semesters, np.int16(semester)),
+            'ages': np.append(snapshot.ages, np.int16(age)),
+            'coordinates_rad': np.vstack([snapshot.coordinates_rad, coordinates_to_radians(coordinates)]),
+            'match_tokens': snapshot.match_tokens.with_row(row, snapshot.preprocessor.match_tokens(user)),
+            'row_user_ids': np.append(snapshot.row_user_ids, feature_dict['user_id']),
+            'user_index': MappingProxyType({**snapshot.user_index, feature_dict['user_id']: row}),
+            'removed': None if snapshot.removed is None else np.append(snapshot.removed, False)
+        }
+        return self._derive_snapshot(
+            snapshot, features_list, user_data, metadata, user_row=user_row, inserted=row
+        )
+    
+    def _remove_row(self, snapshot, row):
+        if snapshot.active_users - 1 < settings.MIN_USERS_FOR_TRAINING:
+            raise HTTPException(status_code=409, detail="Eliminar el usuario dejaría el modelo sin datos suficientes")
+        
+        # Lápida: la fila queda vacía (a distancia 1 de todas) y fuera de user_index
+        # hasta que un alta la reuse. Las demás filas no se mueven, así la tabla de
+        # vecinos y las listas cacheadas fuera de su ventana siguen valiendo
+        features_list = snapshot.features_list.with_row(row, None)
+        user_data = snapshot.user_data.with_row(row, None)
+        matrix = snapshot.stored_matrix
+        empty_row = sp.csr_matrix((1, matrix.shape[1]), dtype=matrix.dtype)
+        
+        metadata = self._assign_row(snapshot, row, None)
+        metadata['semesters'] = snapshot.semesters  # sigue en su partición: no se re-ordena nada
+        metadata['neighbor_table'] = mark_stale(snapshot.neighbor_table, row)
+        return self._derive_snapshot(
+            snapshot, features_list, user_data, metadata, user_row=empty_row, deleted=row, inserted=row
+        )
+    
+    @property
+    def vocabulary_drift(self) -> float:
+        """Tokens fuera de vocabulario desde el último entrenamiento, sobre la referencia del corpus"""
+        if not self._drift_total_tokens or self._snapshot is None:
+            return 0.0
+        observed = self._drift_unknown_tokens / self._drift_total_tokens
+        return max(0.0, observed - self._snapshot.preprocessor.baseline_oov_rate)
+    
+    def _track_vocabulary_drift(self, snapshot, feature_dict):
+        unknown, total = snapshot.preprocessor.vocabulary_coverage(feature_dict)
+        self._drift_unknown_tokens += unknown
+        self._drift_total_tokens += total
+        
+        if (self._drift_total_tokens >= settings.VOCAB_DRIFT_MIN_TOKENS
+                and self.vocabulary_drift > settings.VOCAB_DRIFT_THRESHOLD):
+            self.needs_full_retrain = True
+    
+    def _cache_searches(self, snapshot: ModelSnapshot, searches: Dict[str, RankedSearch]):
+        """
+        Guarda búsquedas calculadas sobre `snapshot` si sigue siendo el publicado
+
+        Chequeo y escritura van bajo _write_lock: un upsert publica e invalida
+        dentro del mismo lock, así una lista calculada antes del upsert no
+        puede guardarse después de su invalidación.
+        """
+        with self._write_lock:
+            if snapshot is not self._snapshot:
+                return
+            for user_id, search in searches.items():
+                self.recommendation_cache.put((user_id, snapshot.version), search, user_id)
+    
+    def _invalidate_user_cache(self, snapshot: ModelSnapshot, user_id: str, old_semester: Optional[int]):
+        """
+        Elimina el cache del usuario y el de todos los que pueden tenerlo como candidato
+
+        Las listas cacheadas guardan filas ya rankeadas: un usuario nuevo o
+        actualizado puede entrar en la lista de cualquiera cuyo semestre caiga
+        en su ventana (antes o después del cambio), aunque no figurara en ella.
+        Uno eliminado solo puede salir de las de su ventana: su fila queda
+        como lápida y las demás no se mueven.
+        """
+        affected = set()
+        row = snapshot.user_index.get(user_id)
+        new_semester = int(snapshot.semesters[row]) if row is not None else None
+        for semester in (old_semester, new_semester):
+            if semester is not None:
+                lo, hi = semester_window(semester)
+                affected.update(range(lo, hi + 1))
+        
+        def in_window(cached_user_id):
+            cached_row = snapshot.user_index.get(cached_user_id)
+            return cached_row is None or int(snapshot.semesters[cached_row]) in affected
+        
+        self.recommendation_cache.invalidate_user(user_id)
+        self.recommendation_cache.invalidate_users(in_window)
     
     def _generate_smart_preferences(self, user_info: Dict) -> Dict:
         user_age = user_info.get('age', 21)
@@ -86,8 +763,9 @@ class AcademicMatcher:
         page: int = 1,
         use_cache: bool = True
     ):
-        if not self.model_trained:
-            raise HTTPException(status_code=400, detail="Modelo no entrenado")
+        # Un único snapshot por request: el re-entrenamiento no lo muta
+        snapshot = self._require_snapshot()
+        started = time.perf_counter()
         
         if limit is None:
             limit = settings.DEFAULT_RECOMMENDATION_LIMIT
@@ -96,202 +774,490 @@ class AcademicMatcher:
             raise HTTPException(status_code=400, detail="page debe ser >= 1")
         
         try:
-            user_mask = self.user_data['user_id'] == user_id
-            if not user_mask.any():
+            user_idx = snapshot.user_index.get(user_id)
+            if user_idx is None:
                 raise HTTPException(status_code=404, detail=f"Usuario {user_id} no encontrado")
             
-            user_idx = self.user_data[user_mask].index[0]
-            
-            cache_key = f"{user_id}:{','.join(sorted(exclude_users))}"
-            
-            if use_cache and cache_key in self._recommendation_cache:
-                print(f"✅ Usando cache para {user_id}")
-                all_recommendations = self._recommendation_cache[cache_key]
-            else:
-                all_recommendations = self._generate_all_recommendations(
-                    user_id, user_idx, exclude_users
-                )
-                
-                if use_cache:
-                    self._recommendation_cache[cache_key] = all_recommendations
-            
-            total_results = len(all_recommendations)
-            start_idx = (page - 1) * limit
-            end_idx = start_idx + limit
-            
-            if start_idx >= total_results and total_results > 0:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"page {page} fuera de rango (total: {total_results}, límite: {limit})"
-                )
+            # Una lista rankeada por usuario y versión de modelo; las exclusiones
+            # (swipes) se aplican al leer, así el cache sobrevive a cada swipe
+            cache_key = (user_id, snapshot.version)
+            with REQUEST_STAGE_SECONDS.time(stage="cache_lookup"):
+                cached = self.recommendation_cache.get(cache_key) if use_cache else None
+            filter_stats = {}
+            excluded_rows = self._excluded_rows(snapshot, exclude_users)
             
-            paginated_recommendations = all_recommendations[start_idx:end_idx]
+            # Solo se busca (o se profundiza lo cacheado) hasta llenar la página pedida
+            search, expansions = self._search_for_page(
+                snapshot, user_idx, page * limit, excluded_rows, filter_stats, cached
+            )
+            cache_hit = cached is not None and search is cached
             
-            total_pages = (total_results + limit - 1) // limit
-            has_next = end_idx < total_results
-            has_prev = page > 1
+            if use_cache and not cache_hit:
+                self._cache_searches(snapshot, {user_id: search})
             
-            user_info = self.features_list[user_idx]
-            user_prefs = self._generate_smart_preferences(user_info)
-            compatibility_metrics = self._calculate_compatibility_metrics(
-                paginated_recommendations, user_info
+            result = self._paginate(
+                snapshot, user_idx, search, excluded_rows, limit, page, cache_hit, expansions
             )
             
-            print(f"\n{'='*70}")
-            print(f"📄 PAGINACIÓN:")
-            print(f"   Página: {page}/{total_pages}")
-            print(f"   Resultados: {len(paginated_recommendations)}/{total_results}")
-            print(f"   Rango: {start_idx + 1}-{min(end_idx, total_results)}")
-            print(f"{'='*70}\n")
+            elapsed = time.perf_counter() - started
+            REQUEST_STAGE_SECONDS.observe(elapsed, stage="total")
+            REQUESTS_TOTAL.inc(endpoint="recommendations", cache="hit" if cache_hit else "miss")
             
-            return {
-                "recommendations": paginated_recommendations,
-                "pagination": {
-                    "page": page,
-                    "limit": limit,
-                    "total": total_results,
-                    "total_pages": total_pages,
-                    "has_next": has_next,
-                    "has_prev": has_prev,
-                    "showing": len(paginated_recommendations)
-                },
-                "compatibility_metrics": compatibility_metrics,
-                "user_preferences_applied": user_prefs,
-                "filter_priority": "Semestre (principal) + Skills + Objectives",
-                "cache_used": use_cache and cache_key in self._recommendation_cache
-            }
+            if sampled(logger, logging.INFO):
+                pagination = result["pagination"]
+                log_event(
+                    logger, logging.INFO, "recommendations",
+                    user_id=user_id,
+                    cache_hit=cache_hit,
+                    page=page,
+                    limit=limit,
+                    returned=pagination["showing"],
+                    total=pagination["total"],
+                    total_is_estimate=pagination["total_is_estimate"],
+                    excluded=len(search.ranked.rows) - pagination["total"],
+                    searched_neighbors=search.searched_k,
+                    expansions=expansions,
+                    model_version=snapshot.version,
+                    elapsed_ms=round(elapsed * 1000, 2),
+                    **filter_stats
+                )
+            return result
             
-        except HTTPException:
+        except HTTPException as e:
+            REQUEST_ERRORS_TOTAL.inc(endpoint="recommendations", status=e.status_code)
             raise
         except Exception as e:
-            print(f"❌ Error: {e}")
-            import traceback
-            traceback.print_exc()
+            REQUEST_ERRORS_TOTAL.inc(endpoint="recommendations", status=500)
+            logger.error("❌ Error generando recomendaciones para %s: %s", user_id, e, exc_info=True)
             raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
     
-    def _generate_all_recommendations(
-        self, 
-        user_id: str, 
-        user_idx: int, 
-        exclude_users: List[str]
-    ) -> List[Dict]:
-        user_features = self.feature_matrix[user_idx].reshape(1, -1)
-        user_info = self.features_list[user_idx]
-        user_prefs = self._generate_smart_preferences(user_info)
+    def get_batch_recommendations(self, items: List[Dict], use_cache: bool = True) -> Dict:
+        """
+        Recomendaciones para muchos usuarios con una sola consulta de vecinos
         
-        print(f"\n{'='*70}")
-        print(f"👤 Generando cache de recomendaciones para: {user_id}")
-        print(f"   Edad: {user_info['age']}")
-        print(f"   Semestre: {user_info['semester']} → Rango: {user_prefs['semester_min']}-{user_prefs['semester_max']}")
-        print(f"   📍 Distancia máxima: {user_prefs['max_distance']} km")
-        print(f"{'='*70}\n")
+        Los usuarios sin cache salen de la tabla precomputada si la hay; el
+        resto se resuelve junto en un único kneighbors sobre sus filas (la
+        distancia se calcula por bloques), con el k inicial más grande que
+        pidan sus páginas. Quien quede corto se expande por separado.
+        Comparte el cache por usuario con get_recommendations.
         
-        search_k = min(
-            len(self.user_data) - 1,
-            100
-        )
+        Args:
+            items: dicts con user_id y opcionalmente exclude_users, limit, page;
+                   cada user_id una sola vez (los resultados van por user_id)
+        """
+        snapshot = self._require_snapshot()
+        started = time.perf_counter()
         
-        if search_k > self.knn_model.n_neighbors:
-            temp_knn = NearestNeighbors(
-                n_neighbors=search_k,
-                metric=settings.KNN_METRIC,
-                algorithm=settings.KNN_ALGORITHM
-            )
-            temp_knn.fit(self.feature_matrix)
-            distances, indices = temp_knn.kneighbors(user_features)
-            print(f"🔍 KNN extendido: {search_k} vecinos")
-        else:
-            distances, indices = self.knn_model.kneighbors(user_features)
-            print(f"🔍 KNN base: {len(indices[0])} vecinos")
-        
-        recommendations = []
-        filtered_counts = {
-            'excluded': 0,
-            'semester': 0,
-            'accepted': 0
-        }
+        repeated = sorted(user_id for user_id, count in Counter(item["user_id"] for item in items).items() if count > 1)
+        if repeated:
+            REQUEST_ERRORS_TOTAL.inc(endpoint="batch", status=400)
+            raise HTTPException(status_code=400, detail=f"user_id repetidos en el batch: {', '.join(repeated)}")
         
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if i == 0:
-                continue
-            
-            candidate_id = self.user_data.iloc[idx]['user_id']
-            
-            if candidate_id in exclude_users:
-                filtered_counts['excluded'] += 1
-                continue
-            
-            candidate_info = self.features_list[idx]
-            candidate_data = self.user_data.iloc[idx]
-            
-            semester_diff = abs(user_info['semester'] - candidate_info['semester'])
-            
-            if semester_diff > settings.MAX_SEMESTER_DIFFERENCE:
-                filtered_counts['semester'] += 1
+        cached_by_user = {}
+        errors = {}
+        misses = {}
+        
+        for item in items:
+            user_id = item["user_id"]
+            user_idx = snapshot.user_index.get(user_id)
+            if user_idx is None:
+                errors[user_id] = f"Usuario {user_id} no encontrado"
+                REQUEST_ERRORS_TOTAL.inc(endpoint="batch", status=404)
                 continue
             
-            candidate_semester = candidate_info['semester']
-            if not (user_prefs['semester_min'] <= candidate_semester <= user_prefs['semester_max']):
-                filtered_counts['semester'] += 1
+            cached = self.recommendation_cache.get((user_id, snapshot.version)) if use_cache else None
+            if cached is not None:
+                cached_by_user[user_id] = (user_idx, cached)
+            else:
+                misses[user_id] = user_idx
+        
+        requests = []
+        needed = {}
+        for item in items:
+            user_id = item["user_id"]
+            if user_id in errors:
                 continue
-            
-            distance_km = self._calculate_distance(user_info, candidate_info)
-            
-            base_similarity = max(0, 1 - distance)
-            
-            semester_bonus = 0
-            if semester_diff == 0:
-                semester_bonus = 0.20
-            elif semester_diff == 1:
-                semester_bonus = 0.15
-            
-            final_score = min(1.0, base_similarity + semester_bonus)
-            
-            recommendation = self._build_recommendation(
-                candidate_id, final_score, candidate_data, 
-                user_idx, idx, semester_diff, distance_km
+            limit = item.get("limit") or settings.DEFAULT_RECOMMENDATION_LIMIT
+            page = item.get("page") or 1
+            excluded_rows = self._excluded_rows(snapshot, item.get("exclude_users") or [])
+            requests.append((user_id, excluded_rows, limit, page))
+            needed[user_id] = page * limit + len(excluded_rows)
+        
+        filter_stats = {}
+        searches = {}
+        online = {}
+        for user_id, user_idx in misses.items():
+            k = min(self._initial_search_k(needed[user_id]), self._search_depth(snapshot, user_idx))
+            with REQUEST_STAGE_SECONDS.time(stage="neighbor_table"):
+                found = self._table_neighbors(snapshot, user_idx, k)
+            if found is not None:
+                searches[user_id] = self._rank_search(snapshot, user_idx, k, found, filter_stats)
+            else:
+                online[user_id] = (user_idx, k)
+        
+        if online:
+            rows = np.fromiter((user_idx for user_idx, _ in online.values()), dtype=np.intp, count=len(online))
+            batch_k = max(k for _, k in online.values())
+            with REQUEST_STAGE_SECONDS.time(stage="neighbor_query_batch"):
+                found_all = self._search_neighbors(snapshot, rows, batch_k)
+            for (user_id, (user_idx, _)), found in zip(online.items(), found_all):
+                searches[user_id] = self._rank_search(snapshot, user_idx, batch_k, found, filter_stats)
+        
+        for user_id, (user_idx, cached) in cached_by_user.items():
+            searches[user_id] = cached
+        
+        results = {}
+        for user_id, excluded_rows, limit, page in requests:
+            user_idx = snapshot.user_index[user_id]
+            previous = searches[user_id]
+            try:
+                search, expansions = self._search_for_page(
+                    snapshot, user_idx, page * limit, excluded_rows, filter_stats, previous
+                )
+                searches[user_id] = search
+                cache_hit = user_id in cached_by_user and search is cached_by_user[user_id][1]
+                results[user_id] = self._paginate(
+                    snapshot, user_idx, search, excluded_rows, limit, page, cache_hit, expansions
+                )
+            except HTTPException as e:
+                errors[user_id] = e.detail
+                REQUEST_ERRORS_TOTAL.inc(endpoint="batch", status=e.status_code)
+        
+        if use_cache:
+            self._cache_searches(snapshot, {
+                user_id: search for user_id, search in searches.items()
+                if user_id not in cached_by_user or search is not cached_by_user[user_id][1]
+            })
+        
+        users = len(cached_by_user) + len(misses)
+        elapsed = time.perf_counter() - started
+        REQUEST_STAGE_SECONDS.observe(elapsed, stage="batch_total")
+        REQUESTS_TOTAL.inc(len(cached_by_user), endpoint="batch", cache="hit")
+        REQUESTS_TOTAL.inc(len(misses), endpoint="batch", cache="miss")
+        
+        if sampled(logger, logging.INFO):
+            log_event(
+                logger, logging.INFO, "batch_recommendations",
+                items=len(items),
+                users=users,
+                cache_hits=len(cached_by_user),
+                cache_misses=len(misses),
+                errors=len(errors),
+                model_version=snapshot.version,
+                elapsed_ms=round(elapsed * 1000, 2),
+                **filter_stats
             )
-            recommendations.append(recommendation)
-            filtered_counts['accepted'] += 1
         
-        print(f"\n{'='*70}")
-        print(f"📊 RESUMEN DE FILTRADO:")
-        print(f"   Total evaluados: {len(indices[0]) - 1}")
-        print(f"   Excluidos: {filtered_counts['excluded']}")
-        print(f"   Rechazados por semestre: {filtered_counts['semester']}")
-        print(f"   ✅ ACEPTADOS: {filtered_counts['accepted']}")
-        print(f"{'='*70}\n")
+        return {
+            "results": results,
+            "errors": errors,
+            "model_version": snapshot.version
+        }
+    
+    @staticmethod
+    def _excluded_rows(snapshot: ModelSnapshot, exclude_users: List[str]) -> np.ndarray:
+        """Filas de los usuarios excluidos (swipes) que existen en el snapshot"""
+        return np.fromiter(
+            (snapshot.user_index[excluded_id] for excluded_id in exclude_users
+             if excluded_id in snapshot.user_index),
+            dtype=np.int32
+        )
+    
+    def _paginate(
+        self,
+        snapshot: ModelSnapshot,
+        user_idx: int,
+        search: RankedSearch,
+        excluded_rows: np.ndarray,
+        limit: int,
+        page: int,
+        cache_hit: bool,
+        expansions: int = 0
+    ) -> Dict:
+        """Aplica exclusiones sobre la lista rankeada y arma la página pedida"""
+        if len(excluded_rows):
+            with REQUEST_STAGE_SECONDS.time(stage="exclusions"):
+                keep = ~np.isin(search.ranked.rows, excluded_rows)
+                all_recommendations = RankedCandidates(*(array[keep] for array in search.ranked))
+        else:
+            all_recommendations = search.ranked
+        
+        total_results = len(all_recommendations.rows)
+        start_idx = (page - 1) * limit
+        end_idx = start_idx + limit
+        
+        if start_idx >= total_results and total_results > 0:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"page {page} fuera de rango (total: {total_results}, límite: {limit})"
+            )
+        
+        # Dicts completos (razones, preview, distancia) solo para la página pedida
+        paginated_recommendations = self._build_page(
+            snapshot, user_idx,
+            RankedCandidates(*(array[start_idx:end_idx] for array in all_recommendations))
+        )
+        
+        total_pages = (total_results + limit - 1) // limit
+        # Sin búsqueda completa puede haber más candidatos aunque la lista termine aquí
+        has_next = end_idx < total_results or not search.complete
+        has_prev = page > 1
+        
+        user_info = snapshot.features_list[user_idx]
+        user_prefs = self._generate_smart_preferences(user_info)
+        compatibility_metrics = self._calculate_compatibility_metrics(
+            paginated_recommendations, user_info
+        )
+        
+        return {
+            "recommendations": paginated_recommendations,
+            "pagination": {
+                "page": page,
+                "limit": limit,
+                "total": total_results,
+                "total_pages": total_pages,
+                "total_is_estimate": not search.complete,
+                "has_next": has_next,
+                "has_prev": has_prev,
+                "showing": len(paginated_recommendations)
+            },
+            "search": {
+                "searched_neighbors": search.searched_k,
+                "expansions": expansions,
+                "pass_rate_estimate": round(self._pass_rate, 4),
+                "complete": search.complete
+            },
+            "compatibility_metrics": compatibility_metrics,
+            "user_preferences_applied": user_prefs,
+            "filter_priority": "Semestre (principal) + Skills + Objectives",
+            "cache_used": cache_hit
+        }
+    
+    def _search_for_page(
+        self,
+        snapshot: ModelSnapshot,
+        user_idx: int,
+        needed: int,
+        excluded_rows: np.ndarray,
+        filter_stats: Optional[Dict] = None,
+        search: Optional[RankedSearch] = None
+    ):
+        """
+        Lista rankeada con al menos `needed` candidatos fuera de las exclusiones
+        
+        Sin lista previa (cache), el primer k es needed / tasa de paso estimada;
+        mientras los filtros dejen la página corta y queden vecinos por ver, k
+        se multiplica por SEARCH_GROWTH_FACTOR. Devuelve (búsqueda, expansiones).
+        """
+        if search is None:
+            k = self._initial_search_k(needed + len(excluded_rows))
+            search = self._ranked_search(snapshot, user_idx, k, filter_stats)
         
-        return recommendations
+        expansions = 0
+        while not search.complete and self._available(search.ranked, excluded_rows) < needed:
+            k = max(search.searched_k + 1, math.ceil(search.searched_k * settings.SEARCH_GROWTH_FACTOR))
+            search = self._extend_search(search, self._ranked_search(snapshot, user_idx, k, filter_stats))
+            expansions += 1
+        if expansions:
+            SEARCH_EXPANSIONS_TOTAL.inc(expansions)
+        return search, expansions
     
-    def _calculate_distance(self, user_info, candidate_info):
-        try:
-            user_coords = user_info.get('location', settings.DEFAULT_COORDINATES)
-            candidate_coords = candidate_info.get('location', settings.DEFAULT_COORDINATES)
-            
-            distance = geodesic(
-                (user_coords[1], user_coords[0]),
-                (candidate_coords[1], candidate_coords[0])
-            ).km
-            
-            return distance
-        except:
-            return 0.0
+    @staticmethod
+    def _extend_search(previous: RankedSearch, deeper: RankedSearch) -> RankedSearch:
+        """
+        La búsqueda más profunda con la lista anterior como prefijo
+        
+        Las páginas ya servidas salen de la lista anterior: la nueva solo
+        agrega al final las filas que aquella no tenía. Con la búsqueda exacta
+        ya es un prefijo; la tabla precomputada (similitudes float32) y LSH
+        (candidatos por buckets o búsqueda exacta según k) pueden ordenar o
+        elegir distinto, y sin esto las páginas repetirían o saltearían filas.
+        """
+        new = ~np.isin(deeper.ranked.rows, previous.ranked.rows)
+        ranked = RankedCandidates(*(
+            np.concatenate([served, found[new]]) for served, found in zip(previous.ranked, deeper.ranked)
+        ))
+        return RankedSearch(ranked, deeper.searched_k, deeper.complete)
+    
+    @staticmethod
+    def _available(ranked: RankedCandidates, excluded_rows: np.ndarray) -> int:
+        if not len(excluded_rows):
+            return len(ranked.rows)
+        return len(ranked.rows) - int(np.count_nonzero(np.isin(ranked.rows, excluded_rows)))
+    
+    def _initial_search_k(self, needed: int) -> int:
+        """k para conseguir `needed` candidatos según la tasa de paso de los filtros (+1: la propia fila)"""
+        pass_rate = max(self._pass_rate, settings.SEARCH_MIN_PASS_RATE)
+        return max(settings.SEARCH_MIN_NEIGHBORS, math.ceil(needed / pass_rate) + 1)
+    
+    @staticmethod
+    def _search_depth(snapshot: ModelSnapshot, user_idx: int) -> int:
+        """Vecinos que puede devolver la búsqueda de la fila: su ventana de semestres o todo el índice"""
+        if snapshot.semester_index is not None:
+            available = snapshot.semester_index.window_size(int(snapshot.semesters[user_idx]))
+        else:
+            available = snapshot.user_count
+        return min(available, snapshot.max_search_k)
+    
+    def _ranked_search(
+        self,
+        snapshot: ModelSnapshot,
+        user_idx: int,
+        k: int,
+        filter_stats: Optional[Dict] = None
+    ) -> RankedSearch:
+        """Busca k vecinos de la fila (tabla precomputada si alcanza) y los rankea"""
+        k = min(k, self._search_depth(snapshot, user_idx))
+        with REQUEST_STAGE_SECONDS.time(stage="neighbor_table"):
+            found = self._table_neighbors(snapshot, user_idx, k)
+        if found is None:
+            with REQUEST_STAGE_SECONDS.time(stage="neighbor_query"):
+                found, = self._search_neighbors(snapshot, slice(user_idx, user_idx + 1), k)
+        return self._rank_search(snapshot, user_idx, k, found, filter_stats)
+    
+    def _rank_search(self, snapshot, user_idx, k, found, filter_stats=None) -> RankedSearch:
+        """RankedSearch a partir de los vecinos encontrados; actualiza la tasa de paso estimada"""
+        distances, indices = found
+        stats = {}
+        ranked = self._rank_neighbors(snapshot, user_idx, distances, indices, stats)
+        self._observe_pass_rate(stats)
+        if filter_stats is not None:
+            for name, count in stats.items():
+                filter_stats[name] = filter_stats.get(name, 0) + count
+        
+        searched = len(indices)
+        # Menos de lo pedido: la ventana no tiene más filas
+        complete = searched < k or searched >= self._search_depth(snapshot, user_idx)
+        return RankedSearch(ranked, searched, complete)
+    
+    def _observe_pass_rate(self, stats: Dict):
+        """Media móvil de la fracción de vecinos que pasa los filtros"""
+        evaluated = stats.get('candidates_evaluated', 0)
+        if evaluated:
+            observed = stats['accepted'] / evaluated
+            self._pass_rate += PASS_RATE_SMOOTHING * (observed - self._pass_rate)
+    
+    @staticmethod
+    def _table_neighbors(snapshot: ModelSnapshot, user_idx: int, k: int):
+        """Vecinos de la tabla precomputada si cubre k (o la ventana entera); None si hay que buscar"""
+        if snapshot.neighbor_table is None:
+            return None
+        
+        eligible = None
+        if snapshot.semester_index is not None:
+            # Los usuarios cambiados entran solo si la búsqueda en línea los devolvería
+            lo, hi = snapshot.semester_index.windows[int(snapshot.semesters[user_idx])]
+            eligible = lambda rows: (snapshot.semesters[rows] >= lo) & (snapshot.semesters[rows] <= hi)
+        
+        found = table_neighbors(snapshot.neighbor_table, snapshot.matrix_rows, snapshot.user_count, user_idx, eligible)
+        if found is None:
+            return None
+        distances, rows, complete = found
+        if len(rows) >= k or complete:
+            return distances, rows
+        return None
+    
+    @staticmethod
+    def _search_neighbors(snapshot: ModelSnapshot, rows, k: int):
+        """
+        [(distancias, filas)] de cada fila consultada (rows: slice o arreglo de filas)
+        
+        Con índice por semestre cada fila busca solo en su ventana compatible
+        (puede devolver menos de k si la ventana es chica); si no, en todo el índice.
+        """
+        # Filas CSR: la búsqueda coseno trabaja directamente sobre la matriz dispersa
+        queries = snapshot.matrix_rows(rows)
+        if snapshot.semester_index is not None:
+            return snapshot.semester_index.kneighbors(queries, snapshot.semesters[rows], k)
+        distances, indices = snapshot.knn_model.kneighbors(queries, n_neighbors=min(k, snapshot.user_count))
+        return list(zip(distances, indices))
+    
+    @REQUEST_STAGE_SECONDS.timed(stage="filtering")
+    def _rank_neighbors(
+        self,
+        snapshot: ModelSnapshot,
+        user_idx: int,
+        distances: np.ndarray,
+        indices: np.ndarray,
+        filter_stats: Optional[Dict] = None
+    ) -> RankedCandidates:
+        """
+        Filtros y scoring vectorizados sobre todo el bloque de vecinos de un usuario
+        
+        Si recibe filter_stats acumula ahí los conteos del filtrado
+        (evaluados, rechazados por semestre, aceptados) para el log del request.
+        """
+        user_prefs = self._generate_smart_preferences({
+            'age': int(snapshot.ages[user_idx]),
+            'semester': int(snapshot.semesters[user_idx])
+        })
+        
+        # Ni el propio usuario ni las lápidas de usuarios eliminados
+        not_self = indices != user_idx
+        if snapshot.removed is not None:
+            not_self &= ~snapshot.removed[indices]
+        candidate_semesters = snapshot.semesters[indices]
+        semester_diffs = np.abs(candidate_semesters - snapshot.semesters[user_idx])
+        
+        semester_ok = (
+            (semester_diffs <= settings.MAX_SEMESTER_DIFFERENCE)
+            & (candidate_semesters >= user_prefs['semester_min'])
+            & (candidate_semesters <= user_prefs['semester_max'])
+        )
+        accepted = not_self & semester_ok
+        
+        semester_bonus = np.select([semester_diffs == 0, semester_diffs == 1], [0.20, 0.15], default=0.0)
+        final_scores = np.minimum(1.0, np.maximum(0.0, 1.0 - distances) + semester_bonus)
+        
+        if filter_stats is not None:
+            counts = {
+                'candidates_evaluated': int(np.count_nonzero(not_self)),
+                'rejected_semester': int(np.count_nonzero(not_self & ~semester_ok)),
+                'accepted': int(np.count_nonzero(accepted))
+            }
+            for name, count in counts.items():
+                filter_stats[name] = filter_stats.get(name, 0) + count
+        
+        ranked = RankedCandidates(
+            rows=indices[accepted].astype(np.int32),
+            scores=final_scores[accepted].astype(np.float32),
+            semester_diffs=semester_diffs[accepted].astype(np.int8)
+        )
+        
+        return ranked
+    
+    def _distance_km(self, origin_rad, points_rad):
+        """Distancias desde el usuario a los candidatos con el backend configurado"""
+        return self._distance_backend(origin_rad, points_rad)
+    
+    def _build_page(self, snapshot: ModelSnapshot, user_idx: int, page: RankedCandidates) -> List[Dict]:
+        """Distancias de la página en una sola llamada y luego un dict por candidato"""
+        with REQUEST_STAGE_SECONDS.time(stage="distance"):
+            distances_km = self._distance_km(
+                snapshot.coordinates_rad[user_idx], snapshot.coordinates_rad[page.rows]
+            )
+        with REQUEST_STAGE_SECONDS.time(stage="reasons"):
+            return [
+                self._build_recommendation(snapshot, user_idx, row, score, semester_diff, distance_km)
+                for row, score, semester_diff, distance_km in zip(
+                    page.rows.tolist(), page.scores.tolist(), page.semester_diffs.tolist(), distances_km.tolist()
+                )
+            ]
     
     def _build_recommendation(
         self, 
-        candidate_id: str, 
-        similarity_score: float, 
-        candidate_data, 
+        snapshot: ModelSnapshot,
         user_idx: int, 
         candidate_idx: int,
+        similarity_score: float, 
         semester_diff: int, 
         distance_km: float = None
     ) -> Dict:
+        candidate_data = snapshot.user_data[candidate_idx]
         profile = candidate_data.get('profile', {})
         
         recommendation = {
-            "user_id": candidate_id,
+            "user_id": snapshot.row_user_ids[candidate_idx],
             "similarity_score": float(similarity_score),
             "compatibility_indicators": {
                 "semester_difference": semester_diff,
@@ -299,8 +1265,8 @@ class AcademicMatcher:
                 "age": profile.get('age'),
                 "semester": profile.get('semester')
             },
-            "match_reasons": self.preprocessor.get_match_reasons(
-                self.user_data, user_idx, candidate_idx
+            "match_reasons": snapshot.preprocessor.get_match_reasons(
+                snapshot.match_tokens[user_idx], snapshot.match_tokens[candidate_idx], profile
             ),
             "profile_preview": {
                 "firstName": profile.get('firstName', 'Usuario'),
@@ -340,33 +1306,43 @@ class AcademicMatcher:
             "primary_filter": "semester_difference"
         }
     
-    def clear_cache(self, user_id: str = None):
+    def clear_cache(self, user_id: str = None) -> int:
         if user_id:
-            keys_to_remove = [k for k in self._recommendation_cache.keys() if k.startswith(f"{user_id}:")]
-            for key in keys_to_remove:
-                del self._recommendation_cache[key]
-            print(f"🗑️ Cache limpiado para {user_id}")
+            cleared = self.recommendation_cache.invalidate_user(user_id)
+            logger.info("🗑️ Cache limpiado para %s (%d entradas)", user_id, cleared)
         else:
-            self._recommendation_cache.clear()
-            print("🗑️ Cache completo limpiado")
+            cleared = self.recommendation_cache.clear()
+            logger.info("🗑️ Cache completo limpiado (%d entradas)", cleared)
+        return cleared
     
     def get_model_stats(self):
-        if not self.model_trained:
-            raise HTTPException(status_code=400, detail="Modelo no entrenado")
+        snapshot = self._require_snapshot()
         
         return {
-            "total_users": len(self.user_data),
-            "feature_dimensions": self.feature_matrix.shape[1],
-            "k_neighbors": self.knn_model.n_neighbors,
-            "feature_weights": self.preprocessor.feature_weights,
+            "total_users": snapshot.active_users,
+            "removed_rows": snapshot.user_count - snapshot.active_users,
+            "feature_dimensions": snapshot.stored_matrix.shape[1],
+            "k_neighbors": snapshot.k_neighbors,
+            "max_search_k": snapshot.max_search_k,
+            "neighbor_table": snapshot.neighbor_table is not None,
+            "semester_partitions": len(snapshot.semester_index.partitions) if snapshot.semester_index else 0,
+            "neighbor_table_bytes": snapshot.neighbor_table_nbytes,
+            "neighbor_table_changed_rows": changed_rows(snapshot.neighbor_table, snapshot.user_count),
+            "feature_weights": snapshot.preprocessor.feature_weights,
             "filter_strategy": "Semester-focused with bonus scoring",
-            "cache_size": len(self._recommendation_cache)
+            "cache_size": len(self.recommendation_cache),
+            "cache_stats": self.recommendation_cache.stats(),
+            "model_version": snapshot.version,
+            "model_revision": snapshot.revision,
+            "last_trained": snapshot.trained_at
         }
     
     def is_healthy(self):
+        snapshot = self._snapshot
         return {
-            "model_trained": self.model_trained,
-            "users_loaded": len(self.user_data) if self.user_data is not None else 0,
+            "model_trained": snapshot is not None,
+            "users_loaded": snapshot.active_users if snapshot is not None else 0,
             "filtering_mode": "semester_priority_with_bonus",
-            "cache_entries": len(self._recommendation_cache)
+            "cache_entries": len(self.recommendation_cache),
+            "cache_stats": self.recommendation_cache.stats()
         }
@@ -0,0 +1,422 @@
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from types import MappingProxyType
+from typing import List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin elección automática de entrenador
+    fcntl = None
+
+import numpy as np
+import scipy.sparse as sp
+
+from ..config.settings import settings
+from .index import NeighborTable
+from .rows import OverlayRows, PackedRows
+from .snapshot import ModelSnapshot, fit_indexes, index_config, index_states, max_search_neighbors
+
+logger = logging.getLogger(__name__)
+
+# Cambia si cambia el layout del directorio: los snapshots viejos se ignoran
+FORMAT_VERSION = 4
+SNAPSHOT_PREFIX = "snapshot-"
+META_FILE = "meta.json"
+ARRAY_FIELDS = ("semesters", "ages", "coordinates_rad")
+CSR_FIELDS = ("data", "indices", "indptr")
+ROW_FIELDS = ("user_data", "features_list", "match_tokens")  # objetos por fila (PackedRows)
+TABLE_FIELDS = NeighborTable._fields  # opcionales: solo si se entrenó con PRECOMPUTE_NEIGHBORS
+
+# Compartido entre workers (SNAPSHOT_ROLE trainer/reader)
+POINTER_FILE = "CURRENT"  # nombre del snapshot vigente, reemplazado atómicamente
+PENDING_DIR = "pending"  # upserts recibidos por readers, aplicados por el entrenador
+DELTAS_DIR = "deltas"  # upserts aplicados sobre un snapshot después de guardarlo
+FULL_RETRAIN_MARKER = "full-retrain"
+LOCK_FILE = "trainer.lock"
+
+_trainer_lock_fd = None
+
+
+def _snapshot_dirname(snapshot: ModelSnapshot) -> str:
+    # Orden lexicográfico = orden cronológico (la versión sola no basta entre procesos)
+    return f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-v{snapshot.version}"
+
+
+def save_snapshot(snapshot: ModelSnapshot, directory: str) -> Path:
+    """
+    Guarda el snapshot en un subdirectorio nuevo de `directory`
+
+    Se escribe en un directorio temporal y se publica con un rename atómico;
+    meta.json va al final, así un directorio sin él nunca se considera válido.
+    Después se apunta CURRENT al directorio nuevo.
+
+    Contenido:
+        preprocessor.pkl             vectorizadores ajustados (skills, interests, objectives)
+        feature_matrix.{data,indices,indptr}.npy
+                                     matriz CSR en .npy planos (se pueden mapear con np.memmap),
+                                     si no hay particiones por semestre
+        *.npy                        ids por fila y metadata (semestre, edad, coordenadas)
+        neighbor_table.*.npy         tabla de vecinos precomputada, si hay
+        removed.npy                  máscara de lápidas (usuarios eliminados), si hay
+        semester_order.npy, semester_matrix.{data,indices,indptr}.npy
+                                     la matriz ordenada por semestre de las particiones, si hay
+        index.{global|semestre}.*.npy
+                                     estado de los índices que lo tienen (tablas LSH), para
+                                     restaurarlos sin re-ajustar
+        {user_data,features_list,match_tokens}.{blob,offsets}.npy
+                                     objetos por fila serializados uno detrás de otro (PackedRows)
+        meta.json                    versión, fecha, k y dimensiones
+        deltas/                      upserts posteriores (append_delta), vacío al guardar
+    """
+    root = Path(directory)
+    root.mkdir(parents=True, exist_ok=True)
+    final_path = root / _snapshot_dirname(snapshot)
+    tmp_path = root / f".tmp-{final_path.name}"
+
+    try:
+        tmp_path.mkdir()
+        _dump(snapshot.preprocessor, tmp_path / "preprocessor.pkl")
+        matrix = snapshot.stored_matrix
+        if snapshot.semester_index is not None:
+            np.save(tmp_path / "semester_order.npy", snapshot.semester_index.order)
+            for name in CSR_FIELDS:
+                np.save(tmp_path / f"semester_matrix.{name}.npy", getattr(matrix, name))
+        else:
+            for name in CSR_FIELDS:
+                np.save(tmp_path / f"feature_matrix.{name}.npy", getattr(matrix, name))
+        np.save(tmp_path / "row_user_ids.npy", snapshot.row_user_ids.astype(str))
+        for name in ARRAY_FIELDS:
+            np.save(tmp_path / f"{name}.npy", getattr(snapshot, name))
+        if snapshot.removed is not None:
+            np.save(tmp_path / "removed.npy", snapshot.removed)
+        if snapshot.neighbor_table is not None:
+            for name in TABLE_FIELDS:
+                np.save(tmp_path / f"neighbor_table.{name}.npy", getattr(snapshot.neighbor_table, name))
+        for name in ROW_FIELDS:
+            packed = getattr(snapshot, name).packed()
+            np.save(tmp_path / f"{name}.blob.npy", packed.blob)
+            np.save(tmp_path / f"{name}.offsets.npy", packed.offsets)
+        states = index_states(snapshot)
+        for key, state in states.items():
+            for name, array in state.items():
+                np.save(tmp_path / f"index.{_state_key(key)}.{name}.npy", array)
+        (tmp_path / DELTAS_DIR).mkdir()
+
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "version": snapshot.version,
+            "revision": snapshot.revision,
+            "nnz": int(matrix.nnz),
+            "trained_at": snapshot.trained_at,
+            "watermark": snapshot.watermark.isoformat() if snapshot.watermark else None,
+            "k_neighbors": snapshot.k_neighbors,
+            "user_count": snapshot.user_count,
+            "feature_shape": list(matrix.shape),
+            "neighbor_table": snapshot.neighbor_table is not None,
+            "semester_index": snapshot.semester_index is not None,
+            "removed": snapshot.removed is not None,
+            "index_state": {
+                "config": index_config(),
+                "arrays": {_state_key(key): sorted(state) for key, state in states.items()},
+            },
+        }
+        with open(tmp_path / META_FILE, "w") as fh:
+            json.dump(meta, fh, indent=2)
+
+        os.rename(tmp_path, final_path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    write_pointer(root, final_path.name)
+    _prune(root, keep=settings.SNAPSHOT_KEEP)
+    return final_path
+
+
+def load_snapshot(path: Path, mmap: bool = False) -> ModelSnapshot:
+    """
+    Reconstruye un ModelSnapshot desde disco, sin sus deltas (ver read_deltas)
+
+    Con mmap=True la matriz, la metadata, los objetos por fila y las tablas
+    de los índices se mapean de solo lectura: todos los workers que cargan
+    el mismo directorio comparten las páginas del page cache en lugar de
+    tener cada uno su copia (con particiones por semestre la matriz guardada
+    es la ordenada sobre la que buscan). Los índices se restauran de su
+    estado guardado si la configuración no cambió; si no, se re-ajustan.
+    Los upserts son copy-on-write, así que nunca se escribe sobre el mapeo.
+    """
+    with open(path / META_FILE) as fh:
+        meta = json.load(fh)
+    if meta.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"formato {meta.get('format_version')} no soportado")
+
+    mmap_mode = "r" if mmap else None
+    prefix = "semester_matrix" if meta.get("semester_index") else "feature_matrix"
+    csr = {name: np.load(path / f"{prefix}.{name}.npy", mmap_mode=mmap_mode) for name in CSR_FIELDS}
+    if len(csr["data"]) != meta["nnz"] or len(csr["indptr"]) != meta["feature_shape"][0] + 1:
+        raise ValueError("matriz CSR incompleta")
+    matrix = sp.csr_matrix(
+        (csr["data"], csr["indices"], csr["indptr"]), shape=tuple(meta["feature_shape"]), copy=False
+    )
+    row_user_ids = np.load(path / "row_user_ids.npy").astype(object)
+    removed = np.load(path / "removed.npy") if meta.get("removed") else None
+    if removed is not None:
+        row_user_ids[removed] = None
+    arrays = {name: np.load(path / f"{name}.npy", mmap_mode=mmap_mode) for name in ARRAY_FIELDS}
+    neighbor_table = None
+    if meta.get("neighbor_table"):
+        neighbor_table = NeighborTable(*(
+            np.load(path / f"neighbor_table.{name}.npy", mmap_mode=mmap_mode) for name in TABLE_FIELDS
+        ))
+    # Con particiones la única matriz guardada es la ordenada por semestre
+    feature_matrix, sorted_rows = matrix, None
+    if meta.get("semester_index"):
+        feature_matrix = None
+        sorted_rows = (np.load(path / "semester_order.npy", mmap_mode=mmap_mode), matrix)
+    rows = {
+        name: OverlayRows(PackedRows(
+            np.load(path / f"{name}.blob.npy", mmap_mode=mmap_mode),
+            np.load(path / f"{name}.offsets.npy", mmap_mode=mmap_mode)
+        ))
+        for name in ROW_FIELDS
+    }
+    states = None
+    index_state = meta.get("index_state") or {}
+    if index_state.get("config") == index_config():
+        states = {
+            _state_key_value(key): {
+                name: np.load(path / f"index.{key}.{name}.npy", mmap_mode=mmap_mode) for name in names
+            }
+            for key, names in index_state["arrays"].items()
+        }
+    preprocessor = _load(path / "preprocessor.pkl")
+
+    user_count = meta["user_count"]
+    if matrix.shape[0] != user_count or len(row_user_ids) != user_count:
+        raise ValueError("dimensiones inconsistentes con meta.json")
+    if any(len(array) != user_count for array in [*arrays.values(), *rows.values()]):
+        raise ValueError("metadata desalineada con la matriz")
+    if removed is not None and len(removed) != user_count:
+        raise ValueError("lápidas desalineadas con la matriz")
+    if neighbor_table is not None and len(neighbor_table.indices) > user_count:
+        raise ValueError("tabla de vecinos desalineada con la matriz")
+    if sorted_rows is not None and len(sorted_rows[0]) != user_count:
+        raise ValueError("filas por semestre desalineadas con la matriz")
+
+    feature_matrix, knn_model, semester_index = fit_indexes(
+        feature_matrix, arrays["semesters"], meta["k_neighbors"], sorted_rows, states
+    )
+    return ModelSnapshot(
+        version=meta["version"],
+        feature_matrix=feature_matrix,
+        knn_model=knn_model,
+        semester_index=semester_index,
+        row_user_ids=row_user_ids,
+        user_index=MappingProxyType({
+            user_id: row for row, user_id in enumerate(row_user_ids) if user_id is not None
+        }),
+        preprocessor=preprocessor,
+        k_neighbors=meta["k_neighbors"],
+        max_search_k=max_search_neighbors(user_count),
+        trained_at=meta["trained_at"],
+        revision=meta["revision"],
+        source=path.name,
+        watermark=datetime.fromisoformat(meta["watermark"]) if meta.get("watermark") else None,
+        neighbor_table=neighbor_table,
+        removed=removed,
+        **rows,
+        **arrays
+    )
+
+
+def _state_key(key) -> str:
+    return "global" if key is None else str(key)
+
+
+def _state_key_value(name: str):
+    return None if name == "global" else int(name)
+
+
+def append_delta(path: Path, sequence: int, upserts, revision: int, watermark: Optional[datetime]) -> Path:
+    """
+    Agrega el delta `sequence` al snapshot de `path` en lugar de reescribirlo
+
+    upserts: [(user_id, documento o None)] en el orden en que se aplicaron;
+    los readers los re-aplican igual (mismos vectorizadores, mismas filas).
+    Se escribe aparte y se publica con un rename: un delta nunca se ve a medias.
+    """
+    deltas = path / DELTAS_DIR
+    final_path = deltas / f"{sequence:06d}.pkl"
+    tmp_path = deltas / f".{final_path.name}.{os.getpid()}"
+    _dump({
+        "sequence": sequence,
+        "upserts": list(upserts),
+        "revision": revision,
+        "watermark": watermark.isoformat() if watermark else None,
+    }, tmp_path)
+    os.rename(tmp_path, final_path)
+    return final_path
+
+
+def read_deltas(path: Path, start: int = 0) -> List[dict]:
+    """Deltas de `path` desde `start`, en orden; se corta en el primero que falte"""
+    deltas = []
+    sequence = start
+    while True:
+        try:
+            delta = _load(path / DELTAS_DIR / f"{sequence:06d}.pkl")
+        except FileNotFoundError:
+            return deltas
+        if delta.get("watermark"):
+            delta["watermark"] = datetime.fromisoformat(delta["watermark"])
+        deltas.append(delta)
+        sequence += 1
+
+
+def _dump(obj, path: Path):
+    with open(path, "wb") as fh:
+        pickle.dump(obj, fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load(path: Path):
+    # Solo directorios escritos por este servicio: pickle no es seguro con datos ajenos
+    with open(path, "rb") as fh:
+        return pickle.load(fh)
+
+
+def list_snapshots(directory: str):
+    """Directorios de snapshot publicados, del más nuevo al más viejo"""
+    root = Path(directory)
+    if not root.is_dir():
+        return []
+    return sorted(
+        (path for path in root.iterdir() if path.is_dir() and path.name.startswith(SNAPSHOT_PREFIX)),
+        key=lambda path: path.name,
+        reverse=True
+    )
+
+
+def load_latest_snapshot(directory: str, mmap: bool = False) -> Optional[ModelSnapshot]:
+    """El snapshot de CURRENT o, si falta, el válido más reciente; los corruptos o incompatibles se saltan"""
+    candidates = list_snapshots(directory)
+    current = read_pointer(directory)
+    if current is not None:
+        candidates.sort(key=lambda path: path.name != current)
+    
+    for path in candidates:
+        try:
+            snapshot = load_snapshot(path, mmap=mmap)
+        except Exception as e:
+            logger.warning("⚠️ Snapshot %s inválido: %s", path.name, e)
+            continue
+        logger.info("📦 Snapshot cargado: %s (%d usuarios)", path.name, snapshot.active_users)
+        return snapshot
+    return None
+
+
+def write_pointer(directory, name: str):
+    """Apunta CURRENT a `name`: los readers ven el nombre viejo o el nuevo, nunca uno a medias"""
+    root = Path(directory)
+    tmp_path = root / f".{POINTER_FILE}.{os.getpid()}"
+    with open(tmp_path, "w") as fh:
+        fh.write(name)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, root / POINTER_FILE)
+
+
+def read_pointer(directory) -> Optional[str]:
+    """Nombre del snapshot vigente según CURRENT (None si no existe)"""
+    try:
+        name = (Path(directory) / POINTER_FILE).read_text().strip()
+    except FileNotFoundError:
+        return None
+    return name or None
+
+
+def enqueue_upsert(directory, user_id: Optional[str] = None):
+    """
+    Deja un upsert para el entrenador (user_id None = re-entrenamiento completo)
+
+    Un archivo vacío por usuario: varios webhooks del mismo usuario se funden
+    en uno. El nombre es el id en hex para no depender de su formato.
+    """
+    pending = Path(directory) / PENDING_DIR
+    pending.mkdir(parents=True, exist_ok=True)
+    name = FULL_RETRAIN_MARKER if user_id is None else user_id.encode().hex()
+    (pending / name).touch()
+
+
+def drain_upserts(directory) -> Tuple[List[str], bool]:
+    """
+    Toma los upserts pendientes: (user_ids, re-entrenamiento completo pedido)
+
+    Cada archivo se borra antes de aplicarlo; si un webhook lo vuelve a crear
+    después, el entrenador lo verá en la siguiente vuelta.
+    """
+    pending = Path(directory) / PENDING_DIR
+    if not pending.is_dir():
+        return [], False
+    
+    user_ids, full_retrain = [], False
+    for path in sorted(pending.iterdir()):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            continue
+        if path.name == FULL_RETRAIN_MARKER:
+            full_retrain = True
+            continue
+        try:
+            user_ids.append(bytes.fromhex(path.name).decode())
+        except ValueError:
+            logger.warning("⚠️ Upsert pendiente inválido: %s", path.name)
+    return user_ids, full_retrain
+
+
+def acquire_trainer_lock(directory) -> bool:
+    """
+    Intenta ser el único entrenador de `directory` (flock no bloqueante)
+
+    El lock se mantiene mientras viva el proceso; si el entrenador muere, el
+    sistema operativo lo libera. Sin fcntl (Windows) nunca se obtiene.
+    """
+    global _trainer_lock_fd
+    if _trainer_lock_fd is not None:
+        return True
+    if fcntl is None:
+        return False
+    
+    root = Path(directory)
+    root.mkdir(parents=True, exist_ok=True)
+    fd = os.open(root / LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _trainer_lock_fd = fd
+    return True
+
+
+def _prune(root: Path, keep: int):
+    """
+    Conserva los `keep` snapshots más nuevos y borra temporales huérfanos
+
+    Un reader que todavía mapea un snapshot borrado sigue leyéndolo: el
+    sistema libera los archivos recién cuando se cierra el último mapeo.
+    """
+    current = read_pointer(root)
+    for path in list_snapshots(root)[max(keep, 1):]:
+        if path.name != current:
+            shutil.rmtree(path, ignore_errors=True)
+    for path in root.glob(".tmp-*"):
+        # Un temporal de otro proceso escribiendo ahora mismo es reciente: dejarlo
+        if time.time() - path.stat().st_mtime > 3600:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,78 @@
+import pickle
+from collections.abc import Sequence
+from typing import Any, Iterable, Mapping, Optional
+
+import numpy as np
+
+
+class PackedRows(Sequence):
+    """
+    Un objeto por fila, serializado en un único arreglo de bytes
+
+    blob (uint8) tiene las filas una detrás de otra y offsets (n + 1) dónde
+    empieza cada una: son dos arreglos planos que se guardan como .npy y se
+    pueden mapear, así los workers comparten las páginas en lugar de
+    des-serializar cada uno los documentos de todas las filas. Cada fila se
+    decodifica recién al leerla (solo las de la página que se responde).
+
+    pickle: solo para datos escritos por este servicio (ver persistence._load).
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def pack(cls, values: Iterable[Any]) -> "PackedRows":
+        encoded = [pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL) for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(blob, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        if not -len(self) <= row < len(self):
+            raise IndexError(row)
+        row %= len(self)
+        return pickle.loads(self.blob[self.offsets[row]:self.offsets[row + 1]])
+
+
+class OverlayRows(Sequence):
+    """
+    Filas de `base` con las que cambiaron después encima (copy-on-write)
+
+    Un upsert no copia la secuencia entera: with_row devuelve otra con esa
+    fila reemplazada (o agregada al final) en un dict aparte. base puede ser
+    una tupla (recién entrenado) o PackedRows (cargado de disco).
+    """
+
+    def __init__(self, base: Sequence, changed: Optional[Mapping[int, Any]] = None, length: Optional[int] = None):
+        self.base = base
+        self.changed = dict(changed or {})
+        self._length = len(base) if length is None else length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, row):
+        if not -self._length <= row < self._length:
+            raise IndexError(row)
+        row %= self._length
+        if row in self.changed:
+            return self.changed[row]
+        return self.base[row]
+
+    def with_row(self, row: int, value) -> "OverlayRows":
+        """Copia con `row` = value; row == len(self) agrega una fila"""
+        if not 0 <= row <= self._length:
+            raise IndexError(row)
+        return OverlayRows(self.base, {**self.changed, row: value}, max(self._length, row + 1))
+
+    def packed(self) -> PackedRows:
+        """Todas las filas en un PackedRows (para guardarlas)"""
+        if not self.changed and isinstance(self.base, PackedRows):
+            return self.base
+        return PackedRows.pack(self)
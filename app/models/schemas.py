@@ -15,12 +15,20 @@ class PaginationMetadata(BaseModel):
     """Metadata de paginación"""
     page: int = Field(..., ge=1, description="Número de página actual (1-indexed)")
     limit: int = Field(..., ge=1, le=100, description="Resultados por página")
-    total: int = Field(..., ge=0, description="Total de resultados disponibles")
-    total_pages: int = Field(..., ge=0, description="Total de páginas")
+    total: int = Field(..., ge=0, description="Resultados encontrados hasta ahora (todos si total_is_estimate es false)")
+    total_pages: int = Field(..., ge=0, description="Total de páginas según total")
+    total_is_estimate: bool = Field(default=False, description="La búsqueda no terminó: total y total_pages son cotas inferiores")
     has_next: bool = Field(..., description="Existe página siguiente")
     has_prev: bool = Field(..., description="Existe página anterior")
     showing: int = Field(..., ge=0, description="Cantidad de resultados en esta página")
 
+class SearchMetadata(BaseModel):
+    """Cuánto se buscó para llenar la página"""
+    searched_neighbors: int = Field(..., ge=0, description="Vecinos pedidos al índice")
+    expansions: int = Field(..., ge=0, description="Veces que se agrandó k en este request")
+    pass_rate_estimate: float = Field(..., ge=0, le=1, description="Fracción estimada de vecinos que pasa los filtros")
+    complete: bool = Field(..., description="Ya no hay más candidatos por buscar")
+
 class RecommendationRequest(BaseModel):
     user_id: str
     exclude_users: Optional[List[str]] = Field(default_factory=list, description="Usuarios ya swipeados")
@@ -32,10 +40,34 @@ class RecommendationResponse(BaseModel):
     recommendations: List[Dict[str, Any]]
     pagination: PaginationMetadata
     compatibility_metrics: Dict[str, Any]
+    search: Optional[SearchMetadata] = None
     model_version: str
     generated_at: str
     cache_used: bool = Field(default=False, description="Si se usó cache")
     
+class BatchRecommendationItem(BaseModel):
+    user_id: str
+    exclude_users: Optional[List[str]] = Field(default_factory=list, description="Usuarios ya swipeados")
+    limit: Optional[int] = Field(default=10, ge=1, le=50, description="Resultados por página")
+    page: Optional[int] = Field(default=1, ge=1, description="Número de página")
+
+class BatchRecommendationRequest(BaseModel):
+    items: List[BatchRecommendationItem] = Field(..., min_length=1, description="Usuarios a recomendar")
+    use_cache: Optional[bool] = Field(default=True, description="Usar cache de recomendaciones")
+
+class BatchRecommendationResult(BaseModel):
+    recommendations: List[Dict[str, Any]]
+    pagination: PaginationMetadata
+    compatibility_metrics: Dict[str, Any]
+    search: Optional[SearchMetadata] = None
+    cache_used: bool = Field(default=False, description="Si se usó cache")
+
+class BatchRecommendationResponse(BaseModel):
+    results: Dict[str, BatchRecommendationResult] = Field(..., description="Resultados por user_id")
+    errors: Dict[str, str] = Field(default_factory=dict, description="Errores por user_id")
+    model_version: str
+    generated_at: str
+
 class TrainingResult(BaseModel):
     status: str
     users_processed: int
@@ -49,13 +81,20 @@ class HealthResponse(BaseModel):
     timestamp: str
     users_loaded: int
     cache_entries: int = Field(default=0, description="Entradas en cache")
+    cache_stats: Dict[str, Any] = Field(default_factory=dict, description="Hits, misses, evicciones y bytes del cache")
 
 class ModelStatsResponse(BaseModel):
     total_users: int
     feature_dimensions: int
     k_neighbors: int
     last_trained: str
+    neighbor_table: bool = Field(default=False, description="Hay tabla de vecinos precomputada")
+    neighbor_table_changed_rows: int = Field(default=0, ge=0, description="Usuarios cambiados o agregados desde la tabla (se puntúan al leer)")
     cache_size: int = Field(default=0, description="Tamaño del cache")
+    cache_stats: Dict[str, Any] = Field(default_factory=dict, description="Hits, misses, evicciones y bytes del cache")
+
+class UserUpdatedWebhook(BaseModel):
+    user_id: str = Field(..., description="Usuario creado, editado o desactivado")
 
 class CacheClearRequest(BaseModel):
     user_id: Optional[str] = Field(default=None, description="Usuario específico (None = limpiar todo)")
@@ -0,0 +1,284 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.neighbors import NearestNeighbors
+
+from ..config.settings import settings
+from ..utils.geo import coordinates_to_radians
+from ..utils.preprocessing import FeaturePreprocessor
+from .index import CosineIndex, LSHIndex, NeighborTable, PartitionedIndex, inverse_permutation, splice_rows, with_rows
+from .rows import OverlayRows
+
+
+@dataclass(frozen=True)
+class ModelSnapshot:
+    """
+    Estado completo e inmutable de un modelo entrenado
+
+    El entrenamiento y los upserts construyen un snapshot nuevo aparte y lo
+    publican con un único cambio de referencia; los requests toman la
+    referencia una vez y leen siempre un estado consistente.
+    """
+    version: int
+    feature_matrix: Optional[sp.csr_matrix]  # None si hay semester_index: la matriz vive ordenada ahí (matrix_rows)
+    knn_model: Any  # CosineIndex, LSHIndex o NearestNeighbors: fit / kneighbors (None si hay semester_index)
+    features_list: OverlayRows  # dicts de features por fila (None = lápida)
+    user_data: OverlayRows  # documentos originales por fila (None = lápida)
+    row_user_ids: np.ndarray
+    user_index: Mapping[str, int]
+    preprocessor: FeaturePreprocessor
+    match_tokens: OverlayRows  # (technical, interests, objectives) frozensets por fila
+    k_neighbors: int
+    max_search_k: int  # tope de la búsqueda adaptativa
+    # Metadata alineada con las filas de la matriz para filtrar/puntuar vectorizado
+    semesters: np.ndarray
+    ages: np.ndarray
+    coordinates_rad: np.ndarray  # (n, 2) lat, lon en radianes (precomputado para haversine)
+    trained_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    revision: int = 0  # upserts aplicados sobre esta versión
+    source: Optional[str] = None  # directorio de disco del que se cargó (None = construido en memoria)
+    deltas: int = 0  # deltas de `source` ya aplicados
+    watermark: Optional[datetime] = None  # UPDATED_AT_FIELD más reciente ya reflejado (deltas)
+    neighbor_table: Optional[NeighborTable] = None  # top NEIGHBOR_TABLE_SIZE por fila (PRECOMPUTE_NEIGHBORS)
+    semester_index: Optional[PartitionedIndex] = None  # sub-índices por ventana de semestres (SEMESTER_PARTITIONS)
+    removed: Optional[np.ndarray] = None  # máscara de filas de usuarios eliminados (lápidas); None = ninguna
+
+    @property
+    def user_count(self) -> int:
+        """Filas de la matriz, lápidas incluidas"""
+        return len(self.features_list)
+    
+    @property
+    def active_users(self) -> int:
+        """Usuarios vigentes (sin las lápidas)"""
+        return len(self.user_index)
+    
+    def free_row(self) -> Optional[int]:
+        """Primera lápida, para reusarla en la próxima alta; None si no hay"""
+        if self.removed is None or not self.removed.any():
+            return None
+        return int(np.argmax(self.removed))
+    
+    @property
+    def stored_matrix(self) -> sp.csr_matrix:
+        """La única copia de la matriz: feature_matrix, o la ordenada por semestre de semester_index"""
+        if self.semester_index is not None:
+            return self.semester_index.sorted_matrix
+        return self.feature_matrix
+    
+    def matrix_rows(self, rows) -> sp.csr_matrix:
+        """Filas de la matriz (rows: slice o arreglo de filas), en ese orden"""
+        if self.semester_index is not None:
+            return self.semester_index.rows(rows)
+        return self.feature_matrix[rows]
+    
+    @property
+    def matrix_nbytes(self) -> int:
+        """Bytes de la matriz CSR (data + indices + indptr)"""
+        matrix = self.stored_matrix
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    
+    @property
+    def neighbor_table_nbytes(self) -> int:
+        """Bytes de la tabla de vecinos precomputada (0 si no hay)"""
+        table = self.neighbor_table
+        if table is None:
+            return 0
+        return table.indices.nbytes + table.similarities.nbytes
+    
+    @property
+    def age_seconds(self) -> float:
+        """Segundos desde el último entrenamiento completo"""
+        return (datetime.now() - datetime.fromisoformat(self.trained_at)).total_seconds()
+
+
+def fit_knn(feature_matrix, k_neighbors, state=None):
+    """
+    Índice de vecinos sobre la matriz según KNN_ALGORITHM
+
+    Todos los backends cumplen el contrato de NearestNeighbors (fit /
+    kneighbors con distancias ordenadas); el matcher no sabe cuál usa.
+    state: lo que guardó su state() con el snapshot; se restaura en lugar
+    de re-ajustar (ver index_config).
+
+    brute (coseno): CosineIndex, exacto; las filas ya vienen normalizadas, así
+        no se copia la matriz (memmap compartido) ni se re-normaliza por consulta.
+    lsh (coseno): LSHIndex, aproximado y experimental; perillas LSH_* en settings.
+    otro: NearestNeighbors de sklearn con ese algoritmo.
+    """
+    if settings.KNN_ALGORITHM == 'lsh':
+        if settings.KNN_METRIC != 'cosine':
+            raise ValueError("KNN_ALGORITHM=lsh solo soporta KNN_METRIC=cosine")
+        index = LSHIndex(
+            n_neighbors=k_neighbors,
+            n_tables=settings.LSH_TABLES,
+            n_bits=settings.LSH_BITS,
+            probe_radius=settings.LSH_PROBE_RADIUS,
+            query_tables=settings.LSH_QUERY_TABLES or None,
+            seed=settings.LSH_SEED
+        )
+        return index.restore(feature_matrix, state) if state else index.fit(feature_matrix)
+
+    if settings.KNN_METRIC == 'cosine' and settings.KNN_ALGORITHM == 'brute':
+        return CosineIndex(n_neighbors=k_neighbors).fit(feature_matrix)
+    
+    knn_model = NearestNeighbors(
+        n_neighbors=k_neighbors,
+        metric=settings.KNN_METRIC,
+        algorithm=settings.KNN_ALGORITHM
+    )
+    return knn_model.fit(feature_matrix)
+
+
+def semester_window(semester):
+    """
+    Semestres candidatos para un usuario de `semester` (rango inclusive)
+
+    Es la intersección de MAX_SEMESTER_DIFFERENCE con el rango ±2 de las
+    preferencias; _rank_neighbors sigue aplicando el filtro completo.
+    """
+    reach = min(settings.MAX_SEMESTER_DIFFERENCE, 2)
+    return max(1, semester - reach), min(12, semester + reach)
+
+
+def fit_semester_index(feature_matrix, semesters, k_neighbors, sorted_rows=None, states=None):
+    """
+    Índice particionado por semestre (None si SEMESTER_PARTITIONS está apagado)
+
+    Una ventana por semestre presente; cada sub-índice es del backend de
+    KNN_ALGORITHM sobre las filas de esa ventana. sorted_rows = (orden,
+    matriz ordenada) y states (semestre → estado de su sub-índice) ya
+    guardados en el snapshot: se usan tal cual.
+    """
+    if not settings.SEMESTER_PARTITIONS:
+        return None
+    order, sorted_matrix = sorted_rows or (None, None)
+    return PartitionedIndex(
+        feature_matrix, semesters, semester_windows(semesters),
+        fit=lambda matrix, state=None: fit_knn(matrix, min(k_neighbors, matrix.shape[0]), state),
+        order=order,
+        sorted_matrix=sorted_matrix,
+        states=states
+    )
+
+
+def semester_windows(semesters):
+    """Una ventana por semestre presente"""
+    return {int(semester): semester_window(int(semester)) for semester in np.unique(semesters)}
+
+
+def fit_indexes(feature_matrix, semesters, k_neighbors, sorted_rows=None, states=None):
+    """
+    (feature_matrix, knn_model, semester_index) del snapshot
+
+    Con particiones por semestre toda búsqueda pasa por semester_index, que
+    guarda la matriz ordenada por semestre: el índice global no se ajusta y
+    el snapshot no guarda feature_matrix (None). Sin feature_matrix (solo
+    sorted_rows, como quedó en disco) y con las particiones apagadas se
+    rearma la matriz en orden de fila. states: los de index_states, si
+    siguen valiendo para la configuración actual (ver index_config).
+    """
+    if feature_matrix is None and not settings.SEMESTER_PARTITIONS:
+        order, sorted_matrix = sorted_rows
+        feature_matrix = sorted_matrix[inverse_permutation(order)]
+    states = states or {}
+    semester_index = fit_semester_index(feature_matrix, semesters, k_neighbors, sorted_rows, states)
+    if semester_index is not None:
+        return None, None, semester_index
+    return feature_matrix, fit_knn(feature_matrix, k_neighbors, states.get(None)), None
+
+
+def index_states(snapshot):
+    """
+    Lo que re-ajustar los índices del snapshot volvería a calcular
+
+    {semestre: estado} de cada partición o {None: estado} del índice global;
+    solo los backends que guardan algo (LSH: sus tablas ordenadas).
+    """
+    if snapshot.semester_index is not None:
+        return snapshot.semester_index.states()
+    state = snapshot.knn_model.state() if hasattr(snapshot.knn_model, 'state') else {}
+    return {None: state} if state else {}
+
+
+def index_config():
+    """Settings de los que depende el estado de los índices: si cambian, se re-ajustan"""
+    return {
+        "algorithm": settings.KNN_ALGORITHM,
+        "metric": settings.KNN_METRIC,
+        "semester_partitions": settings.SEMESTER_PARTITIONS,
+        "max_semester_difference": settings.MAX_SEMESTER_DIFFERENCE,
+        "lsh": [settings.LSH_TABLES, settings.LSH_BITS, settings.LSH_SEED],
+    }
+
+
+def update_indexes(snapshot, semesters, row=None, deleted=None, inserted=None):
+    """
+    (feature_matrix, knn_model, semester_index) tras un upsert de una fila, a partir de los del snapshot
+
+    deleted / inserted como en CosineIndex.with_rows y row la fila nueva de
+    inserted. Los backends se actualizan fila a fila (LSH re-hashea solo
+    esa fila) en lugar de ajustarse de cero; sklearn sí se re-ajusta.
+    """
+    k_neighbors = snapshot.k_neighbors
+    if snapshot.semester_index is not None:
+        semester_index = snapshot.semester_index.with_rows(
+            semesters, semester_windows(semesters), row, deleted=deleted, inserted=inserted
+        )
+        return None, None, semester_index
+    feature_matrix = splice_rows(snapshot.feature_matrix, row, deleted=deleted, inserted=inserted)
+    knn_model = with_rows(
+        snapshot.knn_model, feature_matrix, lambda matrix: fit_knn(matrix, k_neighbors),
+        deleted=deleted, inserted=inserted
+    )
+    return feature_matrix, knn_model, None
+
+
+def max_search_neighbors(user_count):
+    """k máximo por consulta: todos los usuarios (la propia fila incluida), acotado por MAX_SEARCH_NEIGHBORS"""
+    return min(user_count, settings.MAX_SEARCH_NEIGHBORS)
+
+
+def build_user_index(features_list):
+    """Índice inmutable user_id → fila de la matriz y arreglo inverso fila → user_id"""
+    row_user_ids = np.array([f['user_id'] for f in features_list], dtype=object)
+    user_index = MappingProxyType({
+        user_id: row for row, user_id in enumerate(row_user_ids)
+    })
+    return row_user_ids, user_index
+
+
+def _as_int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def metadata_row(feature_dict):
+    """(semestre, edad, [lon, lat]) de un usuario, con valores por defecto si faltan"""
+    location = feature_dict.get('location') or settings.DEFAULT_COORDINATES
+    try:
+        coordinates = [float(location[0]), float(location[1])]
+    except (TypeError, ValueError, IndexError):
+        coordinates = list(settings.DEFAULT_COORDINATES)
+    
+    return (
+        _as_int(feature_dict.get('semester'), 5),
+        _as_int(feature_dict.get('age'), 20),
+        coordinates
+    )
+
+
+def build_metadata_arrays(features_list):
+    """Arreglos semesters/ages/coordinates_rad alineados con las filas de la matriz"""
+    rows = [metadata_row(f) for f in features_list]
+    return {
+        'semesters': np.array([r[0] for r in rows], dtype=np.int16),
+        'ages': np.array([r[1] for r in rows], dtype=np.int16),
+        'coordinates_rad': coordinates_to_radians([r[2] for r in rows]),
+    }
@@ -0,0 +1,84 @@
+import logging
+from threading import Event, Thread
+from typing import Callable, Optional
+
+from pymongo.errors import OperationFailure
+
+from .database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# ChangeStreamFatalError / ChangeStreamHistoryLost: el resume token ya no sirve
+_RESUME_TOKEN_LOST = (280, 286)
+
+
+class UserChangeStream:
+    """
+    Consume el change stream de usuarios en un hilo propio
+
+    Por cada insert/update/replace/delete llama on_change(user_id); el
+    matcher relee ese documento y aplica el upsert. Si el stream se corta,
+    se reabre desde el último resume token; cuando no hay token (o Mongo ya
+    no lo tiene) se llama on_gap() para recuperar lo perdido con un delta
+    por marca de tiempo.
+    """
+
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        on_change: Callable[[str], None],
+        on_gap: Optional[Callable[[], None]] = None,
+        retry_seconds: float = 5.0
+    ):
+        self.db_manager = db_manager
+        self.on_change = on_change
+        self.on_gap = on_gap
+        self.retry_seconds = retry_seconds
+        self.resume_token = None
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="user-change-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        first = True
+        while not self._stop.is_set():
+            try:
+                with self.db_manager.watch_user_changes(self.resume_token) as stream:
+                    if not first and self.resume_token is None and self.on_gap is not None:
+                        self.on_gap()
+                    first = False
+                    logger.info("👂 Change stream de usuarios abierto")
+                    self._consume(stream)
+            except Exception as e:
+                if self._stop.is_set():
+                    return
+                logger.warning("⚠️ Change stream interrumpido: %s - reintentando en %.0fs", e, self.retry_seconds)
+                if isinstance(e, OperationFailure) and e.code in _RESUME_TOKEN_LOST:
+                    # El token ya salió del oplog: se reabre desde ahora y se recupera con un delta
+                    self.resume_token = None
+                first = False
+                self._stop.wait(self.retry_seconds)
+
+    def _consume(self, stream):
+        while not self._stop.is_set() and stream.alive:
+            change = stream.try_next()
+            if change is None:
+                continue
+            self.resume_token = stream.resume_token
+            user_id = str(change["documentKey"]["_id"])
+            try:
+                self.on_change(user_id)
+            except Exception as e:
+                logger.warning("⚠️ Cambio de %s no aplicado: %s", user_id, e)
@@ -1,77 +1,261 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from itertools import islice
+from threading import Lock
+from typing import Dict, Optional
+
 import pymongo
+from bson import ObjectId
 from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReadPreference
 from ..config.settings import settings
+from .metrics import TRAINING_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+_client: Optional[AsyncIOMotorClient] = None
+_client_lock = Lock()
+
+
+def get_client() -> AsyncIOMotorClient:
+    """
+    Cliente Motor único del proceso (creado al primer uso)
+    
+    Los endpoints async lo usan directamente; el código síncrono que corre
+    en los pools (entrenamiento, change stream) usa client.delegate, el
+    MongoClient de pymongo subyacente: un solo pool de conexiones para todo.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AsyncIOMotorClient(
+                settings.MONGODB_URI,
+                maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+                minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+                serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=settings.MONGO_SOCKET_TIMEOUT_MS,
+                appname=settings.API_TITLE,
+            )
+        return _client
+
+
+def close_client():
+    """Cierra el cliente compartido (shutdown); el próximo get_client() abre uno nuevo"""
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+
 
 class DatabaseManager:
-    def __init__(self):
+    # Campos que consume el modelo (mismos en carga completa y en upserts)
+    USER_FIELDS = {
+        # Skills
+        "skills.technical": 1,
+        "skills.interests": 1,
+        
+        # Objectives
+        "objectives.primary": 1,
+        "objectives.timeAvailability": 1,
+        
+        # Profile
+        "profile.firstName": 1,
+        "profile.age": 1,
+        "profile.semester": 1,
+        "profile.university": 1,
+        "profile.location": 1,
+    }
+    
+    def __init__(self, collection=None):
+        """
+        Args:
+            collection: Colección síncrona ya creada (mongomock, fake en memoria);
+                        None = usar el cliente compartido del proceso al primer uso
+        """
         self.client = None
-        self.collection = None
+        self.collection = collection
+        # Lecturas de entrenamiento (cargas completas, deltas): pueden ir a secundarios
+        self.training_collection = collection
+        self.async_collection = None
     
     def connect(self):
-        """Establece conexión a MongoDB"""
+        """Toma las colecciones del cliente compartido (no abre conexiones propias)"""
         try:
-            self.client = pymongo.MongoClient(settings.MONGODB_URI)
-            db = self.client[settings.DATABASE_NAME]
-            self.collection = db[settings.COLLECTION_NAME]
+            self.client = get_client()
+            async_collection = self.client[settings.DATABASE_NAME][settings.COLLECTION_NAME]
+            self.async_collection = async_collection
+            self.collection = async_collection.delegate
+            self.training_collection = self.collection.with_options(
+                read_preference=_READ_PREFERENCES[settings.MONGO_TRAINING_READ_PREFERENCE]
+            )
             return self.collection
         except Exception as e:
-            print(f"Error conectando a MongoDB: {e}")
+            logger.error("Error conectando a MongoDB: %s", e)
             raise HTTPException(status_code=500, detail="Error de conexión a base de datos")
     
+    def _ensure_connected(self):
+        """Conecta al primer uso y de nuevo si el cliente compartido se cerró (otro lifespan)"""
+        if self.collection is None or (self.client is not None and self.client is not _client):
+            self.connect()
+    
     def get_active_users(self):
         """
         Obtiene usuarios activos con SOLO LOS CAMPOS NECESARIOS
         ✅ ELIMINADOS: skills.level, commitmentLevel, preferences, activity, privacy
+        
+        Carga todo en memoria de una vez; el entrenamiento usa
+        iter_active_user_batches.
         """
-        # 🔥 FIX: Cambiar "if not self.collection:" por "if self.collection is None:"
-        if self.collection is None:
-            self.connect()
+        self._ensure_connected()
         
         try:
-            pipeline = [
-                {
-                    "$match": {
-                        "activity.profileCompletion": {"$gte": settings.PROFILE_COMPLETION_MIN}
-                    }
-                },
-                {
-                    "$project": {
-                        # ✅ Campos necesarios
-                        "user_id": {"$toString": "$_id"},
-                        
-                        # Skills
-                        "skills.technical": 1,
-                        "skills.interests": 1,
-                        
-                        # Objectives
-                        "objectives.primary": 1,
-                        "objectives.timeAvailability": 1,
-                        
-                        # Profile
-                        "profile.firstName": 1,
-                        "profile.age": 1,
-                        "profile.semester": 1,
-                        "profile.university": 1,
-                        "profile.location": 1,
-                    }
-                }
-            ]
-            
-            users = list(self.collection.aggregate(pipeline))
-            print(f"✅ {len(users)} usuarios cargados (solo campos necesarios)")
+            users = list(self.training_collection.aggregate(self._active_users_pipeline()))
+            logger.info("✅ %d usuarios cargados (solo campos necesarios)", len(users))
             return users
         
         except Exception as e:
-            print(f"❌ Error obteniendo usuarios: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error("❌ Error obteniendo usuarios: %s", e, exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    def iter_active_user_batches(self, batch_size: Optional[int] = None):
+        """
+        Mismos usuarios que get_active_users, en lotes a medida que llegan del cursor
+        
+        El cursor trae batch_size documentos por viaje y cada lote se entrega
+        apenas está completo: quien consume puede procesarlo y soltarlo sin
+        esperar (ni retener) el resultado entero.
+        
+        Solo el tiempo esperando al cursor cuenta como etapa mongo_load (se
+        observa una vez al terminar); lo que haga quien consume entre lotes no.
+        """
+        self._ensure_connected()
+        
+        batch_size = batch_size or settings.MONGO_BATCH_SIZE
+        loaded = 0
+        fetch_seconds = 0.0
+        try:
+            started = time.perf_counter()
+            cursor = self.training_collection.aggregate(self._active_users_pipeline(), batchSize=batch_size)
+            while True:
+                batch = list(islice(cursor, batch_size))
+                fetch_seconds += time.perf_counter() - started
+                if not batch:
+                    break
+                loaded += len(batch)
+                yield batch
+                started = time.perf_counter()
+        except Exception as e:
+            logger.error("❌ Error obteniendo usuarios: %s", e, exc_info=True)
             raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            TRAINING_STAGE_SECONDS.observe(fetch_seconds, stage="mongo_load")
+        
+        logger.info("✅ %d usuarios cargados en lotes de %d", loaded, batch_size)
+    
+    def _active_users_pipeline(self):
+        return [
+            {
+                "$match": {
+                    "activity.profileCompletion": {"$gte": settings.PROFILE_COMPLETION_MIN}
+                }
+            },
+            {
+                "$project": {
+                    # ✅ Campos necesarios
+                    "user_id": {"$toString": "$_id"},
+                    **self.USER_FIELDS,
+                }
+            }
+        ]
+    
+    def get_latest_update(self) -> Optional[datetime]:
+        """
+        Mayor valor de UPDATED_AT_FIELD en la colección (None si no hay)
+        
+        Se lee ANTES de una carga completa: lo que cambie durante la carga
+        queda por encima de la marca y el siguiente delta lo vuelve a traer.
+        """
+        self._ensure_connected()
+        
+        field = settings.UPDATED_AT_FIELD
+        try:
+            latest = self.training_collection.find_one(
+                {field: {"$exists": True}}, {field: 1}, sort=[(field, pymongo.DESCENDING)]
+            )
+        except Exception as e:
+            logger.error("Error leyendo %s más reciente: %s", field, e)
+            return None
+        return latest.get(field) if latest else None
+    
+    @TRAINING_STAGE_SECONDS.timed(stage="mongo_delta")
+    def get_users_changed_since(self, watermark: datetime) -> Dict:
+        """
+        Usuarios con UPDATED_AT_FIELD >= watermark (solo esos viajan por la red)
+        
+        Devuelve:
+            active: documentos que pasan el filtro, con la proyección de get_active_users
+            inactive_ids: ids que cambiaron pero ya no califican (a eliminar del modelo)
+            watermark: nueva marca (la mayor vista, o la misma si no hubo cambios)
+        
+        Con $gte un documento en el borde puede volver a aplicarse; el upsert es
+        idempotente. Los borrados físicos no dejan rastro aquí: los cubre el
+        change stream o el re-entrenamiento completo.
+        """
+        self._ensure_connected()
+        
+        field = settings.UPDATED_AT_FIELD
+        projection = {**self.USER_FIELDS, "activity.profileCompletion": 1, field: 1}
+        try:
+            cursor = self.training_collection.find({field: {"$gte": watermark}}, projection)
+            active, inactive_ids, latest = [], [], watermark
+            for user in cursor:
+                latest = max(latest, user[field])
+                user_id = str(user["_id"])
+                completion = user.pop("activity", {}).get("profileCompletion")
+                user.pop(field, None)
+                if completion is not None and completion >= settings.PROFILE_COMPLETION_MIN:
+                    user["user_id"] = user_id
+                    active.append(user)
+                else:
+                    inactive_ids.append(user_id)
+        except Exception as e:
+            logger.error("❌ Error obteniendo cambios desde %s: %s", watermark, e, exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
+        
+        logger.info("✅ %d usuarios cambiados desde %s (%d inactivos)",
+                    len(active) + len(inactive_ids), watermark, len(inactive_ids))
+        return {"active": active, "inactive_ids": inactive_ids, "watermark": latest}
+    
+    def watch_user_changes(self, resume_token=None, max_await_time_ms: int = 1000):
+        """
+        Change stream de la colección: inserts, updates, replaces y deletes
+        
+        Requiere replica set. El consumidor toma documentKey._id de cada evento
+        y guarda stream.resume_token para retomar tras una desconexión.
+        """
+        self._ensure_connected()
+        
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        return self.collection.watch(
+            pipeline, resume_after=resume_token, max_await_time_ms=max_await_time_ms
+        )
     
     def get_user_activity_stats(self):
         """Estadísticas básicas de usuarios"""
-        # 🔥 FIX: Cambiar "if not self.collection:" por "if self.collection is None:"
-        if self.collection is None:
-            self.connect()
+        self._ensure_connected()
             
         try:
             pipeline = [
@@ -88,23 +272,64 @@ class DatabaseManager:
             return stats[0] if stats else {}
             
         except Exception as e:
-            print(f"Error obteniendo estadísticas: {e}")
+            logger.error("Error obteniendo estadísticas: %s", e)
             return {}
     
-    def get_user_by_id(self, user_id: str):
-        """Obtiene un usuario específico por ID"""
-        if self.collection is None:
-            self.connect()
+    def get_user_by_id(self, user_id: str, active_only: bool = False):
+        """
+        Obtiene un usuario específico por ID
+        
+        Con active_only=True aplica el mismo filtro y proyección que
+        get_active_users: devuelve None si el usuario no califica.
+        """
+        self._ensure_connected()
         
         try:
-            from bson import ObjectId
-            user = self.collection.find_one({"_id": ObjectId(user_id)})
-            return user
+            query, projection = self._user_query(user_id, active_only)
+            return self._with_user_id(self.collection.find_one(query, projection), active_only)
         except Exception as e:
-            print(f"Error obteniendo usuario {user_id}: {e}")
-            return None
+            return self._user_read_failed(user_id, e, active_only)
+    
+    async def get_user_by_id_async(self, user_id: str, active_only: bool = False):
+        """
+        get_user_by_id sin bloquear el event loop (Motor)
+        
+        Con una colección inyectada (síncrona) la lectura corre en un hilo.
+        """
+        self._ensure_connected()
+        if self.async_collection is None:
+            return await asyncio.to_thread(self.get_user_by_id, user_id, active_only)
         
+        try:
+            query, projection = self._user_query(user_id, active_only)
+            user = await self.async_collection.find_one(query, projection)
+            return self._with_user_id(user, active_only)
+        except Exception as e:
+            return self._user_read_failed(user_id, e, active_only)
+    
+    def _user_query(self, user_id: str, active_only: bool):
+        query = {"_id": ObjectId(user_id)}
+        if not active_only:
+            return query, None
+        query["activity.profileCompletion"] = {"$gte": settings.PROFILE_COMPLETION_MIN}
+        return query, self.USER_FIELDS
+    
+    @staticmethod
+    def _with_user_id(user, active_only: bool):
+        if user is not None and active_only:
+            user["user_id"] = str(user["_id"])
+        return user
+    
+    @staticmethod
+    def _user_read_failed(user_id: str, error: Exception, active_only: bool):
+        logger.error("Error obteniendo usuario %s: %s", user_id, error)
+        if active_only:
+            # No confundir un fallo de lectura con "usuario inactivo"
+            raise HTTPException(status_code=500, detail=str(error))
+        return None
+    
     def close(self):
-        """Cierra la conexión a MongoDB"""
+        """Suelta las colecciones del cliente compartido (se cierra con close_client() al apagar)"""
         if self.client is not None:
-            self.client.close()
+            self.client = None
+            self.collection = self.training_collection = self.async_collection = None
@@ -0,0 +1,54 @@
+import numpy as np
+
+try:
+    from geopy.distance import geodesic
+except ImportError:  # geopy es opcional: solo lo usa el backend "geodesic"
+    geodesic = None
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def coordinates_to_radians(coordinates):
+    """[lon, lat] en grados (formato GeoJSON) → arreglo (n, 2) [lat, lon] en radianes"""
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    return np.radians(coordinates[:, ::-1])
+
+
+def haversine_km(origin_rad, points_rad):
+    """
+    Distancia de gran círculo desde un punto a muchos en una sola operación
+
+    Args:
+        origin_rad: [lat, lon] en radianes
+        points_rad: arreglo (n, 2) [lat, lon] en radianes
+    """
+    lat1, lon1 = origin_rad[0], origin_rad[1]
+    lat2, lon2 = points_rad[:, 0], points_rad[:, 1]
+
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def geodesic_km(origin_rad, points_rad):
+    """Distancia elipsoidal exacta (geopy), un punto a la vez: solo como referencia"""
+    if geodesic is None:
+        raise RuntimeError("DISTANCE_BACKEND=geodesic requiere geopy instalado")
+
+    origin = tuple(np.degrees(origin_rad))
+    return np.array([geodesic(origin, tuple(point)).km for point in np.degrees(points_rad)])
+
+
+DISTANCE_BACKENDS = {
+    'haversine': haversine_km,
+    'geodesic': geodesic_km,
+}
+
+
+def get_distance_backend(name):
+    try:
+        return DISTANCE_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"DISTANCE_BACKEND desconocido: {name} (opciones: {', '.join(DISTANCE_BACKENDS)})")
@@ -0,0 +1,107 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+from ..config.settings import settings
+
+ROOT_LOGGER = "app"
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro: campos base + los de extra={'fields': {...}}"""
+
+    def format(self, record):
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legible para desarrollo: mensaje seguido de key=value"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s | %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " | " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class _StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Encola el registro sin formatearlo
+
+    QueueHandler.prepare() une el traceback al mensaje; aquí solo se resuelven
+    los argumentos y el traceback queda en exc_text para el formatter.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging():
+    """
+    Configura el logger raíz del servicio (idempotente)
+
+    Los registros se encolan y un hilo aparte los formatea y escribe en
+    stdout: el hilo del request nunca espera al log shipper.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if settings.LOG_FORMAT == "json" else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.handlers[:] = [_StructuredQueueHandler(log_queue)]
+    logger.setLevel(settings.LOG_LEVEL.upper())
+    logger.propagate = False
+
+
+def sampled(logger, level=logging.DEBUG) -> bool:
+    """
+    True si un registro del camino caliente debe emitirse
+
+    Combina el nivel del logger con LOG_SAMPLE_RATE; se consulta antes de
+    armar los campos, así un nivel deshabilitado no cuesta formateo.
+    """
+    if not logger.isEnabledFor(level):
+        return False
+    return settings.LOG_SAMPLE_RATE >= 1.0 or random.random() < settings.LOG_SAMPLE_RATE
+
+
+def log_event(logger, level, message, **fields):
+    """Registro estructurado: mensaje corto + campos en extra"""
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"fields": fields})
@@ -0,0 +1,210 @@
+import bisect
+import functools
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Segundos: de sub-milisegundo (cache) a minutos (re-entrenamiento completo)
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """Métricas del proceso, expuestas en formato de texto de Prometheus"""
+
+    def __init__(self):
+        self._metrics: Dict[str, "_Metric"] = {}
+        self._lock = Lock()
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrica duplicada: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} espera labels {self.label_names}, recibió {tuple(labels)}")
+        return tuple(labels[name] for name in self.label_names)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[Tuple, list] = {}  # labels → [conteos por bucket..., suma]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Context manager que observa los segundos transcurridos en el bloque"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def timed(self, **labels):
+        """Decorador equivalente a envolver la función en time()"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = []
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackGauge(_Metric):
+    """Gauge leído en cada scrape; el callback devuelve un número o None (sin muestra)"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], Optional[float]], registry=REGISTRY):
+        super().__init__(name, documentation, registry=registry)
+        self._callback = callback
+
+    def samples(self) -> List[str]:
+        value = self._callback()
+        if value is None:
+            return []
+        return [f"{self.name} {_format_value(value)}"]
+
+
+# Entrenamiento: carga de Mongo, extracción, TF-IDF y ajuste del índice
+TRAINING_STAGE_SECONDS = Histogram(
+    "academic_match_training_stage_seconds",
+    "Duración de cada etapa del entrenamiento",
+    labels=("stage",)
+)
+TRAININGS_TOTAL = Counter(
+    "academic_match_trainings_total",
+    "Entrenamientos completos por resultado",
+    labels=("status",)
+)
+UPSERTS_TOTAL = Counter(
+    "academic_match_upserts_total",
+    "Upserts incrementales por acción",
+    labels=("action",)
+)
+
+# Serving: cache, vecinos, filtrado, exclusiones, distancias, razones y serialización
+REQUEST_STAGE_SECONDS = Histogram(
+    "academic_match_request_stage_seconds",
+    "Duración de cada etapa de un request de recomendaciones",
+    labels=("stage",)
+)
+REQUESTS_TOTAL = Counter(
+    "academic_match_requests_total",
+    "Requests de recomendaciones por resultado del cache",
+    labels=("endpoint", "cache")
+)
+REQUEST_ERRORS_TOTAL = Counter(
+    "academic_match_request_errors_total",
+    "Requests de recomendaciones fallidos por código HTTP",
+    labels=("endpoint", "status")
+)
+SEARCH_EXPANSIONS_TOTAL = Counter(
+    "academic_match_search_expansions_total",
+    "Veces que se agrandó k porque los filtros dejaron la página corta"
+)
@@ -1,8 +1,16 @@
-import pandas as pd
-import numpy as np
-from sklearn.preprocessing import StandardScaler
+import logging
+
+import scipy.sparse as sp
+from sklearn.preprocessing import StandardScaler, normalize
 from sklearn.feature_extraction.text import TfidfVectorizer
 from ..config.settings import settings
+from .logger import log_event
+from .metrics import TRAINING_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Columnas de texto de cada feature_dict, en el orden de los bloques de la matriz
+TEXT_COLUMNS = ('skills_technical_text', 'skills_interests_text', 'objectives_text')
 
 class FeaturePreprocessor:
     def __init__(self):
@@ -24,38 +32,55 @@ class FeaturePreprocessor:
             max_df=0.95,
             sublinear_tf=True
         )
+        self.tfidf_interests = TfidfVectorizer(
+            max_features=50,
+            lowercase=True,
+            strip_accents='unicode',
+            min_df=1,
+            max_df=0.95,
+            sublinear_tf=True
+        )
         
         self.feature_weights = {
             'skills_technical': 0.40,
             'skills_interests': 0.25,
             'objectives': 0.35,
         }
+        
+        # % de tokens fuera de vocabulario en el propio corpus de entrenamiento
+        # (max_features/max_df podan términos): referencia para medir drift
+        self.baseline_oov_rate = 0.0
     
     def extract_user_features(self, users_data):
-        """Extrae SOLO skills.technical, skills.interests y objectives.primary"""
+        """
+        Extrae SOLO skills.technical, skills.interests y objectives.primary
+        
+        Returns:
+            (features, users): features procesadas y documentos originales,
+            alineados fila a fila con la matriz de features
+        """
         if not users_data:
             raise ValueError("No hay datos de usuarios para procesar")
         
-        user_df = pd.DataFrame(users_data)
         features = []
+        users = []
         
-        print(f"\n{'='*70}")
-        print(f"🎯 EXTRAYENDO FEATURES - MODO: SKILLS & OBJECTIVES ONLY")
-        print(f"   ⚠️  SIN FILTRO DE SEMESTRE")
-        print(f"{'='*70}\n")
-        
-        for _, user in user_df.iterrows():
+        for user in users_data:
             try:
                 feature_dict = self._process_single_user(user)
                 features.append(feature_dict)
+                users.append(user)
             except Exception as e:
-                print(f"⚠️ Error procesando usuario {user.get('user_id', 'unknown')}: {e}")
+                logger.warning("⚠️ Error procesando usuario %s: %s", user.get('user_id', 'unknown'), e)
                 continue
         
-        print(f"\n✅ Features procesadas para {len(features)} usuarios")
-        print(f"   📊 Componentes: Technical Skills + Interests + Objectives")
-        print(f"   ℹ️  Semestre guardado como metadata (no afecta matching)\n")
-        return features, user_df
+        # Skills + Interests + Objectives; el semestre queda como metadata
+        log_event(
+            logger, logging.DEBUG, "🎯 Features procesadas",
+            users=len(features),
+            skipped=len(users_data) - len(features)
+        )
+        return features, users
     
     def _process_single_user(self, user):
         """Procesa usuario - SOLO SKILLS Y OBJECTIVES con normalización mejorada"""
@@ -71,7 +96,7 @@ class FeaturePreprocessor:
         objectives_text = ' '.join(objectives) if objectives else ''
         
         if not (skills_technical_text or skills_interests_text or objectives_text):
-            print(f"⚠️ Usuario {user_id}: Sin skills ni objectives - usando placeholder")
+            logger.debug("Usuario %s sin skills ni objectives - usando placeholder", user_id)
             skills_technical_text = 'sin_skills'
             objectives_text = 'sin_objetivos'
         
@@ -92,109 +117,158 @@ class FeaturePreprocessor:
         return feature_dict
     
     def create_feature_matrix(self, features):
-        """Crea matriz optimizada con normalización L2"""
-        if len(features) < 2:
-            raise ValueError("Insuficientes características procesadas")
+        """Crea matriz dispersa (CSR) ponderada con normalización L2"""
+        return self.fit_text_columns(*([f[column] for f in features] for column in TEXT_COLUMNS))
+    
+    @TRAINING_STAGE_SECONDS.timed(stage="tfidf_matrix")
+    def fit_text_columns(self, technical_texts, interests_texts, objectives_texts):
+        """
+        Ajusta los vectorizadores y crea la matriz desde las columnas de texto
         
-        print(f"\n{'='*70}")
-        print(f"🔧 CONSTRUYENDO MATRIZ DE FEATURES - OPTIMIZADO")
-        print(f"{'='*70}\n")
+        Misma matriz que create_feature_matrix, para cuando los textos ya
+        vienen en columnas (ingesta por lotes) y no dentro de cada feature_dict.
+        """
+        if len(technical_texts) < 2:
+            raise ValueError("Insuficientes características procesadas")
         
-        technical_texts = [f['skills_technical_text'] for f in features]
-        technical_matrix = self.tfidf_skills.fit_transform(technical_texts).toarray()
+        technical_matrix = self.tfidf_skills.fit_transform(technical_texts).tocsr()
         technical_weighted = technical_matrix * self.feature_weights['skills_technical']
         
-        print(f"✅ Technical Skills:")
-        print(f"   Dimensiones: {technical_matrix.shape}")
-        print(f"   Peso aplicado: {self.feature_weights['skills_technical']*100:.0f}%")
-        print(f"   Vocabulario: {len(self.tfidf_skills.vocabulary_)} términos únicos")
-        print(f"   Sparsity: {(technical_matrix == 0).sum() / technical_matrix.size * 100:.1f}%\n")
-        
-        interests_texts = [f['skills_interests_text'] for f in features]
-        tfidf_interests = TfidfVectorizer(
-            max_features=50,
-            lowercase=True,
-            strip_accents='unicode',
-            min_df=1,
-            max_df=0.95,
-            sublinear_tf=True
-        )
-        interests_matrix = tfidf_interests.fit_transform(interests_texts).toarray()
+        interests_matrix = self.tfidf_interests.fit_transform(interests_texts).tocsr()
         interests_weighted = interests_matrix * self.feature_weights['skills_interests']
         
-        print(f"✅ Interests:")
-        print(f"   Dimensiones: {interests_matrix.shape}")
-        print(f"   Peso aplicado: {self.feature_weights['skills_interests']*100:.0f}%")
-        print(f"   Vocabulario: {len(tfidf_interests.vocabulary_)} términos únicos")
-        print(f"   Sparsity: {(interests_matrix == 0).sum() / interests_matrix.size * 100:.1f}%\n")
-        
-        objectives_texts = [f['objectives_text'] for f in features]
-        objectives_matrix = self.tfidf_objectives.fit_transform(objectives_texts).toarray()
+        objectives_matrix = self.tfidf_objectives.fit_transform(objectives_texts).tocsr()
         objectives_weighted = objectives_matrix * self.feature_weights['objectives']
         
-        print(f"✅ Objectives:")
-        print(f"   Dimensiones: {objectives_matrix.shape}")
-        print(f"   Peso aplicado: {self.feature_weights['objectives']*100:.0f}%")
-        print(f"   Vocabulario: {len(self.tfidf_objectives.vocabulary_)} términos únicos")
-        print(f"   Sparsity: {(objectives_matrix == 0).sum() / objectives_matrix.size * 100:.1f}%\n")
-        
-        feature_matrix = np.hstack([
+        feature_matrix = sp.hstack([
             technical_weighted,
             interests_weighted,
             objectives_weighted
-        ])
-        
-        from sklearn.preprocessing import normalize
-        feature_matrix = normalize(feature_matrix, norm='l2', axis=1)
-        
-        print(f"{'='*70}")
-        print(f"✅ MATRIZ FINAL CONSTRUIDA Y NORMALIZADA (L2)")
-        print(f"{'='*70}")
-        print(f"   Shape total: {feature_matrix.shape}")
-        print(f"   Total features: {feature_matrix.shape[1]}")
-        print(f"   Usuarios: {feature_matrix.shape[0]}")
-        print(f"   Distribución:")
-        print(f"     • Technical Skills: {technical_matrix.shape[1]} features (40%)")
-        print(f"     • Interests: {interests_matrix.shape[1]} features (25%)")
-        print(f"     • Objectives: {objectives_matrix.shape[1]} features (35%)")
-        print(f"\n   🎯 Normalización L2 aplicada para mejor similitud coseno")
-        print(f"   ⚠️  SEMESTRE NO INCLUIDO en matching\n")
+        ], format='csr')
+        
+        feature_matrix = normalize(feature_matrix, norm='l2', axis=1, copy=False)
+        sample = zip(technical_texts[:2000], interests_texts[:2000], objectives_texts[:2000])
+        self.baseline_oov_rate = self._oov_rate(dict(zip(TEXT_COLUMNS, texts)) for texts in sample)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            blocks = (
+                ('skills_technical', technical_matrix),
+                ('skills_interests', interests_matrix),
+                ('objectives', objectives_matrix),
+            )
+            for name, matrix in blocks:
+                log_event(
+                    logger, logging.DEBUG, "🔧 Bloque TF-IDF",
+                    block=name,
+                    shape=list(matrix.shape),
+                    weight=self.feature_weights[name],
+                    sparsity_pct=round(self._sparsity(matrix), 1)
+                )
+        
+        # Normalización L2 para similitud coseno; el semestre no entra al matching
+        log_event(
+            logger, logging.INFO, "✅ Matriz de features construida (CSR, L2)",
+            shape=list(feature_matrix.shape),
+            nnz=feature_matrix.nnz,
+            density_pct=round(100 - self._sparsity(feature_matrix), 2),
+            baseline_oov_rate=round(self.baseline_oov_rate, 4)
+        )
         
         return feature_matrix
     
-    def get_match_reasons(self, user_data, user_idx, candidate_idx):
-        """Calcula razones del match basadas SOLO en Skills + Objectives"""
+    @staticmethod
+    def _sparsity(matrix):
+        """Porcentaje de ceros de una matriz dispersa, sin densificarla"""
+        total = matrix.shape[0] * matrix.shape[1]
+        if total == 0:
+            return 100.0
+        return (1 - matrix.nnz / total) * 100
+    
+    def transform_features(self, features):
+        """
+        Proyecta features con los vectorizadores YA entrenados (sin re-fit)
+        
+        Devuelve filas CSR con los mismos pesos y normalización que
+        create_feature_matrix, listas para reemplazar filas de la matriz.
+        """
+        blocks = [
+            self.tfidf_skills.transform([f['skills_technical_text'] for f in features])
+            * self.feature_weights['skills_technical'],
+            self.tfidf_interests.transform([f['skills_interests_text'] for f in features])
+            * self.feature_weights['skills_interests'],
+            self.tfidf_objectives.transform([f['objectives_text'] for f in features])
+            * self.feature_weights['objectives'],
+        ]
+        return normalize(sp.hstack(blocks, format='csr'), norm='l2', axis=1, copy=False)
+    
+    def vocabulary_coverage(self, feature_dict):
+        """
+        Cuenta tokens fuera del vocabulario entrenado para medir drift
+        
+        Returns:
+            (tokens_desconocidos, tokens_totales)
+        """
+        unknown = 0
+        total = 0
+        for vectorizer, column in zip(
+            (self.tfidf_skills, self.tfidf_interests, self.tfidf_objectives), TEXT_COLUMNS
+        ):
+            tokens = vectorizer.build_analyzer()(feature_dict[column])
+            total += len(tokens)
+            unknown += sum(1 for token in tokens if token not in vectorizer.vocabulary_)
+        return unknown, total
+    
+    def _oov_rate(self, features):
+        """Proporción de tokens fuera de vocabulario en un conjunto de features"""
+        unknown = 0
+        total = 0
+        for feature_dict in features:
+            feature_unknown, feature_total = self.vocabulary_coverage(feature_dict)
+            unknown += feature_unknown
+            total += feature_total
+        return unknown / total if total else 0.0
+    
+    @staticmethod
+    def match_tokens(user):
+        """Conjuntos (technical, interests, objectives) precomputados en el entrenamiento"""
+        try:
+            skills = user.get('skills') or {}
+            objectives = user.get('objectives') or {}
+            return (
+                frozenset(skills.get('technical') or []),
+                frozenset(skills.get('interests') or []),
+                frozenset(objectives.get('primary') or []),
+            )
+        except Exception as e:
+            logger.warning("⚠️ Error indexando tokens de %s: %s", user.get('user_id', 'unknown'), e)
+            return (frozenset(), frozenset(), frozenset())
+    
+    def get_match_reasons(self, user_tokens, candidate_tokens, candidate_profile):
+        """Calcula razones del match basadas SOLO en Skills + Objectives (sobre tokens precomputados)"""
         try:
-            user = user_data.iloc[user_idx]
-            candidate = user_data.iloc[candidate_idx]
+            user_technical, user_interests, user_objectives = user_tokens
+            candidate_technical, candidate_interests, candidate_objectives = candidate_tokens
             
             reasons = []
             
-            user_technical = set(user.get('skills', {}).get('technical', []))
-            candidate_technical = set(candidate.get('skills', {}).get('technical', []))
             common_technical = user_technical.intersection(candidate_technical)
             
             if common_technical:
                 tech_list = list(common_technical)[:4]
                 reasons.append(f"💻 Technical: {', '.join(tech_list)}")
             
-            user_interests = set(user.get('skills', {}).get('interests', []))
-            candidate_interests = set(candidate.get('skills', {}).get('interests', []))
             common_interests = user_interests.intersection(candidate_interests)
             
             if common_interests:
                 interests_list = list(common_interests)[:3]
                 reasons.append(f"💡 Interests: {', '.join(interests_list)}")
             
-            user_objectives = set(user.get('objectives', {}).get('primary', []))
-            candidate_objectives = set(candidate.get('objectives', {}).get('primary', []))
             common_objectives = user_objectives.intersection(candidate_objectives)
             
             if common_objectives:
                 obj_list = list(common_objectives)[:2]
                 reasons.append(f"🎯 Objectives: {', '.join(obj_list)}")
             
-            candidate_profile = candidate.get('profile', {})
             candidate_semester = candidate_profile.get('semester', 'N/A')
             candidate_university = candidate_profile.get('university', 'N/A')
             
@@ -203,7 +277,7 @@ class FeaturePreprocessor:
             return reasons if reasons else ["✅ Perfil compatible por skills y objetivos"]
             
         except Exception as e:
-            print(f"⚠️ Error calculando razones: {e}")
+            logger.warning("⚠️ Error calculando razones: %s", e)
             return ["✅ Perfil compatible"]
     
     def _get_user_skills(self, user):
@@ -67,7 +67,7 @@ class ModelValidator:
             self.labels = self._generate_synthetic_labels()
         
         # Train/test split
-        split_idx = int(len(self.feature_matrix) * 0.8)
+        split_idx = int(self.feature_matrix.shape[0] * 0.8)
         X_train = self.feature_matrix[:split_idx]
         X_test = self.feature_matrix[split_idx:]
         y_train = self.labels[:split_idx]
@@ -162,7 +162,7 @@ class ModelValidator:
         
         # Para cada usuario, etiquetar si tiene matches de alta calidad
         labels = []
-        for i in range(len(self.feature_matrix)):
+        for i in range(self.feature_matrix.shape[0]):
             # Si tiene al menos 2 vecinos con alta similitud, label=1
             high_sim_neighbors = np.sum(similarities[i] > threshold) - 1  # -1 para excluir a sí mismo
             labels.append(1 if high_sim_neighbors >= 2 else 0)
@@ -0,0 +1,4 @@
+"""
+Benchmarks del servicio ML sobre datos sintéticos
+Ejecutar desde la raíz del repositorio: python -m benchmarks.<nombre>
+"""
@@ -0,0 +1,117 @@
+"""
+Recall@k vs latencia del backend LSH contra la búsqueda exacta (brute)
+
+Para cada tamaño se arma la matriz de features con el preprocesador real
+sobre perfiles sintéticos, se calcula la verdad con CosineIndex y se barre
+la grilla de perillas de LSHIndex: construcción (tablas, bits) y consulta
+(radio de sondeo, tablas consultadas).
+
+El recall cuenta como acierto todo vecino devuelto cuya distancia no supera
+la del k-ésimo vecino exacto: con perfiles sintéticos hay muchos empates y
+comparar ids castigaría elegir otro usuario igual de cercano. Las consultas
+con menos de k candidatos se resuelven exactas: con pocas tablas o muchos
+bits eso infla el recall aunque los buckets no sirvan.
+
+Uso:
+    python -m benchmarks.bench_ann --sizes 10000 100000 --k 100
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import time
+
+import numpy as np
+
+from app.models.index import CosineIndex, LSHIndex
+from app.utils.preprocessing import FeaturePreprocessor
+from .synthetic import generate_users
+
+
+def build_matrix(size, seed):
+    preprocessor = FeaturePreprocessor()
+    features, _ = preprocessor.extract_user_features(generate_users(size, seed=seed))
+    return preprocessor.create_feature_matrix(features)
+
+
+def timed_queries(index, matrix, queries, k):
+    """Vecinos de cada consulta (una por llamada, como get_recommendations) y ms por consulta"""
+    distances, indices = [], []
+    start = time.perf_counter()
+    for row in queries:
+        row_distances, row_indices = index.kneighbors(matrix[row:row + 1], n_neighbors=k)
+        distances.append(row_distances[0])
+        indices.append(row_indices[0])
+    elapsed_ms = (time.perf_counter() - start) / len(queries) * 1000
+    return np.array(distances), np.array(indices), elapsed_ms
+
+
+def recall_at_k(exact_distances, approx_distances, tolerance=1e-9):
+    kth = exact_distances[:, -1:]
+    return float(np.mean(approx_distances <= kth + tolerance))
+
+
+def run(sizes, n_queries, k, tables_grid, bits_grid, radius_grid, seed):
+    logging.getLogger("app").setLevel(logging.WARNING)
+    results = []
+    for size in sizes:
+        matrix = build_matrix(size, seed)
+        queries = np.random.default_rng(seed).choice(matrix.shape[0], size=min(n_queries, matrix.shape[0]), replace=False)
+
+        exact = CosineIndex(n_neighbors=k).fit(matrix)
+        exact_distances, _, brute_ms = timed_queries(exact, matrix, queries, k)
+        print(f"{size:>8} usuarios | brute {brute_ms:.2f} ms/consulta")
+        row = {"users": size, "k": k, "brute_ms": round(brute_ms, 3), "lsh": []}
+
+        for n_tables, n_bits in itertools.product(tables_grid, bits_grid):
+            index = LSHIndex(n_neighbors=k, n_tables=n_tables, n_bits=n_bits, seed=seed)
+            start = time.perf_counter()
+            index.fit(matrix)
+            build_s = time.perf_counter() - start
+
+            # Las perillas de consulta se cambian sobre el mismo índice, sin re-ajustar
+            for radius, query_tables in itertools.product(radius_grid, sorted({max(1, n_tables // 2), n_tables})):
+                index.probe_radius = radius
+                index.query_tables = query_tables
+                approx_distances, _, lsh_ms = timed_queries(index, matrix, queries, k)
+                recall = recall_at_k(exact_distances, approx_distances)
+                row["lsh"].append({
+                    "tables": n_tables,
+                    "bits": n_bits,
+                    "probe_radius": radius,
+                    "query_tables": query_tables,
+                    "build_s": round(build_s, 3),
+                    "query_ms": round(lsh_ms, 3),
+                    "speedup": round(brute_ms / lsh_ms, 2),
+                    "recall": round(recall, 4),
+                })
+                print(
+                    f"{'':>8}          | tablas {n_tables:>2} ({query_tables:>2} consultadas) bits {n_bits:>2} "
+                    f"radio {radius} | build {build_s:.2f}s | {lsh_ms:.2f} ms/consulta "
+                    f"(x{brute_ms / lsh_ms:.1f}) | recall@{k} {recall:.3f}"
+                )
+        results.append(row)
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=200, help="Consultas por tamaño")
+    parser.add_argument("--k", type=int, default=100, help="Vecinos por consulta (MAX_SEARCH_NEIGHBORS)")
+    parser.add_argument("--tables", type=int, nargs="+", default=[16, 32])
+    parser.add_argument("--bits", type=int, nargs="+", default=[10, 12, 14])
+    parser.add_argument("--radius", type=int, nargs="+", default=[0, 1])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", help="Ruta opcional para guardar resultados")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.queries, args.k, args.tables, args.bits, args.radius, args.seed)
+    if args.json_path:
+        with open(args.json_path, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,73 @@
+"""
+Micro-benchmark de distancias: haversine vectorizado vs geopy.geodesic
+
+Mide el tiempo de calcular la distancia del usuario a N candidatos con cada
+backend y el error máximo de haversine respecto al elipsoide.
+
+Uso:
+    python -m benchmarks.bench_distance --candidates 100 1000 10000
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.utils.geo import coordinates_to_radians, geodesic, geodesic_km, haversine_km
+from .synthetic import generate_users
+
+
+def best_of(fn, repeat):
+    """Mejor tiempo (ms) de varias ejecuciones"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings), result
+
+
+def run(candidate_counts, repeat, seed):
+    users = generate_users(max(candidate_counts) + 1, seed=seed)
+    coordinates_rad = coordinates_to_radians([u['profile']['location']['coordinates'] for u in users])
+    origin = coordinates_rad[0]
+
+    results = []
+    for count in candidate_counts:
+        points = coordinates_rad[1:count + 1]
+        row = {"candidates": count}
+
+        row["haversine_ms"], haversine = best_of(lambda: haversine_km(origin, points), repeat)
+        if geodesic is not None:
+            row["geodesic_ms"], exact = best_of(lambda: geodesic_km(origin, points), max(1, repeat // 10))
+            row["max_error_km"] = float(np.max(np.abs(haversine - exact)))
+            row["speedup"] = round(row["geodesic_ms"] / row["haversine_ms"], 1)
+
+        results.append(row)
+        print(
+            f"{count:>7} candidatos | haversine {row['haversine_ms']:.4f} ms"
+            + (
+                f" | geodesic {row['geodesic_ms']:.2f} ms | x{row['speedup']} | error máx {row['max_error_km']:.3f} km"
+                if "geodesic_ms" in row else " | geodesic no disponible (geopy no instalado)"
+            )
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[10, 100, 1000, 10_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", help="Ruta opcional para guardar resultados")
+    args = parser.parse_args()
+
+    results = run(args.candidates, args.repeat, args.seed)
+    if args.json_path:
+        with open(args.json_path, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
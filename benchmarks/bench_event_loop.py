@@ -0,0 +1,136 @@
+"""
+Latencia de /health mientras hay un re-entrenamiento y una ráfaga de
+recomendaciones en curso
+
+Compara el modo "inline" (el matcher corre dentro del event loop, como antes)
+contra el modo "pool" (pools de hilos acotados de app.main). La base de datos
+se reemplaza por usuarios sintéticos en memoria.
+
+Uso:
+    python -m benchmarks.bench_event_loop --users 20000 --burst 200
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import time
+
+import httpx
+import numpy as np
+
+from app import main
+from .synthetic import generate_users
+
+
+async def run_inline(func, *args, **kwargs):
+    """Comportamiento anterior: la llamada bloquea el event loop"""
+    return func(*args, **kwargs)
+
+
+def install_fake_database(users):
+    by_id = {u['user_id']: u for u in users}
+    db_manager = main.matcher.db_manager
+    db_manager.get_active_users = lambda *a, **k: [copy.deepcopy(u) for u in users]
+    db_manager.iter_active_user_batches = lambda batch_size=None: iter([db_manager.get_active_users()])
+    db_manager.get_user_by_id = lambda user_id, active_only=False: copy.deepcopy(by_id.get(user_id))
+    db_manager.get_latest_update = lambda: None
+
+
+async def probe_health(client, stop, interval):
+    """
+    Consulta /health a ritmo fijo y devuelve las latencias en ms
+
+    La latencia se mide desde el instante programado de la sonda, así que
+    incluye el tiempo que el event loop estuvo bloqueado antes de enviarla.
+    """
+    latencies = []
+    scheduled = time.perf_counter()
+    while True:
+        # La sonda pendiente se envía aunque la carga ya haya terminado: es la
+        # que registra un bloqueo del event loop que cubrió toda la carga
+        await client.get("/health")
+        now = time.perf_counter()
+        latencies.append((now - scheduled) * 1000)
+        if stop.is_set():
+            return latencies
+        scheduled = max(scheduled + interval, now)
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+
+
+async def scenario(users, burst, interval, seed):
+    rng = np.random.default_rng(seed)
+    user_ids = [users[i]['user_id'] for i in rng.integers(0, len(users), size=burst)]
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_health(client, stop, interval))
+        await asyncio.sleep(interval * 5)
+
+        start = time.perf_counter()
+        workload = [client.post("/retrain")] + [
+            client.post("/recommendations", json={"user_id": user_id, "use_cache": False})
+            for user_id in user_ids
+        ]
+        responses = await asyncio.gather(*workload)
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        latencies = np.array(await probe)
+
+    return {
+        "workload_s": round(elapsed, 3),
+        "errors": sum(r.status_code != 200 for r in responses),
+        "health_samples": int(latencies.size),
+        "health_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "health_p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "health_max_ms": round(float(latencies.max()), 2),
+    }
+
+
+def run(n_users, burst, interval, seed):
+    users = generate_users(n_users, seed=seed)
+    install_fake_database(users)
+    logging.getLogger("app").setLevel(logging.WARNING)
+    main.matcher.train_model()
+
+    pooled = (main.run_in_matcher, main.run_training)
+    results = {}
+    for mode, (run_matcher, run_training) in {
+        "inline": (run_inline, run_inline),
+        "pool": pooled,
+    }.items():
+        main.run_in_matcher, main.run_training = run_matcher, run_training
+        try:
+            results[mode] = asyncio.run(scenario(users, burst, interval, seed))
+        finally:
+            main.run_in_matcher, main.run_training = pooled
+
+        row = results[mode]
+        print(
+            f"{mode:>6} | carga {row['workload_s']:.2f}s | /health "
+            f"p50 {row['health_p50_ms']:.1f} ms | p95 {row['health_p95_ms']:.1f} ms | "
+            f"máx {row['health_max_ms']:.1f} ms | muestras {row['health_samples']}"
+        )
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--burst", type=int, default=200, help="Requests de recomendaciones concurrentes")
+    parser.add_argument("--interval", type=float, default=0.01, help="Segundos entre sondas de /health")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", help="Ruta opcional para guardar resultados")
+    args = parser.parse_args()
+
+    results = run(args.users, args.burst, args.interval, args.seed)
+    if args.json_path:
+        with open(args.json_path, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
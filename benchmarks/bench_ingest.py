@@ -0,0 +1,106 @@
+"""
+Ingesta de usuarios para entrenar: lista completa vs lotes del cursor
+
+"list" reproduce el camino anterior: list(aggregate) → extract_user_features
+→ create_feature_matrix (textos dentro de cada feature_dict) → metadata.
+"stream" usa iter_active_user_batches + ingest_users + fit_text_columns.
+
+Corre sobre EncodedCollection (documentos en BSON decodificados uno a uno),
+así el pico de memoria medido con tracemalloc incluye materializar (o no)
+todo el resultado.
+
+Uso:
+    python -m benchmarks.bench_ingest --users 100000 --batch-size 2000
+"""
+
+import argparse
+import gc
+import json
+import logging
+import time
+import tracemalloc
+
+from app.models.ingest import ingest_users
+from app.models.snapshot import build_metadata_arrays
+from app.utils.database import DatabaseManager
+from app.utils.preprocessing import FeaturePreprocessor
+from .fake_collection import EncodedCollection
+from .synthetic import generate_users
+
+
+def ingest_list(db_manager):
+    users_data = db_manager.get_active_users()
+    preprocessor = FeaturePreprocessor()
+    features, users = preprocessor.extract_user_features(users_data)
+    matrix = preprocessor.create_feature_matrix(features)
+    metadata = build_metadata_arrays(features)
+    match_tokens = tuple(preprocessor.match_tokens(user) for user in users)
+    return features, users, matrix, metadata, match_tokens
+
+
+def ingest_stream(db_manager, batch_size):
+    preprocessor = FeaturePreprocessor()
+    columns = ingest_users(preprocessor, db_manager.iter_active_user_batches(batch_size))
+    matrix = preprocessor.fit_text_columns(*columns.texts)
+    return columns.features, columns.users, matrix, columns.metadata, tuple(columns.match_tokens)
+
+
+def measure(func, *args):
+    """Tiempo en una corrida sin trazar (tracemalloc la haría más lenta) y memoria en otra"""
+    gc.collect()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        "seconds": round(elapsed, 3),
+        "peak_mb": round(peak / 2**20, 1),
+        "retained_mb": round(retained / 2**20, 1),
+    }
+
+
+def run(n_users, batch_size, seed):
+    logging.getLogger("app").setLevel(logging.WARNING)
+    db_manager = DatabaseManager(collection=EncodedCollection(generate_users(n_users, seed=seed)))
+
+    results = {}
+    outputs = {}
+    for mode, func, args in (
+        ("list", ingest_list, (db_manager,)),
+        ("stream", ingest_stream, (db_manager, batch_size)),
+    ):
+        outputs[mode], results[mode] = measure(func, *args)
+        row = results[mode]
+        print(
+            f"{mode:>6} | {row['seconds']:.2f}s | pico {row['peak_mb']:.1f} MB | "
+            f"retenido {row['retained_mb']:.1f} MB"
+        )
+        outputs[mode] = outputs[mode][2]  # solo la matriz para comparar
+
+    diff = abs(outputs["list"] - outputs["stream"]).max()
+    results["max_abs_matrix_diff"] = float(diff)
+    print(f"máx. diferencia entre matrices: {diff:.2e}")
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", help="Ruta opcional para guardar resultados")
+    args = parser.parse_args()
+
+    results = run(args.users, args.batch_size, args.seed)
+    if args.json_path:
+        with open(args.json_path, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,125 @@
+"""
+Compara la matriz de features densa (toarray + np.hstack) contra la CSR
+
+Mide memoria (tamaño final y pico durante la construcción), tiempo de
+construcción, NearestNeighbors.fit y latencia de kneighbors coseno.
+
+Uso:
+    python -m benchmarks.bench_sparse_matrix --sizes 10000 100000 500000
+"""
+
+import argparse
+import json
+import logging
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import normalize
+
+from app.config.settings import settings
+from app.utils.preprocessing import FeaturePreprocessor
+from .synthetic import generate_users
+
+
+def matrix_nbytes(matrix):
+    """Bytes ocupados por una matriz densa o CSR"""
+    if hasattr(matrix, "nnz"):
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    return matrix.nbytes
+
+
+def dense_feature_matrix(preprocessor, features):
+    """Ruta densa anterior: cada bloque TF-IDF se densifica antes de unirlo"""
+    tfidf_interests = TfidfVectorizer(
+        max_features=50,
+        lowercase=True,
+        strip_accents='unicode',
+        min_df=1,
+        max_df=0.95,
+        sublinear_tf=True
+    )
+    blocks = [
+        (preprocessor.tfidf_skills, 'skills_technical_text', 'skills_technical'),
+        (tfidf_interests, 'skills_interests_text', 'skills_interests'),
+        (preprocessor.tfidf_objectives, 'objectives_text', 'objectives'),
+    ]
+    weighted = [
+        vectorizer.fit_transform([f[column] for f in features]).toarray() * preprocessor.feature_weights[weight]
+        for vectorizer, column, weight in blocks
+    ]
+    return normalize(np.hstack(weighted), norm='l2', axis=1)
+
+
+def measure(build, queries, k):
+    """Construye la matriz midiendo pico de memoria y tiempos de fit/kneighbors"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    matrix = build()
+    build_s = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    knn = NearestNeighbors(n_neighbors=k, metric=settings.KNN_METRIC, algorithm='brute')
+    start = time.perf_counter()
+    knn.fit(matrix)
+    fit_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for row in queries:
+        knn.kneighbors(matrix[row:row + 1])
+    query_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    return {
+        "matrix_mb": round(matrix_nbytes(matrix) / 1e6, 2),
+        "peak_build_mb": round(peak / 1e6, 2),
+        "build_s": round(build_s, 3),
+        "fit_s": round(fit_s, 4),
+        "kneighbors_ms": round(query_ms, 3),
+    }
+
+
+def run(sizes, n_queries, k, seed):
+    logging.getLogger("app").setLevel(logging.WARNING)
+    results = []
+    for size in sizes:
+        users = generate_users(size, seed=seed)
+        preprocessor = FeaturePreprocessor()
+        features, _ = preprocessor.extract_user_features(users)
+        del users
+
+        queries = np.random.default_rng(seed).integers(0, len(features), size=n_queries)
+
+        sparse = measure(lambda: FeaturePreprocessor().create_feature_matrix(features), queries, k)
+        dense = measure(lambda: dense_feature_matrix(FeaturePreprocessor(), features), queries, k)
+
+        results.append({"users": size, "sparse": sparse, "dense": dense})
+        print(
+            f"{size:>8} usuarios | "
+            f"memoria {dense['matrix_mb']:>9.1f} MB → {sparse['matrix_mb']:>8.1f} MB | "
+            f"pico {dense['peak_build_mb']:>9.1f} MB → {sparse['peak_build_mb']:>8.1f} MB | "
+            f"fit {dense['fit_s']:.4f}s → {sparse['fit_s']:.4f}s | "
+            f"kneighbors {dense['kneighbors_ms']:.2f}ms → {sparse['kneighbors_ms']:.2f}ms"
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 500_000])
+    parser.add_argument("--queries", type=int, default=50, help="Consultas kneighbors por tamaño")
+    parser.add_argument("--k", type=int, default=100, help="Vecinos por consulta")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", help="Ruta opcional para guardar resultados")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.queries, args.k, args.seed)
+    if args.json_path:
+        with open(args.json_path, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
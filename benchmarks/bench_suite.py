@@ -0,0 +1,186 @@
+"""
+Suite de benchmarks de entrenamiento y serving sobre datos sintéticos
+
+Por cada tamaño genera usuarios con semilla fija (synthetic.generate_users,
+la forma que proyecta get_active_users), los sirve desde EncodedCollection
+(sin Mongo) y mide:
+
+    extract_user_features   documentos → features
+    create_feature_matrix   TF-IDF + matriz CSR normalizada
+    train_model             entrenamiento completo del matcher (ingesta incluida)
+    recommendations_cold    get_recommendations con el cache vacío
+    recommendations_warm    los mismos requests otra vez (cache)
+
+Cada etapa registra el tiempo de una corrida sin trazar y el pico de memoria
+de otra corrida con tracemalloc; los requests además p50/p95/media por
+request. --json guarda resultados, versiones y settings relevantes;
+--baseline compara contra un JSON anterior e imprime el cambio por métrica.
+
+Uso:
+    python -m benchmarks.bench_suite --sizes 1000 10000 100000 --json bench.json
+    python -m benchmarks.bench_suite --sizes 1000 10000 --baseline bench.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+import sklearn
+
+from app.config.settings import settings
+from app.models.matcher import AcademicMatcher
+from app.utils.database import DatabaseManager
+from app.utils.preprocessing import FeaturePreprocessor
+from .bench_ingest import measure
+from .fake_collection import EncodedCollection
+from .synthetic import generate_users
+
+# Settings que cambian los números: se guardan junto a los resultados
+RECORDED_SETTINGS = (
+    "KNN_ALGORITHM", "MAX_SEARCH_NEIGHBORS", "SEMESTER_PARTITIONS", "PRECOMPUTE_NEIGHBORS",
+    "NEIGHBOR_TABLE_SIZE", "MONGO_BATCH_SIZE", "DEFAULT_RECOMMENDATION_LIMIT",
+)
+
+
+def latency_stats(latencies_ms):
+    latencies = np.asarray(latencies_ms)
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+    }
+
+
+def timed_requests(matcher, user_ids, limit):
+    latencies = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        matcher.get_recommendations(user_id, limit=limit)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def measure_requests(matcher, user_ids, limit, warm):
+    """Latencias sin trazar y pico de memoria en una pasada aparte; warm = con el cache ya lleno"""
+    def prepare():
+        matcher.clear_cache()
+        if warm:
+            timed_requests(matcher, user_ids, limit)
+
+    prepare()
+    stats = latency_stats(timed_requests(matcher, user_ids, limit))
+
+    prepare()
+    tracemalloc.start()
+    timed_requests(matcher, user_ids, limit)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats["peak_mb"] = round(peak / 2**20, 1)
+    return stats
+
+
+def run_size(n_users, n_queries, limit, seed):
+    collection = EncodedCollection(generate_users(n_users, seed=seed))
+    stages = {}
+
+    def extract():
+        return FeaturePreprocessor().extract_user_features(list(collection.aggregate([])))
+
+    (features, _), stages["extract_user_features"] = measure(extract)
+
+    def create_matrix():
+        return FeaturePreprocessor().create_feature_matrix(features)
+
+    _, stages["create_feature_matrix"] = measure(create_matrix)
+    del features
+
+    matcher = AcademicMatcher()
+    matcher.db_manager = DatabaseManager(collection=collection)
+    _, stages["train_model"] = measure(matcher.train_model)
+
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(matcher.snapshot.user_count, size=min(n_queries, matcher.snapshot.user_count), replace=False)
+    user_ids = [matcher.snapshot.row_user_ids[row] for row in rows]
+    stages["recommendations_cold"] = measure_requests(matcher, user_ids, limit, warm=False)
+    stages["recommendations_warm"] = measure_requests(matcher, user_ids, limit, warm=True)
+    return stages
+
+
+def print_stages(n_users, stages):
+    print(f"{n_users:>8} usuarios")
+    for name, row in stages.items():
+        if "seconds" in row:
+            detail = f"{row['seconds']:.3f}s"
+        else:
+            detail = f"p50 {row['p50_ms']:.2f}ms | p95 {row['p95_ms']:.2f}ms | media {row['mean_ms']:.2f}ms"
+        print(f"    {name:<24} {detail} | pico {row['peak_mb']:.1f} MB")
+
+
+def compare(results, baseline):
+    """Cambio relativo de cada métrica contra un JSON anterior del mismo formato"""
+    previous = {row["users"]: row["stages"] for row in baseline["results"]}
+    print("\nComparación contra baseline (positivo = más lento / más memoria)")
+    for row in results["results"]:
+        old_stages = previous.get(row["users"])
+        if old_stages is None:
+            continue
+        for name, metrics in row["stages"].items():
+            for metric, value in metrics.items():
+                old = old_stages.get(name, {}).get(metric)
+                if metric == "requests" or not old:
+                    continue
+                change = (value - old) / old * 100
+                print(f"{row['users']:>8} {name:<24} {metric:<8} {old:>10} → {value:<10} ({change:+.1f}%)")
+
+
+def run(sizes, n_queries, limit, seed):
+    logging.getLogger("app").setLevel(logging.WARNING)
+    settings.SNAPSHOT_DIR = ""  # medir sin escribir snapshots a disco
+
+    results = {
+        "meta": {
+            "seed": seed,
+            "queries": n_queries,
+            "limit": limit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "sklearn": sklearn.__version__,
+            "settings": {name: getattr(settings, name) for name in RECORDED_SETTINGS},
+        },
+        "results": [],
+    }
+    for n_users in sizes:
+        stages = run_size(n_users, n_queries, limit, seed)
+        print_stages(n_users, stages)
+        results["results"].append({"users": n_users, "stages": stages})
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=200, help="Usuarios consultados por tamaño")
+    parser.add_argument("--limit", type=int, default=10, help="Resultados por página")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", help="Ruta opcional para guardar resultados")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.queries, args.limit, args.seed)
+    if args.json_path:
+        with open(args.json_path, "w") as fh:
+            json.dump(results, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            compare(results, json.load(fh))
+
+
+if __name__ == "__main__":
+    main_cli()
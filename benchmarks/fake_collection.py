@@ -0,0 +1,43 @@
+"""
+Colección falsa para correr el servicio sin Mongo
+
+Guarda los documentos codificados en BSON y los decodifica uno a uno al
+iterar, como llegan del servidor: así los picos de memoria medidos incluyen
+materializar (o no) el resultado completo.
+"""
+
+import bson
+
+
+class EncodedCollection:
+    """
+    Lo que DatabaseManager usa de una colección síncrona
+
+    aggregate() devuelve todos los documentos como los deja el $project de
+    get_active_users (user_id en string); find_one() busca por _id (el resto
+    de los filtros se ignora: todos los documentos sintéticos están activos).
+    """
+
+    def __init__(self, users):
+        self._blobs = []
+        self._positions = {}
+        for user in users:
+            doc = dict(user)
+            doc["_id"] = bson.ObjectId(doc.pop("user_id"))
+            self._positions[doc["_id"]] = len(self._blobs)
+            self._blobs.append(bson.encode(doc))
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def aggregate(self, pipeline, batchSize=None):
+        for blob in self._blobs:
+            doc = bson.decode(blob)
+            doc["user_id"] = str(doc["_id"])  # lo que hace el $project con $toString
+            yield doc
+
+    def find_one(self, filter=None, projection=None, sort=None):
+        position = self._positions.get((filter or {}).get("_id"))
+        if position is None:
+            return None  # incluye la marca de UPDATED_AT_FIELD: los sintéticos no la tienen
+        return bson.decode(self._blobs[position])
@@ -0,0 +1,108 @@
+"""
+Generador reproducible de usuarios sintéticos
+
+Produce documentos con la misma forma que proyecta
+DatabaseManager.get_active_users (skills, objectives y profile con location).
+"""
+
+import numpy as np
+
+TECHNICAL_SKILLS = [
+    "Python", "JavaScript", "TypeScript", "React", "Angular", "Vue", "Node.js",
+    "NestJS", "Django", "FastAPI", "Flask", "Spring Boot", "Java", "Kotlin",
+    "Swift", "Flutter", "Dart", "C", "C++", "C#", ".NET", "Go", "Rust", "PHP",
+    "Laravel", "Ruby", "SQL", "PostgreSQL", "MySQL", "MongoDB", "Redis",
+    "Docker", "Kubernetes", "AWS", "Azure", "GCP", "Linux", "Git", "Machine Learning",
+    "Deep Learning", "Data Science", "Pandas", "NumPy", "TensorFlow", "PyTorch",
+    "Scikit-learn", "Power BI", "Excel", "R", "MATLAB", "Figma", "UX Design",
+    "Unity", "Blender", "Arduino", "IoT", "Ciberseguridad", "Redes", "DevOps",
+    "Testing", "GraphQL", "REST APIs", "Microservicios", "Backend", "Frontend",
+    "Mobile", "DataScience", "Cloud", "Blockchain", "Computer Vision", "NLP",
+]
+
+INTERESTS = [
+    "Inteligencia Artificial", "Desarrollo Web", "Desarrollo Móvil", "Videojuegos",
+    "Emprendimiento", "Investigación", "Robótica", "Startups", "Open Source",
+    "Hackathons", "Competitive Programming", "Diseño", "Fintech", "Edtech",
+    "Healthtech", "Sostenibilidad", "Matemáticas", "Estadística", "Big Data",
+    "Seguridad Informática", "Automatización", "Realidad Virtual", "Música",
+    "Fotografía", "Idiomas", "Docencia", "Liderazgo", "Innovación",
+]
+
+OBJECTIVES = [
+    "Tesis de pregrado", "Paper académico", "Proyecto de curso", "Preparar examen",
+    "Aprender nueva tecnología", "Portafolio personal", "Hackathon", "Startup",
+    "Práctica preprofesional", "Certificación", "Concurso de programación",
+    "Grupo de estudio", "Proyecto open source", "Investigación aplicada",
+]
+
+TIME_AVAILABILITY = ["Mañanas", "Tardes", "Noches", "Fines de semana", "Flexible"]
+UNIVERSITIES = ["UNMSM", "UNI", "PUCP", "UPC", "ULima", "UTEC", "USIL", "UNFV", "UCSUR"]
+FIRST_NAMES = ["Ana", "Luis", "María", "Carlos", "Lucía", "Jorge", "Sofía", "Diego", "Valeria", "Renzo"]
+
+# Centro aproximado de Lima (lon, lat) y dispersión en grados
+_CENTER = np.array([-77.0428, -12.0464])
+_SPREAD = 0.15
+
+
+def _zipf_weights(n, rng, exponent=1.1):
+    """Popularidad tipo Zipf con orden aleatorio para que unos pocos términos dominen"""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def generate_users(n_users, seed=42):
+    """
+    Genera n_users documentos sintéticos deterministas para una semilla dada
+
+    Args:
+        n_users: Cantidad de documentos a generar
+        seed: Semilla del generador aleatorio
+    """
+    rng = np.random.default_rng(seed)
+
+    technical_weights = _zipf_weights(len(TECHNICAL_SKILLS), rng)
+    interests_weights = _zipf_weights(len(INTERESTS), rng)
+    objectives_weights = _zipf_weights(len(OBJECTIVES), rng)
+
+    technical_counts = rng.integers(0, 9, size=n_users)
+    interests_counts = rng.integers(0, 5, size=n_users)
+    objectives_counts = rng.integers(0, 4, size=n_users)
+    semesters = rng.integers(1, 11, size=n_users)
+    ages = np.clip(16 + semesters // 2 + rng.integers(0, 6, size=n_users), 16, 40)
+    coordinates = _CENTER + rng.normal(0, _SPREAD, size=(n_users, 2))
+    time_idx = rng.integers(0, len(TIME_AVAILABILITY), size=n_users)
+    university_idx = rng.integers(0, len(UNIVERSITIES), size=n_users)
+    name_idx = rng.integers(0, len(FIRST_NAMES), size=n_users)
+
+    users = []
+    for i in range(n_users):
+        technical = rng.choice(len(TECHNICAL_SKILLS), size=technical_counts[i], replace=False, p=technical_weights)
+        interests = rng.choice(len(INTERESTS), size=interests_counts[i], replace=False, p=interests_weights)
+        objectives = rng.choice(len(OBJECTIVES), size=objectives_counts[i], replace=False, p=objectives_weights)
+
+        users.append({
+            "_id": f"{i:024x}",
+            "user_id": f"{i:024x}",
+            "skills": {
+                "technical": [TECHNICAL_SKILLS[j] for j in technical],
+                "interests": [INTERESTS[j] for j in interests],
+            },
+            "objectives": {
+                "primary": [OBJECTIVES[j] for j in objectives],
+                "timeAvailability": TIME_AVAILABILITY[time_idx[i]],
+            },
+            "profile": {
+                "firstName": FIRST_NAMES[name_idx[i]],
+                "age": int(ages[i]),
+                "semester": int(semesters[i]),
+                "university": UNIVERSITIES[university_idx[i]],
+                "location": {
+                    "type": "Point",
+                    "coordinates": [float(coordinates[i, 0]), float(coordinates[i, 1])],
+                },
+            },
+        })
+
+    return users
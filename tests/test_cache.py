@@ -0,0 +1,92 @@
+"""
+Contabilidad de bytes de RecommendationCache
+
+    python -m unittest discover -s tests -t .
+"""
+
+import sys
+import unittest
+
+import numpy as np
+
+from app.models.cache import RecommendationCache, estimate_size
+from app.models.matcher import RankedCandidates, RankedSearch, ranked_search_size
+
+
+def ranked_search(n_rows):
+    ranked = RankedCandidates(
+        rows=np.arange(n_rows, dtype=np.int32),
+        scores=np.ones(n_rows, dtype=np.float32),
+        semester_diffs=np.zeros(n_rows, dtype=np.int8)
+    )
+    return RankedSearch(ranked, searched_k=n_rows, complete=True)
+
+
+class EstimateSizeTest(unittest.TestCase):
+
+    def test_owned_array_counts_buffer_once(self):
+        array = np.zeros(5000)
+        self.assertEqual(estimate_size(array), sys.getsizeof(array))
+        self.assertLess(estimate_size(array), 2 * array.nbytes)
+
+    def test_view_counts_viewed_bytes(self):
+        view = np.zeros(5000)[:100]
+        self.assertEqual(estimate_size(view), sys.getsizeof(view) + view.nbytes)
+
+    def test_containers_add_their_items(self):
+        array = np.zeros(100)
+        self.assertEqual(estimate_size([array]), sys.getsizeof([array]) + sys.getsizeof(array))
+        # El mismo objeto dos veces se cuenta una
+        self.assertEqual(estimate_size([array, array]), sys.getsizeof([array, array]) + sys.getsizeof(array))
+
+
+class RankedSearchSizeTest(unittest.TestCase):
+
+    def test_size_is_array_bytes(self):
+        # int32 + float32 + int8 por fila
+        self.assertEqual(ranked_search_size(ranked_search(1000)), 1000 * 9)
+
+
+class CacheBytesTest(unittest.TestCase):
+
+    def test_tracks_bytes_on_put_replace_and_invalidate(self):
+        cache = RecommendationCache(max_entries=10, max_bytes=10**6, sizeof=ranked_search_size)
+        cache.put(("a", 0), ranked_search(100), "a")
+        cache.put(("b", 0), ranked_search(200), "b")
+        self.assertEqual(cache.nbytes, 300 * 9)
+
+        cache.put(("a", 0), ranked_search(50), "a")
+        self.assertEqual(cache.nbytes, 250 * 9)
+
+        cache.invalidate_user("b")
+        self.assertEqual(cache.nbytes, 50 * 9)
+        cache.clear()
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_fills_byte_budget_before_evicting(self):
+        entry_bytes = ranked_search_size(ranked_search(1000))
+        cache = RecommendationCache(max_entries=100, max_bytes=10 * entry_bytes, sizeof=ranked_search_size)
+        for i in range(10):
+            cache.put((str(i), 0), ranked_search(1000), str(i))
+        self.assertEqual((len(cache), cache.evictions), (10, 0))
+
+        cache.put(("10", 0), ranked_search(1000), "10")
+        self.assertEqual((len(cache), cache.evictions), (10, 1))
+        self.assertIsNone(cache.get(("0", 0)))
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+
+    def test_default_sizeof_counts_owned_arrays_once(self):
+        array = np.zeros(5000)
+        cache = RecommendationCache(max_entries=10, max_bytes=3 * sys.getsizeof(array))
+        for i in range(3):
+            cache.put((str(i), 0), np.zeros(5000), str(i))
+        self.assertEqual((len(cache), cache.evictions), (3, 0))
+
+    def test_rejects_value_larger_than_budget(self):
+        cache = RecommendationCache(max_entries=10, max_bytes=100, sizeof=ranked_search_size)
+        cache.put(("a", 0), ranked_search(100), "a")
+        self.assertEqual((len(cache), cache.nbytes), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+"""
+Invalidación del cache de recomendaciones tras upserts
+
+Corre sin Mongo sobre usuarios sintéticos (benchmarks.synthetic) servidos
+desde EncodedCollection:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import copy
+import logging
+import threading
+import unittest
+
+from app.config.settings import settings
+from app.models.matcher import AcademicMatcher
+from app.utils.database import DatabaseManager
+from benchmarks.fake_collection import EncodedCollection
+from benchmarks.synthetic import generate_users
+
+N_USERS = 400
+LIMIT = 20
+
+
+class CacheInvalidationTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger("app").setLevel(logging.WARNING)
+        self._snapshot_dir = settings.SNAPSHOT_DIR
+        settings.SNAPSHOT_DIR = ""  # sin escribir snapshots a disco
+        self.users = generate_users(N_USERS, seed=7)
+        self.matcher = AcademicMatcher()
+        self.matcher.db_manager = DatabaseManager(collection=EncodedCollection(self.users))
+        self.matcher.train_model()
+
+    def tearDown(self):
+        settings.SNAPSHOT_DIR = self._snapshot_dir
+
+    def recommended_ids(self, user_id, use_cache=True):
+        result = self.matcher.get_recommendations(user_id, limit=LIMIT, use_cache=use_cache)
+        return [rec["user_id"] for rec in result["recommendations"]]
+
+    def warm_cache(self):
+        for user in self.users:
+            self.recommended_ids(user["user_id"])
+        self.assertEqual(len(self.matcher.recommendation_cache), N_USERS)
+
+    def assert_cache_matches_fresh_search(self):
+        for user in self.users:
+            self.assertEqual(
+                self.recommended_ids(user["user_id"]),
+                self.recommended_ids(user["user_id"], use_cache=False),
+                f"cache desactualizado para {user['user_id']}"
+            )
+
+    def test_inserted_user_appears_in_cached_recommendations(self):
+        self.warm_cache()
+        twin = copy.deepcopy(self.users[0])
+        twin["user_id"] = f"{N_USERS + 1:024x}"
+        self.matcher.apply_user(twin["user_id"], twin)
+
+        # Mismas features que users[0]: distancia 0, primero en su lista
+        self.assertEqual(self.recommended_ids(self.users[0]["user_id"])[0], twin["user_id"])
+        self.assert_cache_matches_fresh_search()
+
+    def test_updated_user_appears_in_cached_recommendations(self):
+        self.warm_cache()
+        target, moved = self.users[0], self.users[1]
+        updated = copy.deepcopy(target)
+        updated["user_id"] = moved["user_id"]
+        self.matcher.apply_user(moved["user_id"], updated)
+
+        self.assertEqual(self.recommended_ids(target["user_id"])[0], moved["user_id"])
+        self.assert_cache_matches_fresh_search()
+
+    def test_upsert_racing_cache_put_does_not_leave_stale_list(self):
+        target = self.users[0]
+        twin = copy.deepcopy(target)
+        twin["user_id"] = f"{N_USERS + 1:024x}"
+        cache = self.matcher.recommendation_cache
+        put = cache.put
+        upsert = threading.Thread(target=self.matcher.apply_user, args=(twin["user_id"], twin))
+
+        def put_after_upsert(*args, **kwargs):
+            # Otro hilo aplica el upsert justo antes de escribir el cache
+            upsert.start()
+            upsert.join(timeout=0.5)
+            put(*args, **kwargs)
+
+        cache.put = put_after_upsert
+        self.recommended_ids(target["user_id"])
+        upsert.join()
+        cache.put = put
+
+        self.assertEqual(self.recommended_ids(target["user_id"])[0], twin["user_id"])
+
+    def test_upsert_keeps_cache_outside_semester_window(self):
+        self.warm_cache()
+        twin = copy.deepcopy(self.users[0])
+        twin["user_id"] = f"{N_USERS + 1:024x}"
+        twin["profile"]["semester"] = 1
+        self.matcher.apply_user(twin["user_id"], twin)
+
+        # Nadie de semestre 10 puede recibir a alguien de semestre 1
+        far_users = [user["user_id"] for user in self.users if user["profile"]["semester"] == 10]
+        self.assertTrue(far_users)
+        hits = self.matcher.recommendation_cache.hits
+        for user_id in far_users:
+            self.recommended_ids(user_id)
+        self.assertEqual(self.matcher.recommendation_cache.hits - hits, len(far_users))
+
+    def test_removed_user_leaves_cached_recommendations(self):
+        self.warm_cache()
+        removed = self.users[1]
+        self.matcher.apply_user(removed["user_id"], None)
+
+        for user in self.users:
+            if user is removed:
+                continue
+            cached = self.recommended_ids(user["user_id"])
+            self.assertNotIn(removed["user_id"], cached)
+            self.assertEqual(cached, self.recommended_ids(user["user_id"], use_cache=False))
+
+    def test_remove_keeps_cache_outside_semester_window(self):
+        self.warm_cache()
+        removed = next(user for user in self.users if user["profile"]["semester"] == 1)
+        self.matcher.apply_user(removed["user_id"], None)
+
+        far_users = [user["user_id"] for user in self.users if user["profile"]["semester"] == 10]
+        self.assertTrue(far_users)
+        hits = self.matcher.recommendation_cache.hits
+        for user_id in far_users:
+            self.recommended_ids(user_id)
+        self.assertEqual(self.matcher.recommendation_cache.hits - hits, len(far_users))
+
+    def test_insert_reuses_removed_row(self):
+        removed = self.users[1]
+        row = self.matcher.snapshot.user_index[removed["user_id"]]
+        rows = self.matcher.snapshot.user_count
+        self.matcher.apply_user(removed["user_id"], None)
+
+        twin = copy.deepcopy(self.users[0])
+        twin["user_id"] = f"{N_USERS + 1:024x}"
+        self.matcher.apply_user(twin["user_id"], twin)
+
+        snapshot = self.matcher.snapshot
+        self.assertEqual(snapshot.user_index[twin["user_id"]], row)
+        self.assertEqual(snapshot.user_count, rows)
+        self.assertNotIn(removed["user_id"], snapshot.user_index)
+        self.assertEqual(self.recommended_ids(self.users[0]["user_id"])[0], twin["user_id"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Resume tokens del change stream (UserChangeStream)
+
+mongomock no tiene change streams: el stream se simula con eventos
+guionados y se corre _run en el hilo del test.
+
+    python -m unittest discover -s tests -t .
+"""
+
+import logging
+import unittest
+
+from pymongo.errors import OperationFailure
+
+from app.utils.change_stream import UserChangeStream
+
+
+class ScriptedStream:
+    """Cursor de change stream: entrega los eventos y después `end` (excepción o callable)"""
+
+    def __init__(self, events, end):
+        self.events = list(events)
+        self.end = end
+        self.resume_token = None
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def try_next(self):
+        if not self.events:
+            if isinstance(self.end, Exception):
+                raise self.end
+            self.end()
+            return None
+        user_id, token = self.events.pop(0)
+        self.resume_token = token
+        return {"operationType": "update", "documentKey": {"_id": user_id}}
+
+
+class ScriptedDatabase:
+    """watch_user_changes abre los streams en orden y anota con qué token"""
+
+    def __init__(self, streams):
+        self.streams = list(streams)
+        self.opened_with = []
+
+    def watch_user_changes(self, resume_token=None):
+        self.opened_with.append(resume_token)
+        return self.streams.pop(0)
+
+
+class UserChangeStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger("app").setLevel(logging.CRITICAL)
+        self.changes = []
+        self.gaps = 0
+
+    def run_stream(self, streams, on_change=None):
+        database = ScriptedDatabase(streams)
+        self.stream = UserChangeStream(
+            database,
+            on_change=on_change or self.changes.append,
+            on_gap=self.count_gap,
+            retry_seconds=0
+        )
+        self.stream._run()
+        return database
+
+    def count_gap(self):
+        self.gaps += 1
+
+    def stop(self):
+        self.stream._stop.set()
+
+    def test_reopens_from_last_resume_token(self):
+        database = self.run_stream([
+            ScriptedStream([("a", "t1"), ("b", "t2")], ConnectionError("red caída")),
+            ScriptedStream([("c", "t3")], self.stop),
+        ])
+        self.assertEqual(database.opened_with, [None, "t2"])
+        self.assertEqual(self.changes, ["a", "b", "c"])
+        self.assertEqual(self.stream.resume_token, "t3")
+        self.assertEqual(self.gaps, 0)  # con token no se pierde nada
+
+    def test_lost_resume_token_reopens_from_now_and_fills_the_gap(self):
+        database = self.run_stream([
+            ScriptedStream([("a", "t1")], OperationFailure("history lost", code=286)),
+            ScriptedStream([("b", "t9")], self.stop),
+        ])
+        self.assertEqual(database.opened_with, [None, None])
+        self.assertEqual(self.gaps, 1)
+        self.assertEqual(self.changes, ["a", "b"])
+
+    def test_other_failures_keep_the_token(self):
+        database = self.run_stream([
+            ScriptedStream([("a", "t1")], OperationFailure("interrupted", code=11601)),
+            ScriptedStream([], self.stop),
+        ])
+        self.assertEqual(database.opened_with, [None, "t1"])
+        self.assertEqual(self.gaps, 0)
+
+    def test_failed_change_still_advances_the_token(self):
+        def on_change(user_id):
+            self.changes.append(user_id)
+            if user_id == "a":
+                raise RuntimeError("upsert falló")
+
+        database = self.run_stream([
+            ScriptedStream([("a", "t1"), ("b", "t2")], ConnectionError("red caída")),
+            ScriptedStream([], self.stop),
+        ], on_change=on_change)
+        self.assertEqual(self.changes, ["a", "b"])
+        self.assertEqual(database.opened_with, [None, "t2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Paginar una lista cacheada que se profundiza no repite ni saltea usuarios
+
+Recorre las páginas de varios usuarios con cada backend (exacto y LSH),
+con y sin particiones por semestre y con la tabla precomputada:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import logging
+import unittest
+
+from app.config.settings import settings
+from app.models.matcher import AcademicMatcher
+from app.utils.database import DatabaseManager
+from benchmarks.fake_collection import EncodedCollection
+from benchmarks.synthetic import generate_users
+
+N_USERS = 1000
+WALKED_USERS = 15
+LIMIT = 10
+CONFIGURATIONS = [
+    {"KNN_ALGORITHM": algorithm, "SEMESTER_PARTITIONS": partitions, "PRECOMPUTE_NEIGHBORS": table}
+    for algorithm in ("brute", "lsh") for partitions in (True, False) for table in (False, True)
+]
+
+
+class PaginationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.getLogger("app").setLevel(logging.WARNING)
+        cls.users = generate_users(N_USERS, seed=42)
+
+    def setUp(self):
+        names = ["SNAPSHOT_DIR", "NEIGHBOR_TABLE_WORKERS"] + list(CONFIGURATIONS[0])
+        self._settings = {name: getattr(settings, name) for name in names}
+        settings.SNAPSHOT_DIR = ""  # sin escribir snapshots a disco
+        settings.NEIGHBOR_TABLE_WORKERS = 1
+
+    def tearDown(self):
+        for name, value in self._settings.items():
+            setattr(settings, name, value)
+
+    def train(self, configuration):
+        for name, value in configuration.items():
+            setattr(settings, name, value)
+        matcher = AcademicMatcher()
+        matcher.db_manager = DatabaseManager(collection=EncodedCollection(self.users))
+        matcher.train_model()
+        return matcher
+
+    @staticmethod
+    def walk_pages(matcher, user_id):
+        served, page = [], 1
+        while True:
+            result = matcher.get_recommendations(user_id, limit=LIMIT, page=page)
+            served += [rec["user_id"] for rec in result["recommendations"]]
+            if not result["pagination"]["has_next"] or not result["recommendations"]:
+                return served
+            page += 1
+
+    def test_pages_have_no_duplicates_or_gaps(self):
+        for configuration in CONFIGURATIONS:
+            matcher = self.train(configuration)
+            snapshot = matcher.snapshot
+            for row in range(WALKED_USERS):
+                user_id = snapshot.row_user_ids[row]
+                with self.subTest(user_id=user_id, **configuration):
+                    served = self.walk_pages(matcher, user_id)
+                    self.assertEqual(len(served), len(set(served)), "usuarios repetidos entre páginas")
+
+                    # Todos los candidatos que la búsqueda completa acepta salen en alguna página
+                    everything = matcher._ranked_search(snapshot, row, snapshot.user_count)
+                    expected = {snapshot.row_user_ids[candidate] for candidate in everything.ranked.rows}
+                    self.assertTrue(everything.complete)
+                    self.assertEqual(set(served), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+"""
+Snapshots en disco: filas mapeadas, estado de los índices y deltas
+
+Un entrenador guarda el snapshot y después solo agrega deltas; un reader
+que lo carga y re-aplica los deltas tiene que recomendar lo mismo.
+
+    python -m unittest discover -s tests -t .
+"""
+
+import copy
+import logging
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from app.config.settings import settings
+from app.models.index import LSHIndex
+from app.models.matcher import AcademicMatcher
+from app.models.persistence import DELTAS_DIR, read_pointer
+from app.models.rows import PackedRows
+from app.utils.database import DatabaseManager
+from benchmarks.fake_collection import EncodedCollection
+from benchmarks.synthetic import generate_users
+
+N_USERS = 300
+LIMIT = 20
+
+
+class SnapshotDeltasTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger("app").setLevel(logging.WARNING)
+        self._settings = {
+            name: getattr(settings, name) for name in ("SNAPSHOT_DIR", "SNAPSHOT_MAX_DELTAS", "KNN_ALGORITHM")
+        }
+        settings.SNAPSHOT_DIR = tempfile.mkdtemp()
+        self.users = generate_users(N_USERS, seed=11)
+        self.collection = EncodedCollection(self.users)
+
+    def tearDown(self):
+        shutil.rmtree(settings.SNAPSHOT_DIR, ignore_errors=True)
+        for name, value in self._settings.items():
+            setattr(settings, name, value)
+
+    def trainer(self):
+        matcher = AcademicMatcher()
+        matcher.db_manager = DatabaseManager(collection=self.collection)
+        matcher.train_model()
+        return matcher
+
+    def reader(self):
+        matcher = AcademicMatcher()
+        self.assertTrue(matcher.refresh_from_disk())
+        return matcher
+
+    def apply_changes(self, matcher, batch):
+        """Un update, un alta y una baja por tanda"""
+        moved = copy.deepcopy(self.users[batch + 1])
+        moved["user_id"] = self.users[batch]["user_id"]
+        matcher.apply_user(moved["user_id"], moved)
+        twin = copy.deepcopy(self.users[batch + 2])
+        twin["user_id"] = f"{N_USERS + batch + 1:024x}"
+        matcher.apply_user(twin["user_id"], twin)
+        matcher.apply_user(self.users[batch + 3]["user_id"], None)
+
+    @staticmethod
+    def ranking(matcher, user_id):
+        # Los motivos salen de sets: su orden puede cambiar al des-serializarlos
+        result = matcher.get_recommendations(user_id, limit=LIMIT, use_cache=False)
+        return [(rec["user_id"], rec["similarity_score"]) for rec in result["recommendations"]]
+
+    def assert_same_recommendations(self, expected, actual):
+        self.assertEqual(expected.snapshot.revision, actual.snapshot.revision)
+        self.assertEqual(dict(expected.snapshot.user_index), dict(actual.snapshot.user_index))
+        for user_id in expected.snapshot.user_index:
+            self.assertEqual(
+                self.ranking(expected, user_id),
+                self.ranking(actual, user_id),
+                f"recomendaciones distintas para {user_id}"
+            )
+
+    def test_loaded_rows_are_packed(self):
+        trained = self.trainer().snapshot
+        snapshot = self.reader().snapshot
+        self.assertIsInstance(snapshot.user_data.base, PackedRows)
+        self.assertEqual(list(snapshot.user_data), list(trained.user_data))
+        self.assertEqual(list(snapshot.match_tokens), list(trained.match_tokens))
+
+    def test_reader_applies_deltas_without_reloading(self):
+        trainer = self.trainer()
+        source = read_pointer(settings.SNAPSHOT_DIR)
+        reader = self.reader()
+
+        for batch in range(3):
+            self.apply_changes(trainer, batch * 4)
+            self.assertTrue(trainer.persist_pending())
+        self.assertFalse(trainer.persist_pending())
+
+        self.assertEqual(read_pointer(settings.SNAPSHOT_DIR), source)
+        self.assertEqual(len(list((Path(settings.SNAPSHOT_DIR) / source / DELTAS_DIR).iterdir())), 3)
+        self.assertTrue(reader.refresh_from_disk())
+        self.assertEqual(reader.snapshot.source, source)
+        self.assertEqual(reader.snapshot.deltas, 3)
+        self.assert_same_recommendations(trainer, reader)
+        self.assert_same_recommendations(trainer, self.reader())
+
+    def test_snapshot_is_rewritten_after_max_deltas(self):
+        settings.SNAPSHOT_MAX_DELTAS = 1
+        trainer = self.trainer()
+        source = read_pointer(settings.SNAPSHOT_DIR)
+
+        self.apply_changes(trainer, 0)
+        self.assertTrue(trainer.persist_pending())
+        self.assertEqual(read_pointer(settings.SNAPSHOT_DIR), source)
+        self.apply_changes(trainer, 4)
+        self.assertTrue(trainer.persist_pending())
+        self.assertNotEqual(read_pointer(settings.SNAPSHOT_DIR), source)
+
+        reader = self.reader()
+        self.assertEqual(reader.snapshot.deltas, 0)
+        self.assert_same_recommendations(trainer, reader)
+
+    def test_lsh_tables_are_restored_not_refit(self):
+        settings.KNN_ALGORITHM = "lsh"
+        trainer = self.trainer()
+        self.apply_changes(trainer, 0)
+        self.assertTrue(trainer.persist_pending())
+
+        with mock.patch.object(LSHIndex, "fit", side_effect=AssertionError("re-ajustado")):
+            reader = self.reader()
+        self.assert_same_recommendations(trainer, reader)
+
+
+if __name__ == "__main__":
+    unittest.main()
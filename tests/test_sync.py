@@ -0,0 +1,116 @@
+"""
+Deltas por marca de tiempo (get_users_changed_since y sync_changes)
+
+Corre contra mongomock: mismas consultas que Mongo, sin servidor.
+
+    python -m unittest discover -s tests -t .
+"""
+
+import logging
+import unittest
+from datetime import datetime, timedelta
+
+import bson
+import mongomock
+
+from app.config.settings import settings
+from app.models.matcher import AcademicMatcher
+from app.utils.database import DatabaseManager
+from benchmarks.synthetic import generate_users
+
+N_USERS = 60
+TRAINED_AT = datetime(2024, 3, 1, 12, 0)
+
+
+class SyncChangesTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger("app").setLevel(logging.WARNING)
+        self._snapshot_dir = settings.SNAPSHOT_DIR
+        settings.SNAPSHOT_DIR = ""  # sin escribir snapshots a disco
+        self.collection = mongomock.MongoClient().db.users
+        self.user_ids = []
+        for i, user in enumerate(generate_users(N_USERS, seed=5)):
+            doc = dict(user)
+            doc["_id"] = bson.ObjectId(doc.pop("user_id"))
+            doc["activity"] = {"profileCompletion": 80}
+            doc[settings.UPDATED_AT_FIELD] = TRAINED_AT - timedelta(minutes=i)
+            self.collection.insert_one(doc)
+            self.user_ids.append(str(doc["_id"]))
+        self.db_manager = DatabaseManager(collection=self.collection)
+        self.matcher = AcademicMatcher()
+        self.matcher.db_manager = self.db_manager
+        self.matcher.train_model()
+
+    def tearDown(self):
+        settings.SNAPSHOT_DIR = self._snapshot_dir
+
+    def touch(self, user_id, updated_at, **fields):
+        self.collection.update_one(
+            {"_id": bson.ObjectId(user_id)},
+            {"$set": {settings.UPDATED_AT_FIELD: updated_at, **fields}}
+        )
+
+    def test_training_sets_watermark_to_latest_update(self):
+        self.assertEqual(self.matcher.snapshot.watermark, TRAINED_AT)
+
+    def test_equal_timestamps_are_redelivered(self):
+        edited_at = TRAINED_AT + timedelta(minutes=5)
+        self.touch(self.user_ids[1], edited_at, **{"profile.semester": 2})
+        result = self.matcher.sync_changes()
+        self.assertEqual(result["applied"], 1)
+        self.assertEqual(self.matcher.snapshot.watermark, edited_at)
+
+        # Escrito después del delta con la misma marca: $gte lo trae igual
+        self.touch(self.user_ids[2], edited_at, **{"profile.semester": 3})
+        changes = self.db_manager.get_users_changed_since(edited_at)
+        self.assertEqual(
+            sorted(user["user_id"] for user in changes["active"]),
+            sorted([self.user_ids[1], self.user_ids[2]])
+        )
+
+        result = self.matcher.sync_changes()
+        # users[1] vuelve a llegar pero no cambió: no se re-aplica
+        self.assertEqual((result["changed"], result["applied"]), (2, 1))
+        snapshot = self.matcher.snapshot
+        self.assertEqual(snapshot.semesters[snapshot.user_index[self.user_ids[1]]], 2)
+        self.assertEqual(snapshot.semesters[snapshot.user_index[self.user_ids[2]]], 3)
+
+    def test_deactivated_user_is_removed(self):
+        user_id = self.user_ids[3]
+        self.touch(user_id, TRAINED_AT + timedelta(minutes=1), **{"activity.profileCompletion": 10})
+
+        changes = self.db_manager.get_users_changed_since(TRAINED_AT + timedelta(minutes=1))
+        self.assertEqual((changes["active"], changes["inactive_ids"]), ([], [user_id]))
+
+        result = self.matcher.sync_changes()
+        self.assertEqual(result["applied"], 1)
+        snapshot = self.matcher.snapshot
+        self.assertNotIn(user_id, snapshot.user_index)
+        self.assertEqual(snapshot.active_users, N_USERS - 1)
+        for other_id in self.user_ids[:10]:
+            if other_id == user_id:
+                continue
+            recommendations = self.matcher.get_recommendations(other_id, limit=N_USERS, use_cache=False)
+            self.assertNotIn(user_id, [rec["user_id"] for rec in recommendations["recommendations"]])
+
+        # Un segundo delta lo vuelve a ver inactivo: no hay nada que eliminar
+        self.assertEqual(self.matcher.sync_changes()["applied"], 0)
+
+    def test_watermark_advances_to_latest_change(self):
+        first, second = TRAINED_AT + timedelta(minutes=1), TRAINED_AT + timedelta(minutes=7)
+        self.touch(self.user_ids[4], first, **{"profile.age": 30})
+        self.touch(self.user_ids[5], second, **{"profile.age": 31})
+
+        self.matcher.sync_changes()
+        self.assertEqual(self.matcher.snapshot.watermark, second)
+        changes = self.db_manager.get_users_changed_since(self.matcher.snapshot.watermark)
+        self.assertEqual([user["user_id"] for user in changes["active"]], [self.user_ids[5]])
+
+        # Sin cambios la marca queda donde estaba
+        self.assertEqual(self.matcher.sync_changes()["applied"], 0)
+        self.assertEqual(self.matcher.snapshot.watermark, second)
+
+
+if __name__ == "__main__":
+    unittest.main()